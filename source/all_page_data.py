@@ -19,6 +19,7 @@ all_page_titles = OrderedDict([
     ('Methamphetamine', 'methamphetamine.html'),
     ('Norepinephrine (NE)', 'norepinephrine.html'),
     ('Receptor', 'receptor.html'),
+    ('Search', 'search.html'),
     ('Serotonin (5-HT)', 'serotonin.html'),
     ('SSRIs (Selective Serotonin Reuptake Inhibitors)', 'ssris.html'),
     ('Sudden Cardiac Death', 'sudden_cardiac_death.html'),
@@ -109,6 +110,7 @@ all_page_aliases = OrderedDict([
     ('noradrenaline', 'norepinephrine.html'),
     ('receptor', 'receptor.html'),
     ('receptors', 'receptor.html'),
+    ('search', 'search.html'),
     ('serotonin (5-ht)', 'serotonin.html'),
     ('serotonin', 'serotonin.html'),
     ('5-ht', 'serotonin.html'),
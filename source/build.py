@@ -4,18 +4,35 @@
 # the templates and outputs static HTML to the 'build' directory.
 
 import argparse
+import multiprocessing
 import textwrap
 import os
 import sys
 import re
+import time
+import traceback
 from collections import OrderedDict
 
 import django
 import django.template
 Context = django.template.Context
+from django.template.base import tag_re
+from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
 
 from dehr_helpers import *
+import dehr_fuzzy
+import dehr_index
+import dehr_layout
+import dehr_links
+import dehr_manifest
+import dehr_output
+import dehr_parse_cache
 import dehr_parser
+import dehr_profile
+import dehr_search
+import dehr_template_tags
+import dehr_watch
 
 
 class BuildError(DehrError):
@@ -28,6 +45,14 @@ source_dir_path = os.path.dirname(build_file_path)  # Chops off '/build.py'
 BASE_DIR = os.path.dirname(source_dir_path)         # Chops off '/source'
 # BASE_DIR == '/Users/zakf/progs/dehr'
 
+# The alias index in the source directory, see AllPageData.save_next():
+INDEX_FILENAME = 'all_page_data.idx'
+
+# The reports of --profile, in the source directory, see 
+# dehr_profile.BuildProfile.save():
+PROFILE_FILENAME = 'build_profile.json'
+TRACE_FILENAME = 'build_trace.json'
+
 
 #======================== Command Line Argument Parser ========================#
 
@@ -42,6 +67,40 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument('-b', '--build-all', action='store_true', 
                     help="Build the website")
+parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N', 
+                    help="Compile the pages in N worker processes")
+parser.add_argument('-i', '--incremental', action='store_true', 
+                    help="Only compile pages whose inputs changed since the "
+                         "last build, see build_manifest.json")
+parser.add_argument('-s', '--single-pass', action='store_true', 
+                    help="Index the titles and aliases of every page before "
+                         "compiling, instead of using all_page_data.py")
+parser.add_argument('--no-parse-cache', action='store_true', 
+                    help="Lex and parse every compiled page, instead of "
+                         "using the parsed pages in source/%s" % 
+                         dehr_parse_cache.PARSE_CACHE_DIRNAME)
+parser.add_argument('--no-search-index', action='store_true', 
+                    help="Do not write the full-text search index to "
+                         "build/%s" % dehr_search.SEARCH_DIRNAME)
+parser.add_argument('--no-fast-path', action='store_true', 
+                    help="Render every page with Django, even a page whose "
+                         "body has no template syntax")
+parser.add_argument('-p', '--profile', action='store_true', 
+                    help="Time every phase of every page, save %s and %s "
+                         "(a Chrome trace), and print the slowest pages" % 
+                         (PROFILE_FILENAME, TRACE_FILENAME))
+parser.add_argument('--top', type=int, default=10, metavar='N', 
+                    help="The number of slowest pages that --profile prints")
+parser.add_argument('-c', '--check', action='store_true', 
+                    help="Check every page source for forbidden characters, "
+                         "syntax errors, and template syntax errors, in -j N "
+                         "worker processes, without building. Every problem "
+                         "is printed")
+parser.add_argument('-w', '--watch', action='store_true', 
+                    help="Build, then serve the build directory and rebuild "
+                         "the pages that change until Ctrl-C")
+parser.add_argument('--port', type=int, default=8000, 
+                    help="The HTTP port for --watch, the default is 8000")
 
 
 #============================= Core Functionality =============================#
@@ -91,6 +150,19 @@ def make_engine(base_dir):
     engine = django.template.Engine(
         dirs = [templates_dir],
         debug = True,
+        loaders = [
+            # The cached Loader compiles each template file (base.html, 
+            # base_base.html, metadata_line.html, ...) only ONCE per Engine, 
+            # every later get_template(), {% extends %}, and {% include %} 
+            # reuses the compiled Template object.
+            
+            # 
+            # RecordingLoader is the cached Loader, but it can also list 
+            # the templates that one page used, see compile_page_entry().
+            
+            ('dehr_manifest.RecordingLoader', [
+                'django.template.loaders.filesystem.Loader']),
+        ],
         libraries = {
             # Libraries mentioned here are accessible to the {% load %} tag, 
             # but they are NOT loaded automatically. The key on the left is 
@@ -228,8 +300,8 @@ class AllPageData(object):
                         
                         We do NOT have duplicates, there is exactly one entry for each page. Every value is unique.
         
-        prior.aliases:  OrderedDict, many-to-one map from aliases to page 
-                        filenames. This is used by the {% link %} tag during lookups. See example below.
+        prior.aliases:  OrderedDict or dehr_index.AliasIndex, many-to-one 
+                        map from aliases to page filenames. This is used by the {% link %} tag during lookups. See example below.
                         
                         We FORCE LOWERCASE in the keys. Thus, "Lexapro" may not appear as a key, it must be "lexapro". This is to facilitate lookups.
                         
@@ -239,6 +311,11 @@ class AllPageData(object):
                         rendering. Next time build.py runs, this will be used as prior.titles.
         
         next.aliases:   Similar to prior.aliases.
+        
+        lookups:        Dict or None. Iff not None, find_url() records 
+                        every lowercase alias it looks up, and the page filename it found (None iff the lookup failed). See dehr_manifest.PageEntry.
+        
+        titles_used:    Boolean, True iff get_titles() was called.
     
     Examples:
         
@@ -263,28 +340,54 @@ class AllPageData(object):
     def __init__(self):
         self.prior = AllPageDataPart(False)
         self.next = AllPageDataPart(False)
+        self.lookups = None
+        self.titles_used = False
     
     def save_next(self, base_dir):
-        """Create the file all_page_data.py using self.next"""
-        next_str = self.next_to_str('all_page')
+        """Create the files all_page_data.py and all_page_data.idx
+        
+        all_page_data.py is the human-readable export of self.next, it is kept in git. all_page_data.idx is the same data as a dehr_index alias index, which load_prior() reads much faster.
+        
+        """
+        
+        o = ["# File: all_page_data.py\n# \n"]
+        o.append("# This file was written by AllPageData.save_next().")
+        o.append("\n\n")
+        o.append(self.next_to_str('all_page'))
+        apd_str = ''.join(o)
         apd_filepath = os.path.join(base_dir, 'source', 'all_page_data.py')
         apd_file = open(apd_filepath, 'wb')
-        apd_file.write("# File: all_page_data.py\n# \n")
-        apd_file.write("# This file was written by AllPageData.save_next().")
-        apd_file.write("\n\n")
-        apd_file.write(next_str)
+        apd_file.write(apd_str)
         apd_file.close()
+        dehr_index.write_index(os.path.join(base_dir, 'source', INDEX_FILENAME), 
+                               self.next, dehr_index.text_hash(apd_str))
         print "Saved the AllPageData.next object to all_page_data.py."
     
     def load_prior(self, base_dir):
-        """Populate self using the all_page_data.py file"""
+        """Populate self.prior from all_page_data.idx or all_page_data.py
+        
+        The alias index is only used iff it was written together with the current all_page_data.py. Otherwise, e.g. after all_page_data.py was changed by git, all_page_data.py is parsed (NOT executed) with dehr_index.parse_py_export().
+        
+        """
+        
         apd_filepath = os.path.join(base_dir, 'source', 'all_page_data.py')
         apd_file = open(apd_filepath, 'rb')
         apd_str = apd_file.read()
         apd_file.close()
-        exec(apd_str)
-        self.prior.titles = all_page_titles
-        self.prior.aliases = all_page_aliases
+        
+        index_filepath = os.path.join(base_dir, 'source', INDEX_FILENAME)
+        index = None
+        if os.path.exists(index_filepath):
+            try:
+                index = dehr_index.AliasIndex(index_filepath)
+            except dehr_index.AliasIndexError:
+                pass
+        if index != None and index.source_hash == dehr_index.text_hash(apd_str):
+            self.prior.titles = index.titles
+            self.prior.aliases = index
+        else:
+            self.prior.titles, self.prior.aliases = (
+                dehr_index.parse_py_export(apd_str))
         self.prior.read_only = True
     
     def add_title(self, title, page_filename):
@@ -294,8 +397,21 @@ class AllPageData(object):
         self.next.add_alias(alt_name, page_filename)
     
     def get_titles(self):
+        self.titles_used = True
         return self.prior.get_titles()
     
+    def merge_next(self, entry):
+        """Add the titles and aliases of one page to self.next
+        
+        The argument entry is a dehr_manifest.PageEntry. Merging the entries in page order gives exactly the same self.next as compiling the pages in that order.
+        
+        """
+        
+        for title, page_filename in entry.titles:
+            self.next.add_title(title, page_filename)
+        for alt_name, page_filename in entry.aliases:
+            self.next.add_alias(alt_name, page_filename)
+    
     def find_url(self, alt_name):
         """This will be used by the {% link %} custom template tag
         
@@ -309,6 +425,8 @@ class AllPageData(object):
         
         alt_name_lowercase = alt_name.lower()
         page_filename = self.prior.aliases.get(alt_name_lowercase, None)
+        if self.lookups != None:
+            self.lookups[alt_name_lowercase] = page_filename
         if page_filename == None:
             # The alias alt_name is NOT in the list, lookup failed.
             raise UrlLookupError(
@@ -325,148 +443,1444 @@ class AllPageData(object):
         return ''.join(o)
 
 
-def compile_one_page(base_dir, engine, apd, page_filename):
-    """Compile and save one HTML file
+LAYOUT_TEMPLATE = 'base.html'
+
+# The "What links here" list at the end of a page, it is rendered on its own 
+# and passed to the layout as backlinks_section, see PageRenderer:
+BACKLINKS_TEMPLATE = 'backlinks.html'
+
+# Page bodies are compiled on their own, so they do not inherit the 
+# {% load %} at the top of base.html. This line gives them the same tags:
+BODY_TEMPLATE_HEADER = '{% load dehr_template_tags %}'
+
+def compile_page_body(engine, content, apd=None):
+    """Compile the body of one page as a small Template of its own
+    
+    The page body may contain Django template syntax, e.g. {% link %}. It is rendered first, and the result is passed to the layout template base.html as the context variable page_content. The layout itself comes from the cached Loader, see make_engine(), so it is compiled only once per build.
     
     Arguments:
-        base_dir:       String, usually BASE_DIR, e.g. "/Users/zakf/progs/dehr".
+        engine:     django.template.Engine object.
         
-        engine:         django.template.Engine object.
-        
-        apd:            AllPageData object.
+        content:    String, WholePageNode.content.
         
-        page_filename:  String, e.g. "lexapro.html".
+        apd:        AllPageData object of the page, or None. Iff not None, 
+                    the tags with only literal arguments are expanded before Django parses the body, see dehr_template_tags.expand_static_tags().
     
-    TODO:
-    Make this function more customizable. Currently, it only handles the template_file 'base.html' and it only handles the template context variables page_title and page_content. In the future, there might be a version where the template_file is 'one_drug.html' and the context variables include generic_names and brand_names and other stuff like that.
+    Returns:
+        A django.template.Template object.
     
     """
     
-    if page_filename[:8] == 'example_':
-        return None
+    if apd != None:
+        content = dehr_template_tags.expand_static_tags(content, apd)
+    return engine.from_string(BODY_TEMPLATE_HEADER + content)
+
+
+# While the layout template is rendered, page_content is this marker. The 
+# layout is split at the marker, and the page body is streamed in between, see 
+# write_page().
+PAGE_CONTENT_MARKER = u'\x00dehr page_content\x00'
+
+class TextBody(object):
+    """A page body with no template syntax, it is its own rendered output
+    
+    It takes the place of the django.template.Template of compile_page_body(), see PageRenderer.compile_body() and write_page().
+    
+    Attributes:
+        text:       Unicode string, the body after 
+                    dehr_template_tags.expand_static_tags().
+    
+    """
+    
+    def __init__(self, text):
+        self.text = text
+    
+    def render(self, context):
+        return mark_safe(self.text)
+
+def iter_template(template, context):
+    """Render a django.template.Template, yielding the output bit by bit
+    
+    This is Template.render() from Django 1.9, but the output of each top-level node of the template is yielded as soon as it is rendered, instead of joining the output of every node into one string. Each yielded string is the force_text() of one node.
+    
+    """
+    
+    context.render_context.push()
+    try:
+        if context.template is None:
+            with context.bind_template(template):
+                context.template_name = template.name
+                for node in template.nodelist:
+                    yield force_text(node.render_annotated(context))
+        else:
+            for node in template.nodelist:
+                yield force_text(node.render_annotated(context))
+    finally:
+        context.render_context.pop()
+
+
+def write_page(out_file, layout_template, body_template, context_object, 
+               layout=None):
+    """Render a page and write it to out_file, without building the whole page
+    
+    The layout is rendered with the PAGE_CONTENT_MARKER as page_content, and the output of body_template is written in place of the marker, one top-level node at a time. The result is byte-identical to rendering body_template as page_content and then rendering layout_template, but neither the rendered body nor the whole rendered page is ever held in memory.
+    
+    Iff the layout does not output page_content exactly once, e.g. a layout that does not show it, the page is rendered the old way instead.
+    
+    Arguments:
+        out_file:           File object, opened for writing.
+        
+        layout_template:    django.template.Template object, e.g. base.html.
+        
+        body_template:      django.template.Template object, see 
+                            compile_page_body(), or a TextBody object.
+        
+        context_object:     django.template.Context object, WITHOUT 
+                            page_content.
+        
+        layout:             Unicode string, the layout already rendered with 
+                            the PAGE_CONTENT_MARKER, see PageRenderer.render_layout(), or None to render it here.
+    
+    """
+    
+    if layout == None:
+        with context_object.push(page_content=PAGE_CONTENT_MARKER):
+            layout = layout_template.render(context_object)
+    parts = layout.split(PAGE_CONTENT_MARKER)
+    if len(parts) != 2:
+        context_object['page_content'] = body_template.render(context_object)
+        out_file.write(layout_template.render(context_object))
+        return
+    
+    out_file.write(parts[0])
+    if isinstance(body_template, TextBody):
+        out_file.write(body_template.text)
+    else:
+        for fragment in iter_template(body_template, context_object):
+            out_file.write(fragment)
+    out_file.write(parts[1])
+
+
+# A page source may not contain these, see dehr_parser.normalize_source():
+FORBIDDEN_CHARACTERS = '\r\t'
+
+def read_page_source(base_dir, page_filename):
+    """Return the contents of one page source file, and its problems
+    
+    Returns:
+        page_raw:   String, normalized, see dehr_parser.normalize_source().
+        
+        problems:   List of dehr_parser.SourceProblem objects, one per CR or 
+                    hard tab character.
+    
+    """
     
     page_filepathname = os.path.join(base_dir, 'source', 'pages', page_filename)
     page_file = open(page_filepathname, 'rb')
     page_raw = page_file.read()
     page_file.close()
+    return dehr_parser.normalize_source(page_raw, FORBIDDEN_CHARACTERS)
+
+
+def read_page_raw(base_dir, page_filename):
+    """Return the contents of one page source file, as a normalized string
     
-    if '\r' in page_raw:
-        raise BuildError(
-            "The file %s contains CR character(s), which is bad. Fix it." % 
-            page_filename)
+    The file is scanned ONCE, and the lexer does not scan it again, see parse_page_raw(). Every CR and hard tab character is listed in the BuildError, with its line and column.
     
-    if '\t' in page_raw:
+    """
+    
+    page_raw, problems = read_page_source(base_dir, page_filename)
+    if problems:
         raise BuildError(
-            "The file %s contains hard tab character(s), which is bad. "
-            "Please fix it." % page_filename)
-    
-    tokens = dehr_parser.lexer(page_raw)
-    whole_page_node = dehr_parser.WholePageNode(tokens)
-    whole_page_node.parse()
-    whole_page_node.render()
-    wpn = whole_page_node
-    
-    meta_dict = whole_page_node.meta_dict   # An OrderedDict of metadata
-    apd.add_title(wpn.title, page_filename)
-    apd.add_alias(wpn.title, page_filename)
-    if page_filename[-5:] == '.html':
-        apd.add_alias(page_filename[:-5], page_filename)
+            "The file %s contains CR or hard tab character(s), which is bad. "
+            "Fix it." % page_filename, 
+            '\n'.join(str(problem) for problem in problems))
+    return page_raw
+
+
+def parse_page_raw(page_raw, parse_cache=None, timer=dehr_profile.NULL_TIMER):
+    """Return the title, meta_dict, and content of one page source
     
-    page_type = meta_dict.get('Page type', [None])[0]
-    if not page_type:
-        page_type = 'Not specified'
+    They come from parse_cache iff it has the page. Otherwise the page is lexed, parsed, and rendered by dehr_parser, and the result is put in parse_cache.
     
-    def get_str_or_none(key):
-        """Use this for keys which ALWAYS have just one value"""
-        value_list = meta_dict.get(key, [])
-        if len(value_list) == 1:
-            return value_list[0]
-        elif len(value_list) == 0:
-            return None
-        else:
-            raise BuildError(
-                "The meta_dict for the page '%s' is ill-formed. The key "
-                "'%s' should have NO MORE THAN ONE value. It had 2 or "
-                "more values. They are: %r" % 
-                (page_filename, key, value_list))
+    Arguments:
+        page_raw:       String, normalized, see read_page_raw().
+        
+        parse_cache:    dehr_parse_cache.ParseCache object, or None.
+        
+        timer:          dehr_profile.PhaseTimer object.
+    
+    Returns:
+        title:          String, WholePageNode.title.
+        
+        meta_dict:      OrderedDict, WholePageNode.meta_dict.
+        
+        content:        String, WholePageNode.content.
+    
+    """
+    
+    parsed = None
+    if parse_cache != None:
+        with timer.phase('parse cache'):
+            cache_key = parse_cache.key(page_raw)
+            parsed = parse_cache.get(cache_key)
+    if parsed != None:
+        return parsed
+    
+    with timer.phase('lexer'):
+        tokens = dehr_parser.lexer(page_raw, typed=True, normalized=True)
+    wpn = dehr_parser.WholePageNode(tokens)
+    del tokens
+    with timer.phase('parse'):
+        wpn.parse()
+    with timer.phase('render'):
+        wpn.render()
+    title = wpn.title
+    meta_dict = wpn.meta_dict   # An OrderedDict of metadata
+    content = wpn.content
+    # Free the token list and the Node tree:
+    del wpn
+    if parse_cache != None:
+        with timer.phase('parse cache'):
+            parse_cache.put(cache_key, title, meta_dict, content)
+    return title, meta_dict, content
+
+
+def add_page_names(apd, page_filename, title, meta_dict):
+    """Add the title and every alias of one page
+    
+    Arguments:
+        apd:            AllPageData or AllPageDataPart object, anything with 
+                        add_title() and add_alias().
+        
+        title:          String, WholePageNode.title.
+        
+        meta_dict:      OrderedDict, WholePageNode.meta_dict.
     
-    def get_list_or_empty(key):
-        return meta_dict.get(key, [])
+    """
     
-    wikipedia_name = get_str_or_none('Wikipedia name')
+    apd.add_title(title, page_filename)
+    apd.add_alias(title, page_filename)
+    if page_filename[-5:] == '.html':
+        apd.add_alias(page_filename[:-5], page_filename)
     
     ## This 'if' is unnecessary, it fails gracefully:
     # if page_type == 'One drug':
-    brand_names = get_list_or_empty('Brand names')
-    for brand_name in brand_names:
+    for brand_name in meta_dict.get('Brand names', []):
         apd.add_alias(brand_name, page_filename)
-    generic_names = get_list_or_empty('Generic names')
-    for generic_name in generic_names:
+    for generic_name in meta_dict.get('Generic names', []):
         apd.add_alias(generic_name, page_filename)
-    related_names = get_list_or_empty('Related names')
-    for related_name in related_names:
+    for related_name in meta_dict.get('Related names', []):
         apd.add_alias(related_name, page_filename)
     # Hidden names do NOT appear on the final HTML page, but they are useful 
     # for redirects, they ARE seen by {% link %} during lookup.
-    hidden_names = get_list_or_empty('Hidden names')
-    for hidden_name in hidden_names:
+    for hidden_name in meta_dict.get('Hidden names', []):
         apd.add_alias(hidden_name, page_filename)
+
+
+def index_page_names(base_dir, page_filenames):
+    """Index the titles and aliases of every page, WITHOUT compiling them
     
-    neurotransmitters = get_list_or_empty('Neurotransmitters')
+    Only the title and metadata of each page are read and parsed, see dehr_parser.read_page_header(). The result is exactly what compiling every page would put in AllPageData.next, so it can be used as AllPageData.prior, and every {% link %} resolves in the SAME run of build.py.
     
-    if (brand_names or generic_names or neurotransmitters or related_names):
-        has_metadata = True
-    else:
-        has_metadata = False
+    Returns:
+        part:       AllPageDataPart object, read only.
     
-    ## Old method, cannot deal with Django template syntax in the page_file:
-    # base_template = engine.get_template('base.html')
+    """
     
-    templates_dir = os.path.join(base_dir, 'source', 'templates')
-    template_filepathname = os.path.join(templates_dir, 'base.html')
-    template_file = open(template_filepathname, 'rb')
-    template_raw = template_file.read()
-    template_file.close()
+    part = AllPageDataPart(False)
+    for page_filename in page_filenames:
+        if page_filename[:8] == 'example_':
+            continue
+        page_file = open(os.path.join(base_dir, 'source', 'pages', 
+                                      page_filename), 'rb')
+        try:
+            title, meta_dict = dehr_parser.read_page_header(page_file)
+        finally:
+            page_file.close()
+        add_page_names(part, page_filename, title, meta_dict)
+    part.read_only = True
+    return part
+
+
+# The context variables of base.html that are the list of values of one 
+# metadata key, e.g. brand_names is meta_dict['Brand names']:
+META_LIST_VARIABLES = [
+    ('brand_names', 'Brand names'),
+    ('generic_names', 'Generic names'),
+    ('related_names', 'Related names'),
+    ('neurotransmitters', 'Neurotransmitters'),
+    ('mechanisms', 'Mechanisms'),
+    ('drug_class', 'Drug class'),
+    ('medical_uses', 'Medical uses'),
+    ('esoteric_medical_uses', 'Esoteric medical uses'),
+]
+
+# has_metadata is True iff one of these lists is not empty:
+HAS_METADATA_VARIABLES = ['brand_names', 'generic_names', 'related_names', 
+                          'neurotransmitters']
+
+class PageRenderer(object):
+    """Makes the template Context of every page of one build
     
-    # Insert the page_file code into the template_file code:
-    template_str = template_raw.replace(
-        '{{ page_content|safe }}',
-        wpn.content)
+    One PageRenderer is made per build (per worker process with -j), and it is used for every page, see compile_one_page(). What is the same for every page is worked out only once: the list of every title and its URL, which the Index page shows, is looked up the first time an Index page needs it, and then shared by every later Index page. Each page only gets one small dict of its own variables, see page_context().
     
-    template_object = engine.from_string(template_str)
-    context_object = Context({
-        'apd': apd,
-        'page_title': wpn.title,
-        # 'page_content': wpn.content,  # Now I do this manually, see above.
-        'page_type': page_type,
-        'wikipedia_name': wikipedia_name,
-        'has_metadata': has_metadata,
-        'brand_names': brand_names,
-        'generic_names': generic_names,
-        'related_names': related_names,
-        'neurotransmitters': neurotransmitters,
-        'mechanisms': get_list_or_empty('Mechanisms'),
-        'drug_class': get_list_or_empty('Drug class'),
-        'medical_uses': get_list_or_empty('Medical uses'),
-        'esoteric_medical_uses': get_list_or_empty('Esoteric medical uses'),
-    })
+    The AllPageData of each page is NOT shared, it records the {% link %} lookups of that one page for the build manifest.
     
-    if page_type == 'Index':
-        all_pages_list = []
-        for page_title in apd.get_titles():
-            all_pages_list.append([
-                page_title,
-                apd.find_url(page_title)])
-        context_object['all_pages_list'] = all_pages_list
+    The What links here list of each page comes from link_graph, see render_backlinks().
     
-    rendered = template_object.render(context_object)
+    Iff fast_path is True, a page is rendered without Django where that gives the same bytes. A body with no template syntax left after dehr_template_tags.expand_static_tags() is written as it is, see compile_body(). The layout is filled in from a dehr_layout.LayoutSkeleton, one per shape of page context, see render_layout().
+    
+    Attributes:
+        engine:         django.template.Engine object.
+        
+        prior:          AllPageDataPart, the titles and aliases that every 
+                        page links to, usually AllPageData.prior.
+        
+        all_pages_list: List of [title, page_filename], one per title of 
+                        prior, sorted by title. None until an Index page needs it.
+        
+        all_pages_lookups:  Dict, the AllPageData.lookups that were made to 
+                            build all_pages_list. They are added to the lookups of every Index page.
+        
+        fast_path:      Boolean, iff False then every page is rendered by 
+                        Django.
+        
+        link_graph:     dehr_links.LinkGraph object, or None iff no page has 
+                        a What links here list.
+        
+        skeletons:      Dict, (template name, shape) --> 
+                        dehr_layout.LayoutSkeleton, or None iff the template can't be filled in for that shape, see dehr_layout.context_shape().
+        
+        shapes_seen:    Set of the (template name, shape) pairs that were 
+                        rendered by Django once, but have no skeleton yet.
+        
+        fast_pages:     Integer, the number of pages whose body and layout 
+                        were both rendered without Django.
+    
+    """
+    
+    def __init__(self, engine, prior, fast_path=True, link_graph=None):
+        self.engine = engine
+        self.prior = prior
+        self.all_pages_list = None
+        self.all_pages_lookups = None
+        self.fast_path = fast_path
+        self.link_graph = link_graph
+        self.skeletons = {}
+        self.shapes_seen = set()
+        self.fast_pages = 0
+    
+    def get_all_pages_list(self, apd):
+        """Return all_pages_list, and record it as used by the page of apd"""
+        if self.all_pages_list == None:
+            lookup_apd = AllPageData()
+            lookup_apd.prior = self.prior
+            lookup_apd.lookups = {}
+            self.all_pages_list = [[page_title, lookup_apd.find_url(page_title)]
+                                   for page_title in self.prior.get_titles()]
+            self.all_pages_lookups = lookup_apd.lookups
+        apd.titles_used = True
+        if apd.lookups != None:
+            apd.lookups.update(self.all_pages_lookups)
+        return self.all_pages_list
+    
+    def page_context(self, apd, page_filename, title, meta_dict):
+        """Return the django.template.Context of one page, see write_page()"""
+        return Context(self.page_layer(apd, page_filename, title, meta_dict))
+    
+    def page_layer(self, apd, page_filename, title, meta_dict):
+        """Return the dict of the context variables of one page
+        
+        Arguments:
+            apd:            AllPageData object of this page, apd.prior must 
+                            be self.prior.
+            
+            page_filename:  String, e.g. "lexapro.html", for error messages.
+            
+            title:          String, WholePageNode.title.
+            
+            meta_dict:      OrderedDict, WholePageNode.meta_dict.
+        
+        """
+        
+        page_type = meta_dict.get('Page type', [None])[0]
+        if not page_type:
+            page_type = 'Not specified'
+        
+        # 'Wikipedia name' ALWAYS has just one value:
+        wikipedia_names = meta_dict.get('Wikipedia name', [])
+        if len(wikipedia_names) > 1:
+            raise BuildError(
+                "The meta_dict for the page '%s' is ill-formed. The key "
+                "'%s' should have NO MORE THAN ONE value. It had 2 or "
+                "more values. They are: %r" % 
+                (page_filename, 'Wikipedia name', wikipedia_names))
+        
+        page_layer = {
+            'apd': apd,
+            'page_title': title,
+            # 'page_content' is rendered from body_template, see write_page().
+            'page_type': page_type,
+            'wikipedia_name': (wikipedia_names or [None])[0],
+        }
+        for variable, key in META_LIST_VARIABLES:
+            page_layer[variable] = meta_dict.get(key, [])
+        page_layer['has_metadata'] = any(
+            page_layer[variable] for variable in HAS_METADATA_VARIABLES)
+        if page_type == 'Index':
+            page_layer['all_pages_list'] = self.get_all_pages_list(apd)
+        return page_layer
+    
+    def compile_body(self, content, apd):
+        """Return the TextBody or django.template.Template of a page body
+        
+        See compile_page_body() for the arguments.
+        
+        """
+        
+        body = dehr_template_tags.expand_static_tags(content, apd)
+        if self.fast_path and not tag_re.search(body):
+            return TextBody(body)
+        return compile_page_body(self.engine, body)
+    
+    def render_layout(self, layout_template, context_object, page_layer):
+        """Render the layout of a page, with the PAGE_CONTENT_MARKER
+        
+        Arguments:
+            layout_template:    django.template.Template object, base.html.
+            
+            context_object:     django.template.Context object of page_layer.
+            
+            page_layer:         Dict, see page_layer().
+        
+        Returns:
+            layout:     Unicode string, the rendered layout.
+            
+            fast:       Boolean, True iff it came from a skeleton.
+        
+        """
+        
+        return self.render_shaped(layout_template, context_object, page_layer, 
+                                  {'page_content': PAGE_CONTENT_MARKER})
+    
+    def backlinks(self, page_filename):
+        """Return the What links here list of a page, see dehr_links.LinkGraph"""
+        if self.link_graph == None:
+            return []
+        return self.link_graph.backlinks(page_filename)
+    
+    def render_backlinks(self, page_filename):
+        """Render the What links here list of a page, see BACKLINKS_TEMPLATE
+        
+        Returns:
+            section:    Unicode string, empty iff no other page links to it.
+            
+            fast:       Boolean, see render_layout().
+        
+        """
+        
+        backlinks = self.backlinks(page_filename)
+        if not backlinks:
+            return u'', True
+        layer = {'backlinks': backlinks}
+        return self.render_shaped(self.engine.get_template(BACKLINKS_TEMPLATE), 
+                                  Context(layer), layer, {})
+    
+    def render_shaped(self, template, context_object, layer, constants):
+        """Render a template, from the skeleton of its shape iff there is one
+        
+        The first two renders of each shape are done by Django, and the second one also makes the skeleton of its shape, see make_skeleton(). So a shape of only one page, e.g. a page compiled on its own, costs no more than Django. Every later render of that shape is filled into the skeleton, and the templates the skeleton used are recorded for the build manifest as if Django had rendered them.
+        
+        Arguments:
+            template:       django.template.Template object.
+            
+            context_object: django.template.Context object of layer.
+            
+            layer:          Dict, the variables that differ between renders.
+            
+            constants:      Dict, variables that are pushed on context_object 
+                            while it is rendered, the same for every render.
+        
+        Returns:
+            rendered:       Unicode string.
+            
+            fast:           Boolean, True iff it came from a skeleton.
+        
+        """
+        
+        shaped = None
+        if self.fast_path:
+            shaped = dehr_layout.context_shape(layer, ['apd'])
+        if shaped != None:
+            shape, probe_layer, values = shaped
+            key = (template.name, shape)
+            skeleton = self.skeletons.get(key, None)
+            if skeleton != None:
+                loader = self.engine.template_loaders[0]
+                if loader.used != None:
+                    loader.used.update(skeleton.templates)
+                return skeleton.fill(values), True
+        
+        with context_object.push(**constants):
+            rendered = template.render(context_object)
+        if shaped != None and key not in self.skeletons:
+            if key in self.shapes_seen:
+                self.skeletons[key] = self.make_skeleton(
+                    template, probe_layer, values, constants, rendered)
+                self.shapes_seen.discard(key)
+            else:
+                self.shapes_seen.add(key)
+        return rendered, False
+    
+    def make_skeleton(self, template, probe_layer, values, constants, 
+                      rendered):
+        """Return the LayoutSkeleton of one shape, or None iff it can't be used
+        
+        The template is rendered with the probes, and with an AllPageData of its own. The skeleton is only used iff every probe came out whole, the template did not look up a link or the list of titles, and the skeleton filled in with the values of this render is exactly rendered, the output of Django.
+        
+        """
+        
+        probe_apd = AllPageData()
+        probe_apd.prior = self.prior
+        probe_apd.lookups = {}
+        probe_layer = dict(probe_layer, apd=probe_apd, **constants)
+        loader = self.engine.template_loaders[0]
+        used = loader.used
+        loader.start_recording()
+        try:
+            probe_rendered = template.render(Context(probe_layer))
+        finally:
+            templates = loader.stop_recording()
+            loader.used = used
+        skeleton = dehr_layout.LayoutSkeleton(probe_rendered, templates)
+        if (not skeleton.complete or probe_apd.lookups or 
+                probe_apd.titles_used or probe_apd.next.get_titles() or 
+                skeleton.fill(values) != rendered):
+            return None
+        return skeleton
+
+
+def compile_one_page(base_dir, engine, apd, page_filename, 
+                     timer=dehr_profile.NULL_TIMER, parse_cache=None, 
+                     renderer=None, writer=None):
+    """Compile and save one HTML file
     
+    Arguments:
+        base_dir:       String, usually BASE_DIR, e.g. "/Users/zakf/progs/dehr".
+        
+        engine:         django.template.Engine object.
+        
+        apd:            AllPageData object.
+        
+        page_filename:  String, e.g. "lexapro.html".
+        
+        timer:          dehr_profile.PhaseTimer object, it records the time 
+                        of each of dehr_profile.PAGE_PHASES. The default records nothing.
+        
+        parse_cache:    dehr_parse_cache.ParseCache object, or None to always 
+                        lex and parse the page.
+        
+        renderer:       PageRenderer object of apd.prior, shared by every 
+                        page of the build, or None to make one for this page only.
+        
+        writer:         dehr_output.OutputWriter object, shared by every page 
+                        of the build, or None to write the output file right away, even iff it did not change. The result of the page is in writer.results.
+    
+    Returns:
+        out_filepathname:   String, the output file, or None iff this page is 
+                            not compiled. The file may not be written yet, see dehr_output.OutputWriter.finish().
+    
+    TODO:
+    Make this function more customizable. Currently, it only handles the template_file 'base.html' and it only handles the template context variables page_title and page_content. In the future, there might be a version where the template_file is 'one_drug.html' and the context variables include generic_names and brand_names and other stuff like that.
+    
+    """
+    
+    if page_filename[:8] == 'example_':
+        return None
+    
+    with timer.phase('read'):
+        page_raw = read_page_raw(base_dir, page_filename)
+    title, meta_dict, content = parse_page_raw(page_raw, parse_cache, timer)
+    # Free the page source before Django compiles the body:
+    del page_raw
+    
+    add_page_names(apd, page_filename, title, meta_dict)
+    
+    if renderer == None:
+        renderer = PageRenderer(engine, apd.prior)
+    page_layer = renderer.page_layer(apd, page_filename, title, meta_dict)
+    context_object = Context(page_layer)
+    
+    ## Old method, cannot deal with Django template syntax in the page_file:
+    # base_template = engine.get_template('base.html')
+    # 
+    ## Older method, recompiles base.html and base_base.html for every page:
+    # template_str = template_raw.replace(
+    #     '{{ page_content|safe }}',
+    #     wpn.content)
+    # template_object = engine.from_string(template_str)
+    
+    with timer.phase('template compile'):
+        layout_template = engine.get_template(LAYOUT_TEMPLATE)
+        body_template = renderer.compile_body(content, apd)
+    
+    if writer == None:
+        writer = dehr_output.OutputWriter(num_threads=0)
     out_filepathname = os.path.join(base_dir, 'build', page_filename)
-    out_file = open(out_filepathname, 'wb')
-    out_file.write(rendered)
-    out_file.close()
+    out_file = writer.open(page_filename, out_filepathname)
+    try:
+        # The writes are timed apart from the rendering, see PhaseTimer:
+        with timer.phase('django render'):
+            page_layer['backlinks_section'], backlinks_fast = (
+                renderer.render_backlinks(page_filename))
+            layout, fast = renderer.render_layout(layout_template, 
+                                                  context_object, page_layer)
+            write_page(timer.wrap_file(out_file), layout_template, 
+                       body_template, context_object, layout)
+    except:
+        # Don't leave half a page in build/:
+        out_file.discard()
+        raise
+    with timer.phase('write'):
+        out_file.close()
+    if fast and backlinks_fast and isinstance(body_template, TextBody):
+        renderer.fast_pages += 1
     
     print "Compiled %s." % page_filename
+    return out_filepathname
+
+
+def list_page_filenames(base_dir):
+    """Return a sorted list of every page filename, such as lexapro.html"""
+    pages_dir = os.path.join(base_dir, 'source', 'pages')
+    page_filenames = []
+    for page_filename in sorted(os.listdir(pages_dir)):
+        if page_filename[-5:] == '.html':
+            page_filenames.append(page_filename)
+    return page_filenames
+
+
+def compile_page_entry(base_dir, engine, prior, page_filename, profile=False, 
+                       parse_cache=None, renderer=None, writer=None):
+    """Compile one page and record its inputs for the build manifest
+    
+    Arguments:
+        prior:      AllPageDataPart, usually AllPageData.prior.
+        
+        profile:    Boolean, iff True then entry.timing is set, see 
+                    dehr_profile.page_timing().
+        
+        parse_cache:    dehr_parse_cache.ParseCache object or None. Iff not 
+                        None, entry.parse_cache_hit is set.
+        
+        renderer:       PageRenderer object of prior, or None. Iff not None, 
+                        entry.fast_path is set, and entry.backlinks comes from its link_graph.
+        
+        writer:     dehr_output.OutputWriter object, or None, see 
+                    compile_one_page(). entry.output_hash and entry.output_written come from it.
+        
+        The other arguments are the same as for compile_one_page().
+    
+    Returns:
+        entry:      dehr_manifest.PageEntry object.
+    
+    """
+    
+    start = time.time()
+    if profile:
+        timer = dehr_profile.PhaseTimer()
+    else:
+        timer = dehr_profile.NULL_TIMER
+    apd = AllPageData()
+    apd.prior = prior
+    apd.lookups = {}
+    if parse_cache != None:
+        hits = parse_cache.hits
+    if renderer != None:
+        fast_pages = renderer.fast_pages
+    if writer == None:
+        writer = dehr_output.OutputWriter(num_threads=0)
+    loader = engine.template_loaders[0]
+    loader.start_recording()
+    try:
+        out_filepathname = compile_one_page(base_dir, engine, apd, 
+                                            page_filename, timer, parse_cache, 
+                                            renderer, writer)
+    finally:
+        templates = loader.stop_recording()
+    
+    page_filepathname = os.path.join(base_dir, 'source', 'pages', page_filename)
+    stat = os.stat(page_filepathname)
+    entry = dehr_manifest.PageEntry()
+    entry.source_hash = dehr_manifest.file_hash(page_filepathname)
+    entry.source_stat = [stat.st_mtime, stat.st_size]
+    entry.templates = templates
+    entry.lookups = apd.lookups
+    if apd.titles_used:
+        entry.titles_hash = dehr_manifest.titles_hash(prior.get_titles())
+    entry.titles = [list(item) for item in apd.next.titles.items()]
+    entry.aliases = [list(item) for item in apd.next.aliases.items()]
+    entry.output = (out_filepathname != None)
+    if entry.output:
+        entry.output_hash, entry.output_size, entry.output_written = (
+            writer.results.pop(page_filename))
+    if parse_cache != None and entry.output:
+        entry.parse_cache_hit = (parse_cache.hits > hits)
+    if renderer != None and entry.output:
+        entry.fast_path = (renderer.fast_pages > fast_pages)
+        entry.backlinks = renderer.backlinks(page_filename)
+    if profile:
+        entry.timing = dehr_profile.page_timing(
+            page_filename, start, time.time() - start, timer)
+    return entry
+
+
+class BuildReport(object):
+    """What build_all() did
+    
+    Attributes:
+        apd:        AllPageData object, apd.next has every page.
+        
+        compiled:   List of page filenames that were compiled.
+        
+        skipped:    List of page filenames that were up to date.
+        
+        broken_links:   OrderedDict, page filename --> sorted list of the 
+                        lowercase aliases that its {% link %} tags did not find. Only pages with broken links are listed.
+        
+        manifest:   dehr_manifest.BuildManifest object, up to date with 
+                    build/.
+        
+        profile:    dehr_profile.BuildProfile object, or None iff the build 
+                    was not profiled.
+        
+        parse_cache_hits:   Integer, the number of compiled pages that came 
+                            from the parse cache, see dehr_parse_cache.
+        
+        parse_cache_misses: Integer, the number of compiled pages that were 
+                            lexed and parsed.
+        
+        fast_pages:     Integer, the number of compiled pages that were 
+                        rendered without Django, see PageRenderer.
+        
+        unchanged_outputs:  Integer, the number of compiled pages whose output 
+                            was the same as the file in build/, which was left alone, see dehr_output.OutputWriter.
+        
+        link_graph:     dehr_links.LinkGraph object of every page.
+        
+        relinked:       List of page filenames that were compiled again 
+                        because their What links here list changed. The 
+                        parse cache, fast path, and profile of the build count only the first compile of each page.
+    
+    """
+    
+    def __init__(self, apd):
+        self.apd = apd
+        self.compiled = []
+        self.skipped = []
+        self.broken_links = OrderedDict()
+        self.manifest = None
+        self.profile = None
+        self.parse_cache_hits = 0
+        self.parse_cache_misses = 0
+        self.fast_pages = 0
+        self.unchanged_outputs = 0
+        self.link_graph = None
+        self.relinked = []
+
+
+def to_str(value):
+    """The manifest keeps some strings as unicode, see PageEntry.from_json_dict()"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def find_broken_links(entry):
+    """Return the sorted lowercase aliases that a PageEntry did not find"""
+    return sorted(to_str(alias) for alias, found in entry.lookups.items() 
+                  if found == None)
+
+
+def print_broken_links(broken_links, aliases, suggester=None):
+    """Print every broken link of the build in ONE summary, with suggestions
+    
+    Arguments:
+        broken_links:   OrderedDict, see BuildReport.broken_links.
+        
+        aliases:        OrderedDict, every alias of this build, usually 
+                        AllPageData.next.aliases. The dehr_fuzzy.AliasSuggester is built from it once.
+        
+        suggester:      dehr_fuzzy.AliasSuggester of aliases, or None to 
+                        build a new one.
+    
+    """
+    
+    if suggester == None:
+        suggester = dehr_fuzzy.AliasSuggester(aliases)
+    print "Found %s broken link(s):" % sum(
+        len(targets) for targets in broken_links.values())
+    for page_filename, targets in broken_links.items():
+        for target in targets:
+            if target in aliases:
+                hint = ("it exists now, run build.py again or use "
+                        "--single-pass")
+            else:
+                suggestions = suggester.suggest(target)
+                if suggestions:
+                    hint = "did you mean %s?" % ' or '.join(
+                        '"%s" (%s)' % (alias, aliases[alias]) 
+                        for alias in suggestions)
+                else:
+                    hint = "no similar alias"
+            print '    %s: "%s", %s' % (page_filename, target, hint)
+
+
+def build_search_index(base_dir, manifest, page_filenames, 
+                       use_parse_cache=True):
+    """Write the full-text search index of every page to build/search
+    
+    The pages are read and parsed one at a time, see dehr_search.SearchIndexWriter. With the parse cache, a page that was compiled in this build is not parsed again.
+    
+    Arguments:
+        base_dir:           String, usually BASE_DIR.
+        
+        manifest:           dehr_manifest.BuildManifest object, the aliases 
+                            of each page come from it. Pages without output, e.g. example_*.html, are left out.
+        
+        page_filenames:     Sorted list of every page filename.
+        
+        use_parse_cache:    Boolean, see build_all().
+    
+    Returns:
+        num_pages:          Integer, the number of pages in the index.
+    
+    """
+    
+    parse_cache = None
+    if use_parse_cache:
+        parse_cache = dehr_parse_cache.ParseCache.for_base_dir(base_dir)
+    writer = dehr_search.SearchIndexWriter(
+        os.path.join(base_dir, 'build', dehr_search.SEARCH_DIRNAME), 
+        dehr_search.num_shards_for(len(page_filenames)))
+    try:
+        for page_filename in page_filenames:
+            entry = manifest.pages.get(page_filename, None)
+            if entry == None or not entry.output:
+                continue
+            title, meta_dict, content = parse_page_raw(
+                read_page_raw(base_dir, page_filename), parse_cache)
+            writer.add_page(title, page_filename, content, 
+                            [to_str(alias) for alias, target in entry.aliases])
+        writer.finish()
+    except:
+        writer.abort()
+        raise
+    return len(writer.pages)
+
+
+def build_all(base_dir, engine, jobs=1, incremental=False, single_pass=False, 
+              profile=False, use_parse_cache=True, fast_path=True, 
+              search_index=True):
+    """Compile every page, then save all_page_data.py
+    
+    Arguments:
+        base_dir:       String, usually BASE_DIR.
+        
+        engine:         django.template.Engine object, used iff jobs == 1.
+        
+        jobs:           Integer, the number of worker processes. Iff jobs > 
+                        1, the pages are compiled by a multiprocessing.Pool, see compile_page_in_worker(). The result is exactly the same as a serial build.
+        
+        incremental:    Boolean, iff True then pages whose inputs did not 
+                        change since the last build are NOT compiled again, see dehr_manifest.BuildManifest.is_fresh(). Their titles and aliases come from the manifest. Iff False, every page is compiled and a new manifest is saved.
+        
+        single_pass:    Boolean, iff True then AllPageData.prior comes from 
+                        index_page_names(), NOT from all_page_data.py. A new page can then be linked to in the same build.
+        
+        profile:        Boolean, iff True then every phase of the build and 
+                        of each compiled page is timed, see report.profile.
+        
+        use_parse_cache:    Boolean, iff True then the title, metadata, and 
+                            content of a page source that was parsed before come from the dehr_parse_cache.ParseCache in source/parse_cache, and the cache is pruned after the build.
+        
+        fast_path:      Boolean, iff True then the pages that can be are 
+                        rendered without Django, see PageRenderer. The output is the same.
+        
+        search_index:   Boolean, iff True then the search index in 
+                        build/search is written again, iff a page changed or it does not exist yet. See build_search_index().
+    
+    The What links here list of each page comes from the link graph of the last build, source/link_graph.json. Once every page is compiled, the link graph of this build is made from the manifest, and every page whose list changed is compiled once more, see report.relinked. The links of a page don't depend on its list, so once is enough.
+    
+    Returns:
+        report:         BuildReport object.
+    
+    """
+    
+    if jobs < 1:
+        raise BuildError(
+            "The number of jobs must be at least 1. It was %s." % jobs)
+    
+    if profile:
+        build_profile = dehr_profile.BuildProfile()
+        timer = build_profile.build
+    else:
+        build_profile = None
+        timer = dehr_profile.NULL_TIMER
+    
+    apd = AllPageData()
+    page_filenames = list_page_filenames(base_dir)
+    with timer.phase('load prior'):
+        if single_pass:
+            apd.prior = index_page_names(base_dir, page_filenames)
+        else:
+            apd.load_prior(base_dir)
+        link_graph = dehr_links.LinkGraph.load(base_dir)
+    report = BuildReport(apd)
+    with timer.phase('hash code and templates'):
+        code_hashes = dehr_manifest.code_hashes()
+        template_hashes = dehr_manifest.template_hashes(base_dir)
+    
+    with timer.phase('load manifest'):
+        if incremental:
+            manifest = dehr_manifest.BuildManifest.load(base_dir)
+            manifest.keep_only(page_filenames)
+            # Even iff the code changed, the files in build/ are the same:
+            output_hashes = manifest.output_hashes()
+            manifest.check_code(code_hashes)
+        else:
+            # Start from scratch, even if the saved manifest is broken:
+            manifest = dehr_manifest.BuildManifest()
+            try:
+                output_hashes = dehr_manifest.BuildManifest.load(
+                    base_dir).output_hashes()
+            except dehr_manifest.ManifestError:
+                output_hashes = {}
+    
+    with timer.phase('check fresh'):
+        for page_filename in page_filenames:
+            if incremental and manifest.is_fresh(base_dir, page_filename, 
+                                                 template_hashes, apd.prior):
+                report.skipped.append(page_filename)
+            else:
+                report.compiled.append(page_filename)
+    
+    with timer.phase('compile'):
+        entries = compile_entries(base_dir, engine, jobs, apd.prior, 
+                                  report.compiled, profile, use_parse_cache, 
+                                  fast_path, link_graph, output_hashes)
+    for page_filename, entry in zip(report.compiled, entries):
+        manifest.set_entry(page_filename, entry)
+        if profile:
+            build_profile.pages.append(entry.timing)
+        if entry.parse_cache_hit == True:
+            report.parse_cache_hits += 1
+        elif entry.parse_cache_hit == False:
+            report.parse_cache_misses += 1
+        if entry.fast_path:
+            report.fast_pages += 1
+        if entry.output_written == False:
+            report.unchanged_outputs += 1
+    
+    with timer.phase('link graph'):
+        link_graph = dehr_links.LinkGraph.from_manifest(manifest)
+        for page_filename in page_filenames:
+            entry = manifest.pages[page_filename]
+            if (entry.output and 
+                    entry.backlinks != link_graph.backlinks(page_filename)):
+                report.relinked.append(page_filename)
+    report.link_graph = link_graph
+    if report.relinked:
+        with timer.phase('compile again'):
+            relinked_entries = compile_entries(
+                base_dir, engine, jobs, apd.prior, report.relinked, profile, 
+                use_parse_cache, fast_path, link_graph, 
+                manifest.output_hashes())
+        for page_filename, entry in zip(report.relinked, relinked_entries):
+            manifest.set_entry(page_filename, entry)
+    
+    # Merge in page order, so apd.next is the same as in a serial build:
+    with timer.phase('merge'):
+        for page_filename in page_filenames:
+            entry = manifest.pages[page_filename]
+            apd.merge_next(entry)
+            broken = find_broken_links(entry)
+            if broken:
+                report.broken_links[page_filename] = broken
+    
+    if report.skipped:
+        print "Skipped %s unchanged page(s)." % len(report.skipped)
+    if use_parse_cache and (report.parse_cache_hits or 
+                            report.parse_cache_misses):
+        print "Parse cache: %s hit(s), %s miss(es)." % (
+            report.parse_cache_hits, report.parse_cache_misses)
+    if report.relinked:
+        print "Compiled %s page(s) again for their What links here list." % (
+            len(report.relinked))
+    if fast_path and report.compiled:
+        print "Rendered %s of %s compiled page(s) without Django." % (
+            report.fast_pages, len(report.compiled))
+    if report.unchanged_outputs:
+        print "Left %s unchanged page(s) in build/ alone." % (
+            report.unchanged_outputs)
+    if report.broken_links:
+        with timer.phase('broken links'):
+            print_broken_links(report.broken_links, apd.next.aliases)
+    if search_index and (manifest.changed or not os.path.isdir(
+            os.path.join(base_dir, 'build', dehr_search.SEARCH_DIRNAME))):
+        with timer.phase('search index'):
+            num_pages = build_search_index(base_dir, manifest, page_filenames, 
+                                           use_parse_cache)
+        print "Wrote the search index of %s page(s)." % num_pages
+    with timer.phase('save'):
+        if manifest.changed or not os.path.exists(
+                dehr_links.LinkGraph.filepathname(base_dir)):
+            link_graph.save(base_dir)
+        if manifest.changed:
+            manifest.code_hashes = code_hashes
+            manifest.template_hashes = template_hashes
+            manifest.save(base_dir)
+        apd.save_next(base_dir)
+        if report.parse_cache_misses:
+            # Only a miss adds to the cache:
+            dehr_parse_cache.ParseCache.for_base_dir(base_dir).prune()
+    report.manifest = manifest
+    if profile:
+        build_profile.finish()
+        report.profile = build_profile
+    return report
+
+
+def compile_entries(base_dir, engine, jobs, prior, page_filenames, 
+                    profile=False, use_parse_cache=False, fast_path=True, 
+                    link_graph=None, output_hashes=None):
+    """Compile the pages, return a list of PageEntry objects in the same order
+    
+    See build_all() for the other arguments. Every output file is written by the time this returns.
+    
+    Arguments:
+        output_hashes:  Dict, see dehr_manifest.BuildManifest.output_hashes(), 
+                        the files in build/ now. An output that is the same is not written again.
+    
+    """
+    
+    if jobs == 1 or len(page_filenames) < 2:
+        parse_cache = None
+        if use_parse_cache and page_filenames:
+            parse_cache = dehr_parse_cache.ParseCache.for_base_dir(base_dir)
+        renderer = PageRenderer(engine, prior, fast_path, link_graph)
+        writer = dehr_output.OutputWriter(output_hashes)
+        entries = []
+        try:
+            for page_filename in page_filenames:
+                entries.append(compile_page_entry(base_dir, engine, prior, 
+                                                  page_filename, profile, 
+                                                  parse_cache, renderer, 
+                                                  writer))
+        except:
+            # Still write the pages that did compile:
+            writer.close()
+            raise
+        writer.finish()
+    else:
+        pool = multiprocessing.Pool(jobs, init_worker, 
+                                    (base_dir, prior, profile, 
+                                     use_parse_cache, fast_path, link_graph, 
+                                     output_hashes))
+        try:
+            # The results come back in the SAME order as report.compiled, 
+            # no matter which worker finished first. A plain pool.map() 
+            # can't be interrupted by Ctrl-C or signals in Python 2, a 
+            # get() with a (huge) timeout can:
+            async_result = pool.map_async(compile_page_in_worker, 
+                                          page_filenames, 1)
+            entries = async_result.get(WORKER_TIMEOUT)
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+    return entries
+
+
+# Seconds, effectively forever, see build_all():
+WORKER_TIMEOUT = 7 * 24 * 60 * 60
+
+# Each worker process has its own Engine and its own copy of apd.prior, 
+# they are set once by init_worker():
+worker_state = {}
+
+def init_worker(base_dir, prior, profile=False, use_parse_cache=False, 
+                fast_path=True, link_graph=None, output_hashes=None):
+    """Called once in each worker process of the multiprocessing.Pool"""
+    worker_state['base_dir'] = base_dir
+    worker_state['engine'] = make_engine(base_dir)
+    prior.read_only = True
+    worker_state['prior'] = prior
+    worker_state['renderer'] = PageRenderer(worker_state['engine'], prior, 
+                                            fast_path, link_graph)
+    worker_state['profile'] = profile
+    # The pool may end a worker process at any time after its last page, so 
+    # each output file is written before the page is done, without threads:
+    worker_state['writer'] = dehr_output.OutputWriter(output_hashes, 0)
+    worker_state['parse_cache'] = None
+    if use_parse_cache:
+        worker_state['parse_cache'] = dehr_parse_cache.ParseCache.for_base_dir(
+            base_dir)
+
+
+def compile_page_in_worker(page_filename):
+    """Compile one page in a worker process
+    
+    Returns:
+        entry:      dehr_manifest.PageEntry, see compile_page_entry().
+    
+    """
+    
+    try:
+        return compile_page_entry(worker_state['base_dir'], 
+                                  worker_state['engine'], 
+                                  worker_state['prior'], page_filename, 
+                                  worker_state['profile'], 
+                                  worker_state['parse_cache'], 
+                                  worker_state['renderer'], 
+                                  worker_state['writer'])
+    except DehrError:
+        raise
+    except Exception:
+        # The parent process must unpickle the exception. That is NOT 
+        # guaranteed for exceptions from other packages (e.g. Django), so 
+        # send a BuildError with the traceback as text instead.
+        raise BuildError(
+            "Compiling %s failed in a worker process." % page_filename, 
+            traceback.format_exc())
+
+
+#================================= Check Mode =================================#
+
+def check_page(base_dir, engine, page_filename):
+    """Return every problem of one page source, as a list of strings
+    
+    The page is read, lexed, and parsed, and its body is compiled by Django, but nothing is rendered or written. Every CR and hard tab character is a problem. The parser and Django stop at the first syntax error, so each of them adds at most one problem.
+    
+    """
+    
+    problems = []
+    page_raw, source_problems = read_page_source(base_dir, page_filename)
+    for problem in source_problems:
+        problems.append("%s, %s" % (page_filename, problem))
+    try:
+        title, meta_dict, content = parse_page_raw(page_raw)
+    except dehr_parser.ParserError as err:
+        problems.append("%s: %s" % (page_filename, err))
+        return problems
+    try:
+        compile_page_body(engine, content)
+    except django.template.TemplateSyntaxError as err:
+        problems.append("%s: %s" % (page_filename, err))
+    return problems
+
+
+def check_pages(base_dir, jobs=1):
+    """Check every page source, see check_page() and build.py --check
+    
+    Unlike build_all(), a bad page does not stop the check, every problem of every page is returned.
+    
+    Arguments:
+        base_dir:   String, usually BASE_DIR.
+        
+        jobs:       Integer, the number of worker processes.
+    
+    Returns:
+        problems:   List of strings, in page order.
+    
+    """
+    
+    page_filenames = [page_filename for page_filename in 
+                      list_page_filenames(base_dir) 
+                      if page_filename[:8] != 'example_']
+    if jobs == 1 or len(page_filenames) < 2:
+        engine = make_engine(base_dir)
+        page_problems = [check_page(base_dir, engine, page_filename) 
+                         for page_filename in page_filenames]
+    else:
+        pool = multiprocessing.Pool(jobs, init_check_worker, (base_dir,))
+        try:
+            # See compile_entries():
+            async_result = pool.map_async(check_page_in_worker, 
+                                          page_filenames)
+            page_problems = async_result.get(WORKER_TIMEOUT)
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+    problems = []
+    for one_page_problems in page_problems:
+        problems.extend(one_page_problems)
+    return problems
+
+
+def init_check_worker(base_dir):
+    """Called once in each worker process of check_pages()"""
+    worker_state['base_dir'] = base_dir
+    worker_state['engine'] = make_engine(base_dir)
+
+
+def check_page_in_worker(page_filename):
+    try:
+        return check_page(worker_state['base_dir'], worker_state['engine'], 
+                          page_filename)
+    except Exception:
+        # See compile_page_in_worker():
+        return ["%s: checking it failed:\n%s" % (page_filename, 
+                                                  traceback.format_exc())]
+
+
+#================================= Watch Mode =================================#
+
+class LiveBuild(object):
+    """A build that stays in memory, and recompiles only what changed
+    
+    This is build.py --watch, see dehr_watch.watch(). The Engine with its compiled templates, the build manifest, and the titles and aliases of every page stay in memory between rebuilds. As with --single-pass, every {% link %} is resolved with the aliases of the pages as they are NOW, so a new alias can be linked to right away.
+    
+    The manifest, all_page_data.py, and the alias index are only written by save(), when watch mode stops. Saving them takes much longer than compiling one page.
+    
+    Attributes:
+        base_dir:       String, usually BASE_DIR.
+        
+        engine:         django.template.Engine object.
+        
+        manifest:       dehr_manifest.BuildManifest object, up to date with 
+                        build/, except for pages that failed to compile.
+        
+        page_filenames: Sorted list of every page filename.
+        
+        names:          AllPageDataPart, read only, the titles and aliases of 
+                        every page, merged in page order. Every page is compiled with it as AllPageData.prior.
+        
+        suggester:      dehr_fuzzy.AliasSuggester of names.aliases, or None 
+                        iff it was not needed yet.
+        
+        parse_cache:    dehr_parse_cache.ParseCache object, or None. A page 
+                        that is compiled again only because a link or a template changed comes from it.
+        
+        fast_path:      Boolean, see PageRenderer.
+        
+        search_index:   Boolean, iff True then save() writes the search 
+                        index again, iff a page changed.
+        
+        search_stale:   Boolean, True iff a page changed since the search 
+                        index was written.
+        
+        link_graph:     dehr_links.LinkGraph object, up to date with 
+                        manifest. Every compiled page is updated in it, see compile().
+    
+    """
+    
+    def __init__(self, base_dir, engine, use_parse_cache=True, fast_path=True, 
+                 search_index=True):
+        self.base_dir = base_dir
+        self.engine = engine
+        self.fast_path = fast_path
+        self.search_index = search_index
+        self.search_stale = False
+        report = build_all(base_dir, engine, 1, True, True, 
+                           use_parse_cache=use_parse_cache, 
+                           fast_path=fast_path, search_index=search_index)
+        self.manifest = report.manifest
+        self.link_graph = report.link_graph
+        self.page_filenames = list_page_filenames(base_dir)
+        self.names = report.apd.next
+        self.names.read_only = True
+        self.suggester = None
+        self.parse_cache = None
+        if use_parse_cache:
+            self.parse_cache = dehr_parse_cache.ParseCache.for_base_dir(
+                base_dir)
+    
+    def update(self, page_filenames, template_names):
+        """Recompile every page that depends on the given files
+        
+        A page is compiled again iff its source changed, or it used a template that changed, or one of its {% link %} tags now finds a different page, or it lists every page title (e.g. the Index page) and a title changed, or its What links here list changed. The pages that look up an alias come from the link graph, so removing or renaming an alias compiles only those pages.
+        
+        Arguments:
+            page_filenames:     List of the pages that changed, were added, 
+                                or were deleted, e.g. ["lexapro.html"].
+            
+            template_names:     List of the templates that changed, were 
+                                added, or were deleted, e.g. ["base.html"].
+        
+        Returns:
+            compiled:           List of the page filenames that were 
+                                compiled.
+        
+        """
+        
+        manifest = self.manifest
+        to_compile = set()
+        relink = set()
+        if template_names:
+            # Forget every compiled template, the cached Loader compiles them 
+            # again as they are used:
+            self.engine.template_loaders[0].reset()
+            template_hashes = dehr_manifest.template_hashes(self.base_dir)
+            changed = set(
+                name for name in set(template_hashes) | 
+                set(manifest.template_hashes) 
+                if template_hashes.get(name) != manifest.template_hashes.get(name))
+            for page_filename, entry in manifest.pages.items():
+                if changed.intersection(entry.templates):
+                    to_compile.add(page_filename)
+            manifest.template_hashes = template_hashes
+            manifest.changed = True
+        
+        self.page_filenames = list_page_filenames(self.base_dir)
+        names_changed = (len(manifest.pages) != len(self.page_filenames))
+        existing = set(self.page_filenames)
+        for page_filename in set(manifest.pages) - existing:
+            relink.update(self.link_graph.remove_page(page_filename))
+        manifest.keep_only(self.page_filenames)
+        to_compile.update(page_filename for page_filename in page_filenames 
+                          if page_filename in existing)
+        
+        compiled = []
+        if self.compile(sorted(to_compile), compiled, relink):
+            names_changed = True
+        if names_changed:
+            names = self.merge_names()
+            changed_aliases = set(
+                alias for alias in set(names.aliases) | set(self.names.aliases)
+                if names.aliases.get(alias) != self.names.aliases.get(alias))
+            titles_changed = (names.get_titles() != self.names.get_titles())
+            self.names = names
+            self.suggester = None
+            dependents = self.link_graph.dependents(changed_aliases)
+            if titles_changed:
+                dependents.update(
+                    page_filename for page_filename, entry in 
+                    manifest.pages.items() if entry.titles_hash != None)
+            # The titles and aliases of a page come from its own source, so 
+            # they can't change again here:
+            self.compile(sorted(dependents), compiled, relink)
+        # Nor can the links of a page change when only its What links here 
+        # list does, so this loop ends after one more round:
+        while relink:
+            stale = sorted(
+                page_filename for page_filename in relink 
+                if page_filename in manifest.pages and 
+                manifest.pages[page_filename].output and 
+                manifest.pages[page_filename].backlinks != 
+                self.link_graph.backlinks(page_filename))
+            relink = set()
+            self.compile(stale, compiled, relink)
+        if compiled or names_changed:
+            self.search_stale = True
+        
+        broken_links = OrderedDict()
+        for page_filename in sorted(set(compiled)):
+            broken = find_broken_links(manifest.pages[page_filename])
+            if broken:
+                broken_links[page_filename] = broken
+        if broken_links:
+            if self.suggester == None:
+                self.suggester = dehr_fuzzy.AliasSuggester(self.names.aliases)
+            print_broken_links(broken_links, self.names.aliases, 
+                               self.suggester)
+        return compiled
+    
+    def compile(self, page_filenames, compiled, relink):
+        """Compile the pages, append the ones that compiled to compiled
+        
+        A page that fails is reported, and its old manifest entry is kept, so the other pages can still link to it. It is marked so that the next build compiles it again.
+        
+        The links of every page that compiled are updated in the link graph, and every page whose What links here list may have changed is added to the set relink.
+        
+        The output files are written in the background, and every one of them is written by the time this returns. An output that did not change is not written again, see dehr_output.OutputWriter.
+        
+        Returns:
+            names_changed:  Boolean, True iff a page that compiled has 
+                            different titles or aliases than before.
+        
+        """
+        
+        renderer = PageRenderer(self.engine, self.names, self.fast_path, 
+                                self.link_graph)
+        writer = dehr_output.OutputWriter(self.manifest.output_hashes())
+        try:
+            names_changed = self.compile_each(renderer, writer, 
+                                              page_filenames, compiled, relink)
+        finally:
+            # The browser reloads as soon as update() returns:
+            writer.close()
+        if writer.errors:
+            # Write them again next time:
+            for page_filename in page_filenames:
+                entry = self.manifest.pages.get(page_filename, None)
+                if entry != None:
+                    entry.output_hash = None
+            writer.finish()
+        return names_changed
+    
+    def compile_each(self, renderer, writer, page_filenames, compiled, relink):
+        """The loop of compile(), see there"""
+        names_changed = False
+        for page_filename in page_filenames:
+            old_entry = self.manifest.pages.get(page_filename, None)
+            try:
+                entry = compile_page_entry(self.base_dir, self.engine, 
+                                           self.names, page_filename, 
+                                           parse_cache=self.parse_cache, 
+                                           renderer=renderer, writer=writer)
+            except Exception:
+                traceback.print_exc()
+                if old_entry != None:
+                    old_entry.source_hash = None
+                    old_entry.source_stat = None
+                continue
+            self.manifest.set_entry(page_filename, entry)
+            compiled.append(page_filename)
+            if entry.output:
+                relink.update(self.link_graph.set_page(page_filename, entry))
+            else:
+                relink.update(self.link_graph.remove_page(page_filename))
+            if (old_entry == None or old_entry.titles != entry.titles or 
+                    old_entry.aliases != entry.aliases):
+                names_changed = True
+        return names_changed
+    
+    def merge_names(self):
+        """Return the titles and aliases of every page, see self.names"""
+        apd = AllPageData()
+        for page_filename in self.page_filenames:
+            entry = self.manifest.pages.get(page_filename, None)
+            if entry != None:
+                apd.merge_next(entry)
+        apd.next.read_only = True
+        return apd.next
+    
+    def save(self):
+        """Save the manifest, the link graph, all_page_data.py, and the alias index
+        
+        The search index is written too, iff a page changed, and the parse cache is pruned.
+        
+        """
+        
+        if self.search_index and self.search_stale:
+            build_search_index(self.base_dir, self.manifest, 
+                               self.page_filenames, self.parse_cache != None)
+            self.search_stale = False
+        if self.manifest.changed:
+            self.link_graph.save(self.base_dir)
+            self.manifest.save(self.base_dir)
+        apd = AllPageData()
+        apd.next = self.names
+        apd.save_next(self.base_dir)
+        if self.parse_cache != None:
+            self.parse_cache.prune()
 
 
 #=============================== Test Functions ===============================#
@@ -517,6 +1931,14 @@ if __name__ == '__main__':
         print "Type 'python build.py -h' for more help."
         sys.exit()
     
+    if args.check:
+        problems = check_pages(BASE_DIR, args.jobs)
+        for problem in problems:
+            print problem
+        print "Checked the pages, %s problem(s)." % len(problems)
+        if problems:
+            sys.exit(1)
+    
     engine = make_engine(BASE_DIR)
     
     if args.build_all:
@@ -529,10 +1951,22 @@ if __name__ == '__main__':
         # template_test03(engine)
         # compile_one_page(BASE_DIR, engine, 'page_test_01.html')
         
-        apd = AllPageData()
-        apd.load_prior(BASE_DIR)
-        pages_dir = os.path.join(BASE_DIR, 'source', 'pages')
-        for page_filename in sorted(os.listdir(pages_dir)):
-            if page_filename[-5:] == '.html':
-                compile_one_page(BASE_DIR, engine, apd, page_filename)
-        apd.save_next(BASE_DIR)
+        report = build_all(BASE_DIR, engine, args.jobs, args.incremental, 
+                           args.single_pass, args.profile, 
+                           not args.no_parse_cache, not args.no_fast_path, 
+                           not args.no_search_index)
+        if args.profile:
+            report.profile.save(
+                os.path.join(BASE_DIR, 'source', PROFILE_FILENAME), 
+                os.path.join(BASE_DIR, 'source', TRACE_FILENAME))
+            print report.profile.summary(args.top)
+            print "Saved the profile to %s and %s." % (PROFILE_FILENAME, 
+                                                       TRACE_FILENAME)
+    
+    if args.watch:
+        live_build = LiveBuild(BASE_DIR, engine, not args.no_parse_cache, 
+                               not args.no_fast_path, not args.no_search_index)
+        try:
+            dehr_watch.watch(BASE_DIR, live_build.update, args.port)
+        finally:
+            live_build.save()
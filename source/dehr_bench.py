@@ -0,0 +1,632 @@
+# File dehr_bench.py
+# 
+# Benchmarks for the DEHR lexer, parser, and build. These are NOT unit tests, 
+# they just print timings. Run them like this:
+# 
+#     python source/dehr_bench.py --lexer --parser --incremental
+# 
+# To compare two commits, save the --suite results of each as JSON:
+# 
+#     python source/dehr_bench.py --suite --json old.json
+#     (check out the new commit)
+#     python source/dehr_bench.py --suite --json new.json --compare old.json
+
+import argparse
+from collections import OrderedDict
+from cStringIO import StringIO as BytesIO
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+from StringIO import StringIO
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+import build
+import dehr_fuzzy
+import dehr_index
+import dehr_parser
+from dehr_synthetic import make_synthetic_page, write_synthetic_corpus
+
+
+#======================== Command Line Argument Parser ========================#
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent("""\
+    Benchmarks the DEHR Lexer and Parser
+    
+    Synthetic pages are generated in the same format as the files in
+    source/pages, and each benchmark prints the best of several runs."""))
+
+parser.add_argument('--lexer', action='store_true',
+                    help="Time every lexer engine on pages from 1 KB to 10 MB, "
+                         "and on source/pages")
+parser.add_argument('--parser', action='store_true',
+                    help="Time WholePageNode parse() and render() on pages "
+                         "from 1 KB to 10 MB")
+parser.add_argument('--header', action='store_true',
+                    help="Time read_page_header() against a full parse on "
+                         "pages from 1 KB to 10 MB")
+parser.add_argument('--index', action='store_true',
+                    help="Time loading all_page_data.py against loading the "
+                         "alias index, with --aliases aliases")
+parser.add_argument('--aliases', type=int, default=100000,
+                    help="Number of aliases for --index")
+parser.add_argument('--fuzzy', action='store_true',
+                    help="Time the AliasSuggester with --aliases aliases")
+parser.add_argument('--incremental', action='store_true',
+                    help="Time a build --incremental where nothing changed, "
+                         "on a corpus of --pages synthetic pages")
+parser.add_argument('--memory', action='store_true',
+                    help="Measure the peak RSS of compile_one_page() on pages "
+                         "from 1 KB to 10 MB, streamed and not streamed")
+parser.add_argument('--suite', action='store_true',
+                    help="Time the lexer, parse, render, compile_one_page(), "
+                         "and a full build, on a corpus of --pages pages of "
+                         "--page-size bytes. See --json and --compare")
+parser.add_argument('--pages', type=int, default=None,
+                    help="Number of pages for --incremental (default 10000) "
+                         "and --suite (default 1000)")
+parser.add_argument('--page-size', type=int, default=2**13,
+                    help="Size of each page (bytes) for --suite")
+parser.add_argument('--aliases-per-page', type=int, default=4,
+                    help="Number of hidden names of each page for --suite. "
+                         "Iff more than 0, no link in the corpus is broken")
+parser.add_argument('--json', metavar='FILE',
+                    help="Save the --suite results to FILE")
+parser.add_argument('--compare', metavar='FILE',
+                    help="Compare the --suite results with FILE, saved by "
+                         "--json on an older commit")
+parser.add_argument('--repeat', type=int, default=3,
+                    help="Number of runs per measurement, the best is kept")
+parser.add_argument('--reslice-limit', type=int, default=2**20,
+                    help="Largest page size (bytes) for the 'reslice' engine, "
+                         "which is quadratic and VERY slow on big pages")
+
+
+#================================= Page Sizes =================================#
+
+BENCH_SIZES = [2**10, 2**13, 2**16, 2**20, 10 * 2**20]
+
+
+#================================== Timing ====================================#
+
+def best_time(func, args, repeat):
+    """Call func(*args) repeat times, return the fastest time in seconds"""
+    
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def size_label(size):
+    if size >= 2**20:
+        return '%g MB' % (size / float(2**20))
+    return '%g KB' % (size / float(2**10))
+
+
+def lex_pages(pages, engine, typed=False):
+    for page in pages:
+        dehr_parser.lexer(page, engine, typed)
+
+
+def bench_lexer(repeat, reslice_limit):
+    """Print the time each lexer engine takes on each page size, and which one wins
+    
+    There is one row per synthetic page size, and one for every page in source/pages at once. There is one column per engine, and one more per engine in TYPED_LEXER_ENGINES, with typed=True, which is what build.py uses. Every engine outputs the same tokens, see test_dehr_parser.LexerEngineTest.
+    
+    """
+    
+    columns = [(engine, False) for engine in dehr_parser.LEXER_ENGINES]
+    columns.extend((engine, True) for engine in dehr_parser.LEXER_ENGINES 
+                   if engine in dehr_parser.TYPED_LEXER_ENGINES)
+    print '%-10s %10s' % ('size', 'tokens') + ''.join(
+        '%14s' % (engine + (' typed' if typed else '')) 
+        for engine, typed in columns) + '%16s' % 'fastest'
+    
+    rows = [(size_label(size), [make_synthetic_page(size)]) 
+            for size in BENCH_SIZES]
+    rows.append(('corpus', [build.read_page_raw(build.BASE_DIR, page_filename)
+                            for page_filename in 
+                            build.list_page_filenames(build.BASE_DIR)]))
+    for label, pages in rows:
+        num_tokens = sum(len(dehr_parser.lexer(page)) for page in pages)
+        line = ['%-10s %10d' % (label, num_tokens)]
+        times = []
+        for engine, typed in columns:
+            if engine == 'reslice' and max(map(len, pages)) > reslice_limit:
+                line.append('%14s' % 'skipped')
+                continue
+            seconds = best_time(lex_pages, (pages, engine, typed), repeat)
+            line.append('%13.4fs' % seconds)
+            times.append((seconds, engine + (' typed' if typed else '')))
+        line.append('%16s' % min(times)[1])
+        print ''.join(line)
+
+
+def parse_page(tokens):
+    node = dehr_parser.WholePageNode(tokens)
+    node.parse()
+    return node
+
+
+def bench_parser(repeat):
+    """Print the parse and render times, and the time per token
+    
+    The time per token should stay roughly constant as the pages grow.
+    
+    """
+    
+    print '%-10s %10s %10s %12s %12s %12s' % (
+        'size', 'paragraphs', 'tokens', 'parse', 'render', 'us/token')
+    for size in BENCH_SIZES:
+        tokens = dehr_parser.lexer(make_synthetic_page(size), typed=True)
+        paragraphs = tokens.kinds.count(chr(dehr_parser.BREAK))
+        parse_seconds = best_time(parse_page, (tokens,), repeat)
+        node = parse_page(tokens)
+        render_seconds = best_time(node.render, (), repeat)
+        print '%-10s %10d %10d %11.4fs %11.4fs %12.3f' % (
+            size_label(size), paragraphs, len(tokens), parse_seconds, 
+            render_seconds, 1e6 * (parse_seconds + render_seconds) / len(tokens))
+
+
+def parse_header_of_file(page):
+    return dehr_parser.read_page_header(BytesIO(page))
+
+
+def parse_whole_file(page):
+    node = dehr_parser.WholePageNode(dehr_parser.lexer(BytesIO(page).read(), 
+                                                       typed=True))
+    node.parse()
+    return node.title, node.meta_dict
+
+
+def bench_header(repeat):
+    """Print the time to get the title and metadata of each page size
+    
+    The pages are read from in-memory files, so only the lexing and parsing are timed, not the disk.
+    
+    """
+    
+    print '%-10s %12s %12s %10s' % ('size', 'full parse', 'header', 'speedup')
+    for size in BENCH_SIZES:
+        page = make_synthetic_page(size)
+        if parse_header_of_file(page) != parse_whole_file(page):
+            raise AssertionError("read_page_header() disagrees with parse().")
+        full_seconds = best_time(parse_whole_file, (page,), repeat)
+        header_seconds = best_time(parse_header_of_file, (page,), repeat)
+        print '%-10s %11.4fs %11.6fs %9.0fx' % (
+            size_label(size), full_seconds, header_seconds, 
+            full_seconds / header_seconds)
+
+
+def exec_py_export(apd_str):
+    """The old AllPageData.load_prior(), it exec()s all_page_data.py"""
+    namespace = {'OrderedDict': dehr_index.OrderedDict}
+    exec(apd_str, namespace)
+    return namespace['all_page_titles'], namespace['all_page_aliases']
+
+
+def lookup_all(aliases, queries):
+    get = aliases.get
+    for query in queries:
+        get(query)
+
+
+def bench_index(num_aliases, repeat):
+    """Print the time to load the aliases, and to look 10000 of them up"""
+    
+    apd = build.AllPageData()
+    num_pages = num_aliases // 4
+    for i in range(num_pages):
+        page_filename = 'page%06d.html' % i
+        apd.add_title('Synthetic Page %s' % i, page_filename)
+        for j in range(4):
+            apd.add_alias('Alias %s of page %s' % (j, i), page_filename)
+    queries = ['alias %s of page %s' % (i % 4, i * 7919 % num_pages) 
+               for i in range(10000)]
+    
+    base_dir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    try:
+        os.mkdir(os.path.join(base_dir, 'source'))
+        sys.stdout = StringIO()     # Hide the "Saved ..." line
+        apd.save_next(base_dir)
+        sys.stdout = stdout
+        apd_file = open(os.path.join(base_dir, 'source', 'all_page_data.py'), 
+                        'rb')
+        apd_str = apd_file.read()
+        apd_file.close()
+        index_filepath = os.path.join(base_dir, 'source', 
+                                      build.INDEX_FILENAME)
+        
+        print '%-24s %12s %16s' % ('format', 'load', '10000 lookups')
+        titles, aliases = exec_py_export(apd_str)
+        print '%-24s %11.4fs %15.4fs' % (
+            'exec all_page_data.py', 
+            best_time(exec_py_export, (apd_str,), repeat), 
+            best_time(lookup_all, (aliases, queries), repeat))
+        print '%-24s %11.4fs %15s' % (
+            'parse all_page_data.py', 
+            best_time(dehr_index.parse_py_export, (apd_str,), repeat), '')
+        index = dehr_index.AliasIndex(index_filepath)
+        print '%-24s %11.4fs %15.4fs' % (
+            'alias index (mmap)', 
+            best_time(dehr_index.AliasIndex, (index_filepath,), repeat), 
+            best_time(lookup_all, (index, queries), repeat))
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(base_dir)
+
+
+def make_fake_aliases(num_aliases, seed=0):
+    """Return num_aliases distinct lowercase aliases, 1 to 3 words each
+    
+    The words are made of random syllables, so they look a bit like drug names, e.g. "zolaxepram".
+    
+    """
+    
+    rng = random.Random(seed)
+    def syllable():
+        return (rng.choice('bcdfghjklmnprstvxz') + rng.choice('aeiouy') + 
+                rng.choice(['', '', 'l', 'n', 'r', 'x', 'm']))
+    aliases = set()
+    while len(aliases) < num_aliases:
+        words = [''.join(syllable() for i in range(rng.randint(2, 4)))
+                 for j in range(rng.randint(1, 3))]
+        aliases.add(' '.join(words))
+    return sorted(aliases)
+
+
+def typo(rng, alias):
+    """Return alias with one random character changed, added, or removed"""
+    i = rng.randint(0, len(alias) - 1)
+    kind = rng.randint(0, 2)
+    if kind == 0:
+        return alias[:i] + rng.choice('aeioux') + alias[i+1:]
+    elif kind == 1:
+        return alias[:i] + rng.choice('aeioux') + alias[i:]
+    return alias[:i] + alias[i+1:]
+
+
+def suggest_all(suggester, queries):
+    for query in queries:
+        suggester.suggest(query)
+
+
+def bench_fuzzy(num_aliases, repeat):
+    """Print the time to build an AliasSuggester, and the time per query"""
+    
+    aliases = make_fake_aliases(num_aliases)
+    rng = random.Random(1)
+    typo_queries = [typo(rng, rng.choice(aliases)) for i in range(1000)]
+    prefix_queries = [rng.choice(aliases)[:4] for i in range(1000)]
+    build_seconds = best_time(dehr_fuzzy.AliasSuggester, (aliases,), 1)
+    suggester = dehr_fuzzy.AliasSuggester(aliases)
+    similar_seconds = best_time(suggest_all, (suggester, typo_queries), repeat)
+    prefix_seconds = best_time(lambda: [suggester.prefix(query) 
+                                        for query in prefix_queries], (), 
+                               repeat)
+    print '%-10s %12s %22s %22s' % ('aliases', 'build', 
+                                    'suggest (typo), each', 'prefix, each')
+    print '%-10d %11.3fs %20.3fms %20.3fms' % (
+        num_aliases, build_seconds, 1e3 * similar_seconds / len(typo_queries), 
+        1e3 * prefix_seconds / len(prefix_queries))
+
+
+def write_page_joined(out_file, layout_template, body_template, 
+                      context_object):
+    """The old build.write_page(), it renders the whole page, then writes it"""
+    context_object['page_content'] = body_template.render(context_object)
+    out_file.write(layout_template.render(context_object))
+
+
+def peak_rss_of_compile(base_dir, page_filename, streamed):
+    """Compile one page in a forked child, return the child's peak RSS in KB
+    
+    Each measurement needs a fresh process, because the peak RSS of a process never goes down.
+    
+    """
+    
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            if not streamed:
+                build.write_page = write_page_joined
+            sys.stdout = StringIO()     # Hide the "Compiled foo.html." line
+            build.compile_one_page(base_dir, build.make_engine(base_dir), 
+                                   build.AllPageData(), page_filename)
+            os.write(write_fd, str(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 100)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    if not result:
+        raise AssertionError("Compiling %s failed." % page_filename)
+    return int(result)
+
+
+def bench_memory():
+    """Print the peak RSS of compiling one page, streamed and not streamed
+    
+    The peak RSS of the 1 KB page is mostly Python and Django themselves.
+    
+    """
+    
+    base_dir = tempfile.mkdtemp()
+    try:
+        shutil.copytree(os.path.join(build.BASE_DIR, 'source', 'templates'), 
+                        os.path.join(base_dir, 'source', 'templates'))
+        os.mkdir(os.path.join(base_dir, 'source', 'pages'))
+        os.mkdir(os.path.join(base_dir, 'build'))
+        print '%-10s %16s %16s' % ('size', 'not streamed', 'streamed')
+        for size in BENCH_SIZES:
+            page_filename = 'page_%s.html' % size
+            page_file = open(os.path.join(base_dir, 'source', 'pages', 
+                                          page_filename), 'wb')
+            page_file.write(make_synthetic_page(size))
+            page_file.close()
+            print '%-10s %13.1f MB %13.1f MB' % (
+                size_label(size), 
+                peak_rss_of_compile(base_dir, page_filename, False) / 1024.0, 
+                peak_rss_of_compile(base_dir, page_filename, True) / 1024.0)
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def make_corpus_base_dir(num_pages, page_size=2**11, aliases_per_page=0):
+    """Return a new temporary base_dir, with a synthetic corpus in source/pages
+    
+    The templates are copied from the real source/templates, so the real build/ and all_page_data.py are never touched. The caller must remove the base_dir. See write_synthetic_corpus() for the arguments.
+    
+    """
+    
+    base_dir = tempfile.mkdtemp()
+    shutil.copytree(os.path.join(build.BASE_DIR, 'source', 'templates'), 
+                    os.path.join(base_dir, 'source', 'templates'))
+    os.mkdir(os.path.join(base_dir, 'source', 'pages'))
+    os.mkdir(os.path.join(base_dir, 'build'))
+    write_synthetic_corpus(os.path.join(base_dir, 'source', 'pages'), 
+                           num_pages, page_size, aliases_per_page)
+    return base_dir
+
+
+def bench_incremental(num_pages, repeat):
+    """Print the time of a full build, and of a no-op incremental build
+    
+    The corpus is written to a temporary base_dir, so the real build/ and all_page_data.py are not touched.
+    
+    """
+    
+    base_dir = make_corpus_base_dir(num_pages)
+    stdout = sys.stdout
+    try:
+        engine = build.make_engine(base_dir)
+        
+        sys.stdout = StringIO()     # Hide the "Compiled foo.html." lines
+        build.AllPageData().save_next(base_dir)
+        full_seconds = best_time(build.build_all, (base_dir, engine), 1)
+        # The aliases of the full build are the prior of the next build, so 
+        # settle them before timing:
+        build.build_all(base_dir, engine, 1, True)
+        noop_seconds = best_time(build.build_all, 
+                                 (base_dir, engine, 1, True), repeat)
+        report = build.build_all(base_dir, engine, 1, True)
+        sys.stdout = stdout
+        
+        print '%-10s %10s %10s %12s %14s' % (
+            'pages', 'compiled', 'skipped', 'full build', 'no-op build')
+        print '%-10d %10d %10d %11.3fs %13.3fs' % (
+            num_pages, len(report.compiled), len(report.skipped), 
+            full_seconds, noop_seconds)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(base_dir)
+
+
+#=================================== Suite ====================================#
+
+def lex_all(pages):
+    return [dehr_parser.lexer(page, typed=True) for page in pages]
+
+
+def parse_all(token_lists):
+    return [parse_page(tokens) for tokens in token_lists]
+
+
+def render_all(nodes):
+    for node in nodes:
+        node.render()
+
+
+def compile_pages(base_dir, engine, apd, page_filenames):
+    for page_filename in page_filenames:
+        build.compile_one_page(base_dir, engine, apd, page_filename)
+
+
+def run_suite(num_pages, page_size, aliases_per_page, repeat):
+    """Time each stage of the build on one synthetic corpus
+    
+    The lexer, parse, and render are timed on every page of the corpus, in memory. compile_one_page() is timed on the first 100 pages, or fewer, against the aliases of a finished build, so it reads and writes the disk like a real build does. The full build is build.py --no-parse-cache, the cached full build is build.py where every page is in the parse cache, and the no-op build is build.py --incremental where nothing changed.
+    
+    Returns:
+        results:    OrderedDict, the name of a measurement --> the best time 
+                    in seconds.
+    
+    """
+    
+    results = OrderedDict()
+    base_dir = make_corpus_base_dir(num_pages, page_size, aliases_per_page)
+    stdout = sys.stdout
+    try:
+        pages_dir = os.path.join(base_dir, 'source', 'pages')
+        page_filenames = sorted(os.listdir(pages_dir))
+        pages = []
+        for page_filename in page_filenames:
+            page_file = open(os.path.join(pages_dir, page_filename), 'rb')
+            pages.append(page_file.read())
+            page_file.close()
+        
+        results['lexer'] = best_time(lex_all, (pages,), repeat)
+        token_lists = lex_all(pages)
+        results['parse'] = best_time(parse_all, (token_lists,), repeat)
+        nodes = parse_all(token_lists)
+        results['render'] = best_time(render_all, (nodes,), repeat)
+        del pages, token_lists, nodes
+        
+        engine = build.make_engine(base_dir)
+        sys.stdout = StringIO()     # Hide the "Compiled foo.html." lines
+        build.AllPageData().save_next(base_dir)
+        results['full build'] = best_time(
+            build.build_all, (base_dir, engine, 1, False, False, False, False), 
+            repeat)
+        build.build_all(base_dir, engine)
+        results['full build, cached'] = best_time(build.build_all, 
+                                                  (base_dir, engine), repeat)
+        # The aliases of the full build are the prior of the next build, so 
+        # settle them before timing:
+        build.build_all(base_dir, engine, 1, True)
+        results['no-op build'] = best_time(build.build_all, 
+                                           (base_dir, engine, 1, True), repeat)
+        apd = build.AllPageData()
+        apd.load_prior(base_dir)
+        results['compile_one_page'] = best_time(
+            compile_pages, (base_dir, engine, apd, page_filenames[:100]), 
+            repeat)
+        report = build.build_all(base_dir, engine)
+        sys.stdout = stdout
+        if aliases_per_page > 0 and report.broken_links:
+            raise AssertionError("The synthetic corpus has broken links.")
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(base_dir)
+    return results
+
+
+def git_commit():
+    """Return the commit of build.BASE_DIR, or None iff git fails"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=build.BASE_DIR, 
+            stderr=open(os.devnull, 'wb')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suite_json_dict(params, results):
+    """Return what --json saves: where and how the suite ran, and its results"""
+    return OrderedDict([
+        ('commit', git_commit()),
+        ('date', datetime.datetime.now().isoformat()),
+        ('python', platform.python_version()),
+        ('machine', platform.machine()),
+        ('params', params),
+        ('results', results),
+    ])
+
+
+def compare_results(old, new):
+    """Return the lines of a table of the old and new results, with the ratio
+    
+    Arguments:
+        old:    Dict, from suite_json_dict(), e.g. loaded from --compare.
+        
+        new:    Dict, from suite_json_dict().
+    
+    """
+    
+    o = []
+    if old['params'] != new['params']:
+        o.append("WARNING: the params differ, old %s, new %s." % (
+            json.dumps(old['params'], sort_keys=True), 
+            json.dumps(new['params'], sort_keys=True)))
+    o.append('%-20s %12s %12s %10s' % ('', str(old['commit'])[:10], 
+                                       str(new['commit'])[:10], 'new/old'))
+    for name, seconds in new['results'].items():
+        old_seconds = old['results'].get(name)
+        if old_seconds == None:
+            o.append('%-20s %12s %11.4fs %10s' % (name, '', seconds, ''))
+        else:
+            o.append('%-20s %11.4fs %11.4fs %9.2fx' % (
+                name, old_seconds, seconds, seconds / old_seconds))
+    return o
+
+
+def bench_suite(num_pages, page_size, aliases_per_page, repeat, json_path, 
+                compare_path):
+    """Print the suite results, save them to json_path, compare them"""
+    
+    params = OrderedDict([
+        ('pages', num_pages),
+        ('page_size', page_size),
+        ('aliases_per_page', aliases_per_page),
+        ('repeat', repeat),
+    ])
+    new = suite_json_dict(params, run_suite(num_pages, page_size, 
+                                            aliases_per_page, repeat))
+    if compare_path == None:
+        print '%-20s %12s' % ('', 'best')
+        for name, seconds in new['results'].items():
+            print '%-20s %11.4fs' % (name, seconds)
+    else:
+        compare_file = open(compare_path, 'rb')
+        old = json.load(compare_file, object_pairs_hook=OrderedDict)
+        compare_file.close()
+        print '\n'.join(compare_results(old, new))
+    if json_path != None:
+        json_file = open(json_path, 'wb')
+        json.dump(new, json_file, indent=1)
+        json_file.close()
+        print "Saved %s." % json_path
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    
+    if not (args.lexer or args.parser or args.header or args.index or 
+            args.fuzzy or args.memory or args.incremental or args.suite):
+        parser.print_help()
+    
+    if args.lexer:
+        bench_lexer(args.repeat, args.reslice_limit)
+    
+    if args.parser:
+        bench_parser(args.repeat)
+    
+    if args.header:
+        bench_header(args.repeat)
+    
+    if args.index:
+        bench_index(args.aliases, args.repeat)
+    
+    if args.fuzzy:
+        bench_fuzzy(args.aliases, args.repeat)
+    
+    if args.memory:
+        bench_memory()
+    
+    if args.incremental:
+        bench_incremental(args.pages or 10000, args.repeat)
+    
+    if args.suite:
+        bench_suite(args.pages or 1000, args.page_size, args.aliases_per_page, 
+                    args.repeat, args.json, args.compare)
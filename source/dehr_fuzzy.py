@@ -0,0 +1,170 @@
+# File dehr_fuzzy.py
+# 
+# Fuzzy lookup of page aliases, used by build.py to suggest what a broken
+# {% link %} probably meant. See AliasSuggester.
+
+from bisect import bisect_left
+
+
+def edit_distance(a, b, max_distance):
+    """Return the Levenshtein distance between two strings
+    
+    Iff the distance is more than max_distance, max_distance + 1 is returned instead. Only the cells within max_distance of the diagonal of the table are computed, the others can't lead to a distance of max_distance or less.
+    
+    """
+    
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+    len_b = len(b)
+    # previous[j] is the distance between a[:i-1] and b[:j]:
+    previous = range(min(len_b, max_distance) + 1) + [too_far] * max(
+        0, len_b - max_distance)
+    for i in xrange(1, len(a) + 1):
+        char_a = a[i-1]
+        low = max(1, i - max_distance)
+        high = min(len_b, i + max_distance)
+        current = [too_far] * (len_b + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+        for j in xrange(low, high + 1):
+            value = previous[j-1] + (char_a != b[j-1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j-1] + 1 < value:
+                value = current[j-1] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return too_far
+        previous = current
+    return min(previous[len_b], too_far)
+
+
+def trigrams(alias):
+    """Return the set of 3-character substrings of alias, padded at both ends"""
+    padded = '\0\0' + alias + '\0\0'
+    return set([padded[i:i+3] for i in xrange(len(padded) - 2)])
+
+
+class AliasSuggester(object):
+    """Answers prefix and edit distance queries over a set of aliases
+    
+    Build it ONCE per build, from every alias, e.g. AllPageData.next.aliases. The aliases are kept in two structures:
+    
+    1. A sorted list. Every alias with a given prefix is in one contiguous run of the list, which bisect finds. This is what a trie would do, but with much less memory in Python.
+    
+    2. A trigram index, trigram --> list of alias numbers. Iff an alias is within max_distance edits of the query, then all but max_distance of the disjoint pieces of the query are untouched by the edits, and appear in the alias as they are, moved by max_distance characters or less. So only the aliases listed under the rarest trigram of one of the max_distance + 1 rarest pieces, and that contain enough whole pieces near the same places, are ever compared with the query. Queries too short to cut into pieces of 3 characters use a weaker filter, see similar().
+    
+    Attributes:
+        aliases:        Sorted list of strings, every alias.
+        
+        postings:       Dict, trigram --> list of indexes into aliases.
+        
+        by_length:      Dict, length --> list of the aliases of that length.
+    
+    """
+    
+    def __init__(self, aliases):
+        self.aliases = sorted(set(aliases))
+        self.postings = {}
+        self.by_length = {}
+        for number, alias in enumerate(self.aliases):
+            for trigram in trigrams(alias):
+                self.postings.setdefault(trigram, []).append(number)
+            self.by_length.setdefault(len(alias), []).append(alias)
+    
+    def prefix(self, prefix, limit=10):
+        """Return up to limit aliases that start with prefix, sorted"""
+        aliases = self.aliases
+        matches = []
+        i = bisect_left(aliases, prefix)
+        while i < len(aliases) and len(matches) < limit:
+            if not aliases[i].startswith(prefix):
+                break
+            matches.append(aliases[i])
+            i += 1
+        return matches
+    
+    def similar(self, query, max_distance=2, limit=5):
+        """Return up to limit (distance, alias) pairs, nearest first
+        
+        Only aliases within max_distance edits (insertions, deletions, or substitutions) of query are returned. Ties are sorted by alias.
+        
+        """
+        
+        postings = self.postings
+        def rarest(trigrams):
+            return min(trigrams, key=lambda t: len(postings.get(t, ())))
+        
+        num_pieces = max(max_distance + 1, len(query) // 3)
+        min_shared = len(trigrams(query)) - 3 * max_distance
+        if len(query) >= 3 * (max_distance + 1):
+            # Cut the query into pieces of 3 or more characters. Each edit 
+            # spoils at most one piece, so the alias has all but max_distance 
+            # of them, each moved by max_distance characters or less:
+            pieces = []
+            for i in range(num_pieces):
+                start = i * len(query) // num_pieces
+                piece = query[start:(i + 1) * len(query) // num_pieces]
+                trigram = rarest([piece[j:j+3] for j in range(len(piece) - 2)])
+                pieces.append((len(postings.get(trigram, ())), trigram, piece, 
+                               max(0, start - max_distance), 
+                               start + len(piece) + max_distance))
+            pieces.sort()
+            min_found = num_pieces - max_distance
+            # Any max_distance + 1 pieces include one that the alias has:
+            numbers = set()
+            for count, trigram, piece, low, high in pieces[:max_distance + 1]:
+                numbers.update(postings.get(trigram, ()))
+            candidates = []
+            for number in numbers:
+                alias = self.aliases[number]
+                found = 0
+                for count, trigram, piece, low, high in pieces:
+                    if alias.find(piece, low, high) != -1:
+                        found += 1
+                if found >= min_found:
+                    candidates.append(alias)
+        elif min_shared > 0:
+            # The alias shares at least min_shared trigrams with the query, 
+            # so it shares one of ANY 3 * max_distance + 1 of them:
+            query_trigrams = sorted(trigrams(query), 
+                                    key=lambda t: len(postings.get(t, ())))
+            candidates = set()
+            for trigram in query_trigrams[:3 * max_distance + 1]:
+                for number in postings.get(trigram, ()):
+                    candidates.add(self.aliases[number])
+        else:
+            # A very short query, compare every alias of a similar length:
+            candidates = []
+            for length in range(len(query) - max_distance, 
+                                len(query) + max_distance + 1):
+                candidates.extend(self.by_length.get(length, ()))
+        
+        found = []
+        for alias in candidates:
+            if abs(len(alias) - len(query)) > max_distance:
+                continue
+            distance = edit_distance(query, alias, max_distance)
+            if distance <= max_distance:
+                found.append((distance, alias))
+        found.sort()
+        return found[:limit]
+    
+    def suggest(self, query, limit=3):
+        """Return up to limit aliases that query probably meant
+        
+        The nearest aliases by edit distance come first. Iff there are none, the aliases that start with query are returned, e.g. "lexa" --> "lexapro".
+        
+        """
+        
+        query = query.lower()
+        suggestions = [alias for distance, alias in
+                       self.similar(query, limit=limit) if alias != query]
+        if not suggestions:
+            suggestions = [alias for alias in self.prefix(query, limit)
+                           if alias != query]
+        return suggestions
@@ -4,6 +4,9 @@ class DehrError(Exception):
     """A base Exception class, make sub-classes for specific modules"""
     
     def __init__(self, description, more=''):
+        # Exception.__init__() sets self.args, which pickle needs to send 
+        # the error from a worker process back to the parent process:
+        Exception.__init__(self, description, more)
         self.description = description
         self.more = more
     
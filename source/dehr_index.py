@@ -0,0 +1,243 @@
+# File dehr_index.py
+# 
+# The alias index is a compact binary copy of all_page_data.py. build.py
+# loads AllPageData.prior from it without exec() and without reading every
+# alias into memory: aliases are looked up in a hash table in a mmap of the
+# file.
+# 
+# File layout, every integer is unsigned 32-bit little-endian:
+# 
+#     header      See HEADER_FORMAT.
+#     titles      JSON list of [title, page_filename] pairs, in page order.
+#     slots       Open addressing hash table of the aliases, see SLOT_FORMAT.
+#     heap        The bytes of every alias and every page filename.
+
+from collections import OrderedDict
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+
+from dehr_helpers import *
+
+
+class AliasIndexError(DehrError):
+    pass
+
+
+INDEX_MAGIC = 'DEHRAPD1'
+
+# Magic, SHA-1 hex digest of the all_page_data.py written with this index,
+# length of the titles in bytes, number of slots, number of aliases:
+HEADER_FORMAT = '<8s40sIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Offset and length of the alias, offset and length of the page filename.
+# Offsets are from the start of the file. A slot is empty iff its alias
+# length is EMPTY_SLOT.
+SLOT_FORMAT = '<IIII'
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+EMPTY_SLOT = 0xFFFFFFFF
+
+
+def slot_of(alias, mask):
+    return zlib.crc32(alias) & mask
+
+
+def text_hash(text):
+    return hashlib.sha1(text).hexdigest()
+
+
+def write_index(filepathname, part, source_hash):
+    """Save the titles and aliases of an AllPageDataPart as an alias index
+    
+    The file is written to a temporary name and then renamed, so an AliasIndex that is still open keeps its own (old) copy of the file.
+    
+    Arguments:
+        filepathname:   String, e.g. ".../source/all_page_data.idx".
+        
+        part:           AllPageDataPart object.
+        
+        source_hash:    String, text_hash() of the all_page_data.py that
+                        holds the same data.
+    
+    """
+    
+    titles_bytes = json.dumps(list(part.titles.items()), separators=(',', ':'))
+    num_aliases = len(part.aliases)
+    num_slots = 8
+    while num_slots < 2 * num_aliases:
+        num_slots *= 2
+    mask = num_slots - 1
+    
+    heap_offset = HEADER_SIZE + len(titles_bytes) + num_slots * SLOT_SIZE
+    heap = []
+    heap_size = 0
+    value_spans = {}
+    slots = [None] * num_slots
+    for alias, page_filename in part.aliases.items():
+        if page_filename not in value_spans:
+            value_spans[page_filename] = (heap_offset + heap_size,
+                                          len(page_filename))
+            heap.append(page_filename)
+            heap_size += len(page_filename)
+        slot = slot_of(alias, mask)
+        while slots[slot] != None:
+            slot = (slot + 1) & mask
+        slots[slot] = (heap_offset + heap_size, len(alias)) + (
+            value_spans[page_filename])
+        heap.append(alias)
+        heap_size += len(alias)
+    
+    o = [struct.pack(HEADER_FORMAT, INDEX_MAGIC, source_hash,
+                     len(titles_bytes), num_slots, num_aliases)]
+    o.append(titles_bytes)
+    pack = struct.Struct(SLOT_FORMAT).pack
+    empty = pack(0, EMPTY_SLOT, 0, 0)
+    for slot_value in slots:
+        if slot_value == None:
+            o.append(empty)
+        else:
+            o.append(pack(*slot_value))
+    o.extend(heap)
+    
+    temp_filepathname = filepathname + '.tmp'
+    index_file = open(temp_filepathname, 'wb')
+    index_file.write(''.join(o))
+    index_file.close()
+    os.rename(temp_filepathname, filepathname)
+
+
+class AliasIndex(object):
+    """A read-only, dict-like view of the aliases in an alias index file
+    
+    Only get(), [], in, and len() are supported, which is all AllPageData.find_url() needs. Nothing is read until it is looked up.
+    
+    Attributes:
+        filepathname:   String, the index file.
+        
+        source_hash:    String, see write_index().
+        
+        titles:         OrderedDict, title --> page_filename. Unlike the
+                        aliases, the titles are read into memory.
+    
+    """
+    
+    def __init__(self, filepathname):
+        self.filepathname = filepathname
+        self.open()
+    
+    def open(self):
+        index_file = open(self.filepathname, 'rb')
+        try:
+            self.mm = mmap.mmap(index_file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        finally:
+            index_file.close()
+        if len(self.mm) < HEADER_SIZE:
+            raise AliasIndexError(
+                "The alias index %s is truncated." % self.filepathname)
+        (magic, self.source_hash, titles_length, self.num_slots,
+         self.num_aliases) = struct.unpack_from(HEADER_FORMAT, self.mm)
+        if magic != INDEX_MAGIC:
+            raise AliasIndexError(
+                "The file %s is not an alias index." % self.filepathname)
+        self.slots_offset = HEADER_SIZE + titles_length
+        self.mask = self.num_slots - 1
+        self.unpack_slot = struct.Struct(SLOT_FORMAT).unpack_from
+        
+        self.titles = OrderedDict()
+        titles_json = self.mm[HEADER_SIZE:self.slots_offset]
+        for title, page_filename in json.loads(titles_json):
+            self.titles[title.encode('utf-8')] = page_filename.encode('utf-8')
+    
+    def close(self):
+        self.mm.close()
+    
+    def get(self, alias, default=None):
+        if isinstance(alias, unicode):
+            alias = alias.encode('utf-8')
+        mm = self.mm
+        slot = slot_of(alias, self.mask)
+        while True:
+            key_offset, key_length, value_offset, value_length = (
+                self.unpack_slot(mm, self.slots_offset + slot * SLOT_SIZE))
+            if key_length == EMPTY_SLOT:
+                return default
+            if (key_length == len(alias) and
+                    mm[key_offset:key_offset+key_length] == alias):
+                return mm[value_offset:value_offset+value_length]
+            slot = (slot + 1) & self.mask
+    
+    def __getitem__(self, alias):
+        page_filename = self.get(alias)
+        if page_filename == None:
+            raise KeyError(alias)
+        return page_filename
+    
+    def __contains__(self, alias):
+        return self.get(alias) != None
+    
+    def __len__(self):
+        return self.num_aliases
+    
+    def __getstate__(self):
+        """A mmap can't be pickled, so pickle the file name and reopen it"""
+        return {'filepathname': self.filepathname}
+    
+    def __setstate__(self, state):
+        self.filepathname = state['filepathname']
+        self.open()
+
+
+# One line of all_page_data.py, as written by build.od_to_str(). A string is 
+# the repr() of a str, which is quoted with ' or ".
+py_str = r"'(?:[^'\\\n]|\\.)*'" + '|' + r'"(?:[^"\\\n]|\\.)*"'
+py_line_pat = re.compile(r"""
+    (?P<blank>\#.*|)$|
+    (?P<name>[A-Za-z_]\w*)\ =\ OrderedDict\(\[$|
+    \ {4}\((?P<key>%s),\ (?P<value>%s)\),$|
+    (?P<end>\]\))$
+""" % (py_str, py_str), re.VERBOSE)
+
+def unquote(py_str):
+    return py_str[1:-1].decode('string_escape')
+
+
+def parse_py_export(apd_str):
+    """Return (titles, aliases) from the text of an all_page_data.py file
+    
+    The file is parsed line by line, it is NOT executed. Every line must be in the format that build.od_to_str() writes, anything else raises an AliasIndexError.
+    
+    Returns:
+        titles:         OrderedDict, the all_page_titles variable.
+        
+        aliases:        OrderedDict, the all_page_aliases variable.
+    
+    """
+    
+    variables = {}
+    od = None
+    for line_number, line in enumerate(apd_str.split('\n'), 1):
+        mtch = py_line_pat.match(line)
+        if mtch == None:
+            raise AliasIndexError(
+                "Line %s of all_page_data.py is not in the format that "
+                "od_to_str() writes:\n%s" % (line_number, line[:60]))
+        if mtch.group('key') != None and od != None:
+            od[unquote(mtch.group('key'))] = unquote(mtch.group('value'))
+        elif mtch.group('name') != None and od == None:
+            od = variables[mtch.group('name')] = OrderedDict()
+        elif mtch.group('end') != None and od != None:
+            od = None
+        elif mtch.group('blank') == None:
+            raise AliasIndexError(
+                "Line %s of all_page_data.py is out of place:\n%s" % 
+                (line_number, line[:60]))
+    if od != None or not ('all_page_titles' in variables and 
+                          'all_page_aliases' in variables):
+        raise AliasIndexError("all_page_data.py is incomplete.")
+    return variables['all_page_titles'], variables['all_page_aliases']
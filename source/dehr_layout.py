@@ -0,0 +1,146 @@
+# File dehr_layout.py
+# 
+# Renders the layout template of a page (base.html) without Django. The
+# layout is rendered by Django once per "shape" of page context, with a probe
+# string in place of every title and name, and the output is cut at the
+# probes into a LayoutSkeleton. Every later page of the same shape is
+# rendered by filling its own values into the skeleton. See
+# build.PageRenderer.render_shaped().
+
+import re
+
+from django.utils.encoding import force_text
+from django.utils.html import conditional_escape
+
+
+# The layout compares these variables with constants, e.g.
+# {% ifnotequal page_type 'Index' %}, so their values are part of the shape
+# instead of being probed:
+SHAPE_VALUE_VARIABLES = ['page_type']
+
+# Every probe has these characters, so the skeleton can tell the values that
+# the layout escapes, e.g. {{ page_title }}, from the ones it does not, e.g.
+# {{ page_title|safe }}:
+PROBE_BODY = u'<&>"\''
+
+probe_pat = re.compile(u'\x01(\\d+)(%s|%s)\x02' % (
+    re.escape(PROBE_BODY), re.escape(conditional_escape(PROBE_BODY))))
+
+
+def probe(number):
+    return u'\x01%d%s\x02' % (number, PROBE_BODY)
+
+
+def probe_item(item, values):
+    """Return (probed item, its shape) of one list item, or None"""
+    if isinstance(item, basestring):
+        if not item:
+            return item, False
+        values.append(item)
+        return probe(len(values) - 1), True
+    if isinstance(item, list):
+        probed = []
+        for string in item:
+            if not isinstance(string, basestring):
+                return None
+            probed.append(probe_item(string, values))
+        return ([probed_string for probed_string, shape in probed], 
+                tuple(shape for probed_string, shape in probed))
+    return None
+
+
+def context_shape(page_layer, skip=()):
+    """Split the context variables of a page into its shape and its values
+    
+    Every non-empty string, alone, in a list, or in a list of lists (e.g. [[title, url], ...]), is a value, and it is replaced by a probe. Everything else is part of the shape: None, booleans, empty strings, the length of each list, and the SHAPE_VALUE_VARIABLES. Two pages with the same shape take the same path through the layout, so only their values differ in the output.
+    
+    Arguments:
+        page_layer:     Dict, the context variables of one page, see
+                        build.PageRenderer.page_layer().
+        
+        skip:           Names of variables that are left out, e.g. 'apd'.
+    
+    Returns:
+        None iff some variable is neither a string, a list of strings or of lists of strings, a boolean, nor None. Otherwise, a tuple:
+        
+        shape:          Tuple, hashable, the same for pages of the same shape.
+        
+        probe_layer:    Dict, page_layer with a probe in place of each value.
+        
+        values:         List of the values, probe(i) stands for values[i].
+    
+    """
+    
+    shape = []
+    probe_layer = {}
+    values = []
+    for name in sorted(page_layer):
+        if name in skip:
+            continue
+        value = page_layer[name]
+        if (isinstance(value, basestring) and value and
+                name not in SHAPE_VALUE_VARIABLES):
+            probe_layer[name] = probe(len(values))
+            values.append(value)
+            shape.append((name, True))
+        elif isinstance(value, list):
+            items = []
+            for item in value:
+                probed = probe_item(item, values)
+                if probed == None:
+                    return None
+                items.append(probed)
+            probe_layer[name] = [probed_item for probed_item, item_shape 
+                                 in items]
+            shape.append((name, tuple(item_shape for probed_item, item_shape 
+                                      in items)))
+        elif value == None or isinstance(value, (bool, basestring)):
+            probe_layer[name] = value
+            shape.append((name, value))
+        else:
+            return None
+    return tuple(shape), probe_layer, values
+
+
+class LayoutSkeleton(object):
+    """A layout rendered with probes, cut at every probe
+    
+    Attributes:
+        chunks:         List of unicode strings, the output between the
+                        probes. There is one more chunk than holes.
+        
+        holes:          List of (number, escaped) pairs, one per probe in
+                        the output. number is the index of the value, escaped is True iff the layout escaped it.
+        
+        complete:       Boolean, False iff a probe was changed by the layout
+                        (e.g. by a filter like |upper), so the skeleton can't be filled.
+        
+        templates:      List of the template names the layout used, see
+                        dehr_manifest.RecordingLoader.
+    
+    """
+    
+    def __init__(self, rendered, templates):
+        self.chunks = []
+        self.holes = []
+        pos = 0
+        for mtch in probe_pat.finditer(rendered):
+            self.chunks.append(rendered[pos:mtch.start()])
+            self.holes.append((int(mtch.group(1)),
+                               mtch.group(2) != PROBE_BODY))
+            pos = mtch.end()
+        self.chunks.append(rendered[pos:])
+        self.complete = not any(u'\x01' in chunk or u'\x02' in chunk
+                                for chunk in self.chunks)
+        self.templates = templates
+    
+    def fill(self, values):
+        """Return the layout of the page with these values, see context_shape()"""
+        o = [self.chunks[0]]
+        for (number, escaped), chunk in zip(self.holes, self.chunks[1:]):
+            text = force_text(values[number])
+            if escaped:
+                text = conditional_escape(text)
+            o.append(text)
+            o.append(chunk)
+        return u''.join(o)
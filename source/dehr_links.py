@@ -0,0 +1,214 @@
+# File dehr_links.py
+# 
+# The link graph of the website: the page that each {% link %} of each page
+# resolved to, and the other way around, the pages that link to each page.
+# It is built from the lookups in the build manifest, see
+# dehr_manifest.PageEntry, and saved to source/link_graph.json after every
+# build, with the "What links here" list of every page and every broken
+# link. build.PageRenderer renders the What links here list of each page
+# from it.
+
+from collections import OrderedDict
+import json
+import os
+
+from dehr_helpers import *
+
+
+# In the source directory:
+LINK_GRAPH_FILENAME = 'link_graph.json'
+
+LINK_GRAPH_VERSION = 1
+
+
+def to_str(value):
+    # The manifest and the saved graph are JSON, so they have unicode:
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class LinkGraph(object):
+    """The links between the pages of one build
+    
+    The graph is updated one page at a time, see set_page() and remove_page(), so watch mode never builds it again from scratch.
+    
+    Attributes:
+        links:          Dict, page_filename --> dict, lowercase alias --> the
+                        page filename it resolved to, or None iff it is a broken link. The same as PageEntry.lookups.
+        
+        titles:         Dict, page_filename --> its title, for the What links
+                        here lists.
+        
+        alias_pages:    Dict, lowercase alias --> set of the pages that
+                        looked it up. Iff the alias is removed or renamed, these pages, and only these, must be compiled again.
+        
+        target_pages:   Dict, page_filename --> set of the OTHER pages that
+                        link to it. The pages that link to every page, e.g. the Index page, are left out, they would be in every What links here list.
+        
+        lists_all:      Set of the pages that link to every page, see
+                        dehr_manifest.PageEntry.titles_hash.
+    
+    """
+    
+    def __init__(self):
+        self.links = {}
+        self.titles = {}
+        self.alias_pages = {}
+        self.target_pages = {}
+        self.lists_all = set()
+    
+    @classmethod
+    def from_manifest(cls, manifest):
+        """Return the LinkGraph of every page of a BuildManifest with output"""
+        graph = cls()
+        for page_filename, entry in manifest.pages.items():
+            if entry.output:
+                graph.set_page(page_filename, entry)
+        return graph
+    
+    @staticmethod
+    def filepathname(base_dir):
+        return os.path.join(base_dir, 'source', LINK_GRAPH_FILENAME)
+    
+    @classmethod
+    def load(cls, base_dir):
+        """Return the saved LinkGraph, or an empty one
+        
+        The saved graph is only where a build starts from, every page it got wrong is compiled again, see build.build_all(). So a missing or broken file is not an error.
+        
+        """
+        
+        graph = cls()
+        try:
+            graph_file = open(cls.filepathname(base_dir), 'rb')
+        except IOError:
+            return graph
+        try:
+            json_dict = json.load(graph_file)
+        except ValueError:
+            return graph
+        finally:
+            graph_file.close()
+        if json_dict.get('version') != LINK_GRAPH_VERSION:
+            return graph
+        try:
+            for page_filename, title, lookups, lists_all in json_dict['pages']:
+                graph.add_links(to_str(page_filename), title, lookups, 
+                                lists_all)
+        except (KeyError, TypeError, ValueError):
+            return cls()
+        return graph
+    
+    def save(self, base_dir):
+        graph_file = open(self.filepathname(base_dir), 'wb')
+        json.dump(self.to_json_dict(), graph_file, indent=1)
+        graph_file.close()
+    
+    def to_json_dict(self):
+        return OrderedDict([
+            ('version', LINK_GRAPH_VERSION),
+            ('pages', [[page_filename, self.titles[page_filename],
+                        sorted(self.links[page_filename].items()),
+                        page_filename in self.lists_all]
+                       for page_filename in sorted(self.links)]),
+            ('backlinks', OrderedDict(
+                (page_filename, sorted(self.target_pages[page_filename]))
+                for page_filename in sorted(self.target_pages))),
+            ('broken', self.broken_links()),
+        ])
+    
+    def add_links(self, page_filename, title, lookups, lists_all=False):
+        """Add the links of a page that is not in the graph
+        
+        Returns:
+            targets:    Set of the pages whose What links here list it is in.
+        
+        """
+        
+        if lists_all:
+            self.lists_all.add(page_filename)
+        targets = set()
+        links = {}
+        for alias, target in lookups:
+            alias = to_str(alias)
+            target = to_str(target)
+            links[alias] = target
+            self.alias_pages.setdefault(alias, set()).add(page_filename)
+            if (target != None and target != page_filename and 
+                    not lists_all):
+                self.target_pages.setdefault(target, set()).add(page_filename)
+                targets.add(target)
+        self.links[page_filename] = links
+        self.titles[page_filename] = to_str(title)
+        return targets
+    
+    def set_page(self, page_filename, entry):
+        """Add or replace the links of one page, see remove_page()
+        
+        Arguments:
+            entry:      dehr_manifest.PageEntry object of the page.
+        
+        """
+        
+        changed = self.remove_page(page_filename)
+        title = page_filename
+        if entry.titles:
+            title = entry.titles[0][0]
+        changed.update(self.add_links(page_filename, title,
+                                      entry.lookups.items(),
+                                      entry.titles_hash != None))
+        return changed
+    
+    def remove_page(self, page_filename):
+        """Remove the links of one page
+        
+        Returns:
+            changed:    Set of the pages whose What links here list may have
+                        changed, every page that it linked to.
+        
+        """
+        
+        changed = set()
+        links = self.links.pop(page_filename, None)
+        if links == None:
+            return changed
+        del self.titles[page_filename]
+        lists_all = (page_filename in self.lists_all)
+        self.lists_all.discard(page_filename)
+        for alias, target in links.items():
+            pages = self.alias_pages[alias]
+            pages.discard(page_filename)
+            if not pages:
+                del self.alias_pages[alias]
+            if (target != None and target != page_filename and 
+                    not lists_all):
+                pages = self.target_pages[target]
+                pages.discard(page_filename)
+                if not pages:
+                    del self.target_pages[target]
+                changed.add(target)
+        return changed
+    
+    def backlinks(self, page_filename):
+        """Return the What links here list of a page, [title, page_filename] pairs"""
+        return [[self.titles[source], source] for source in
+                sorted(self.target_pages.get(page_filename, ()))]
+    
+    def dependents(self, aliases):
+        """Return the set of the pages that looked up any of the aliases"""
+        pages = set()
+        for alias in aliases:
+            pages.update(self.alias_pages.get(alias, ()))
+        return pages
+    
+    def broken_links(self):
+        """Return an OrderedDict, page_filename --> its sorted broken aliases"""
+        broken = OrderedDict()
+        for page_filename in sorted(self.links):
+            aliases = sorted(alias for alias, target in
+                             self.links[page_filename].items()
+                             if target == None)
+            if aliases:
+                broken[page_filename] = aliases
+        return broken
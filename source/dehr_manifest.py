@@ -0,0 +1,368 @@
+# File dehr_manifest.py
+# 
+# The build manifest remembers, for every page, the inputs that produced its
+# output file. build.py uses it to skip pages whose inputs did not change,
+# see build_all() and the --incremental option.
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+import django.template.loaders.cached
+
+from dehr_helpers import *
+
+
+class ManifestError(DehrError):
+    pass
+
+
+MANIFEST_VERSION = 4
+
+# Every page is compiled by this Python code:
+CODE_DEPENDENCIES = ['build.py', 'dehr_helpers.py', 'dehr_index.py', 
+                     'dehr_layout.py', 'dehr_links.py', 'dehr_manifest.py', 
+                     'dehr_parse_cache.py', 'dehr_parser.py', 
+                     'dehr_template_tags.py']
+
+
+def file_hash(filepathname):
+    """Return the SHA-1 hex digest of the contents of a file"""
+    a_file = open(filepathname, 'rb')
+    digest = hashlib.sha1(a_file.read()).hexdigest()
+    a_file.close()
+    return digest
+
+
+def titles_hash(titles):
+    """Return the SHA-1 hex digest of a list of page titles"""
+    return hashlib.sha1('\n'.join(titles)).hexdigest()
+
+
+def code_hashes():
+    """Hash every Python file that compiles the pages
+    
+    The code is always loaded from THIS directory, even when base_dir points somewhere else.
+    
+    Returns:
+        Dict, e.g. 'build.py' --> SHA-1 hex digest.
+    
+    """
+    
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    hashes = {}
+    for name in CODE_DEPENDENCIES:
+        hashes[name] = file_hash(os.path.join(code_dir, name))
+    return hashes
+
+
+def template_hashes(base_dir):
+    """Hash every file in source/templates, ONCE per build
+    
+    Returns:
+        Dict, e.g. 'base.html' --> SHA-1 hex digest.
+    
+    """
+    
+    templates_dir = os.path.join(base_dir, 'source', 'templates')
+    hashes = {}
+    for name in os.listdir(templates_dir):
+        filepathname = os.path.join(templates_dir, name)
+        if os.path.isfile(filepathname):
+            hashes[name] = file_hash(filepathname)
+    return hashes
+
+
+def str_pairs(pairs):
+    """Convert a list of pairs from json.load() to a list of [str, str]
+    
+    json.load() returns unicode objects, but the titles and aliases are written to all_page_data.py, which uses str.
+    
+    """
+    
+    return [[k.encode('utf-8'), v.encode('utf-8')] for k, v in pairs]
+
+
+class RecordingLoader(django.template.loaders.cached.Loader):
+    """The cached template Loader, but it can record which templates are used
+    
+    Every {% extends %}, {% include %}, and inclusion tag asks the Loader for its template, even when the compiled template is already cached. Between start_recording() and stop_recording(), the names of those templates are remembered.
+    
+    Attributes:
+        used:       Set of template names, or None iff not recording.
+    
+    """
+    
+    def __init__(self, engine, loaders):
+        super(RecordingLoader, self).__init__(engine, loaders)
+        self.used = None
+    
+    def get_template(self, template_name, template_dirs=None, skip=None):
+        template = super(RecordingLoader, self).get_template(
+            template_name, template_dirs, skip)
+        if self.used != None:
+            self.used.add(template_name)
+        return template
+    
+    def start_recording(self):
+        self.used = set()
+    
+    def stop_recording(self):
+        """Stop recording, return a sorted list of the template names"""
+        used = sorted(self.used)
+        self.used = None
+        return used
+
+
+class PageEntry(object):
+    """Everything the manifest remembers about one page
+    
+    Attributes:
+        source_hash:    String, SHA-1 hex digest of the page source file.
+        
+        source_stat:    List [mtime, size] of the page source file. Iff the
+                        stat has not changed, the file is not hashed again.
+        
+        templates:      List of the names of the templates the page used,
+                        see RecordingLoader.
+        
+        lookups:        Dict, every lowercase alias that the page
+                        looked up with AllPageData.find_url(), mapped to the page filename it resolved to, or to None iff it was a broken link.
+        
+        titles_hash:    String or None. Iff the page used the list of all
+                        page titles (e.g. the Index page), this is titles_hash() of that list.
+        
+        titles:         List of [title, page_filename] pairs, what the page
+                        added to AllPageData.next.titles.
+        
+        aliases:        List of [alias, page_filename] pairs, what the page
+                        added to AllPageData.next.aliases.
+        
+        output:         Boolean, True iff the page wrote a file to build/.
+        
+        output_hash:    String or None, SHA-1 hex digest of the file in 
+                        build/, see dehr_output.OutputWriter.
+        
+        output_size:    Integer or None, the size of that file.
+        
+        backlinks:      List of [title, page_filename] pairs, the What links 
+                        here list the page was rendered with, see dehr_links.LinkGraph.backlinks().
+        
+        timing:         Dict or None, see dehr_profile.page_timing(). It is 
+                        NOT saved in the manifest.
+        
+        parse_cache_hit:    Boolean, True iff the page came from the parse 
+                            cache, or None iff no parse cache was used. It is NOT saved in the manifest.
+        
+        fast_path:      Boolean, True iff the page was rendered without 
+                        Django, see build.PageRenderer, or None iff that was not recorded. It is NOT saved in the manifest.
+        
+        output_written: Boolean, False iff the output was the same as the 
+                        file already in build/, so it was left alone, or None iff that was not recorded. It is NOT saved in the manifest.
+    
+    """
+    
+    def __init__(self):
+        self.source_hash = None
+        self.source_stat = None
+        self.templates = []
+        self.lookups = {}
+        self.titles_hash = None
+        self.titles = []
+        self.aliases = []
+        self.output = False
+        self.output_hash = None
+        self.output_size = None
+        self.backlinks = []
+        self.timing = None
+        self.parse_cache_hit = None
+        self.fast_path = None
+        self.output_written = None
+    
+    def to_json_dict(self):
+        return OrderedDict([
+            ('source_hash', self.source_hash),
+            ('source_stat', self.source_stat),
+            ('templates', self.templates),
+            ('lookups', sorted(self.lookups.items())),
+            ('titles_hash', self.titles_hash),
+            ('titles', self.titles),
+            ('aliases', self.aliases),
+            ('output', self.output),
+            ('output_hash', self.output_hash),
+            ('output_size', self.output_size),
+            ('backlinks', self.backlinks),
+        ])
+    
+    @classmethod
+    def from_json_dict(cls, json_dict):
+        """The inverse of to_json_dict()
+        
+        This runs once per page on every incremental build, so only the titles, aliases, and backlinks are converted to str. The hashes, template names, and lookups stay unicode: they are only compared, and an ASCII unicode object is equal to the same str. A non-ASCII one is not, so at worst the page is compiled again.
+        
+        """
+        
+        entry = cls.__new__(cls)
+        entry.source_hash = json_dict['source_hash']
+        entry.source_stat = json_dict['source_stat']
+        entry.templates = json_dict['templates']
+        entry.lookups = dict(json_dict['lookups'])
+        entry.titles_hash = json_dict['titles_hash']
+        entry.titles = str_pairs(json_dict['titles'])
+        entry.aliases = str_pairs(json_dict['aliases'])
+        entry.output = json_dict['output']
+        entry.output_hash = json_dict['output_hash']
+        entry.output_size = json_dict['output_size']
+        entry.backlinks = str_pairs(json_dict['backlinks'])
+        entry.timing = None
+        entry.parse_cache_hit = None
+        entry.fast_path = None
+        entry.output_written = None
+        return entry
+
+
+class BuildManifest(object):
+    """The inputs of every page of the last build, saved as a JSON file
+    
+    The manifest is only saved after a build succeeds, so every PageEntry was compiled with the code_hashes and template_hashes saved next to it.
+    
+    Attributes:
+        pages:              Dict, page_filename --> PageEntry.
+        
+        code_hashes:        Dict, see code_hashes().
+        
+        template_hashes:    Dict, see template_hashes().
+        
+        changed:            Boolean, True iff self differs from the saved
+                            file.
+    
+    """
+    
+    def __init__(self):
+        self.pages = {}
+        self.code_hashes = {}
+        self.template_hashes = {}
+        self.changed = True
+    
+    @staticmethod
+    def filepathname(base_dir):
+        return os.path.join(base_dir, 'source', 'build_manifest.json')
+    
+    @classmethod
+    def load(cls, base_dir):
+        """Return the saved BuildManifest, or an empty one iff there is none"""
+        manifest = cls()
+        manifest_filepath = cls.filepathname(base_dir)
+        if not os.path.exists(manifest_filepath):
+            return manifest
+        manifest_file = open(manifest_filepath, 'rb')
+        try:
+            json_dict = json.load(manifest_file)
+        except ValueError as err:
+            raise ManifestError(
+                "The build manifest %s is not valid JSON. Delete it, or "
+                "build once without --incremental." % manifest_filepath,
+                str(err))
+        finally:
+            manifest_file.close()
+        if json_dict.get('version') != MANIFEST_VERSION:
+            # An old format, start from scratch:
+            return manifest
+        manifest.code_hashes = json_dict['code']
+        manifest.template_hashes = json_dict['templates']
+        # A plain dict, an OrderedDict is much slower to fill in Python 2:
+        manifest.pages = dict(
+            (page_filename.encode('utf-8'), PageEntry.from_json_dict(entry_dict))
+            for page_filename, entry_dict in json_dict['pages'])
+        manifest.changed = False
+        return manifest
+    
+    def save(self, base_dir):
+        json_dict = OrderedDict([
+            ('version', MANIFEST_VERSION),
+            ('code', self.code_hashes),
+            ('templates', self.template_hashes),
+            ('pages', [[page_filename, entry.to_json_dict()]
+                       for page_filename, entry in sorted(self.pages.items())]),
+        ])
+        manifest_file = open(self.filepathname(base_dir), 'wb')
+        json.dump(json_dict, manifest_file, separators=(',', ':'))
+        manifest_file.close()
+        self.changed = False
+    
+    def output_hashes(self):
+        """Return a dict, page_filename --> [output_hash, output_size], see dehr_output.OutputWriter"""
+        return dict((page_filename, [entry.output_hash, entry.output_size]) 
+                    for page_filename, entry in self.pages.items() 
+                    if entry.output_hash != None)
+    
+    def set_entry(self, page_filename, entry):
+        self.pages[page_filename] = entry
+        self.changed = True
+    
+    def keep_only(self, page_filenames):
+        """Forget every page that is not in page_filenames"""
+        keep = set(page_filenames)
+        for page_filename in list(self.pages):
+            if page_filename not in keep:
+                del self.pages[page_filename]
+                self.changed = True
+    
+    def check_code(self, code_hashes):
+        """Forget every page iff the Python code changed since the last build
+        
+        This is checked ONCE per build, not once per page.
+        
+        """
+        
+        if self.code_hashes != code_hashes:
+            self.pages = {}
+            self.changed = True
+    
+    def is_fresh(self, base_dir, page_filename, template_hashes, prior):
+        """Return True iff the output of page_filename is up to date
+        
+        Arguments:
+            base_dir:           String, usually BASE_DIR.
+            
+            page_filename:      String, e.g. "lexapro.html".
+            
+            template_hashes:    Dict, see template_hashes(), the templates
+                                of THIS build.
+            
+            prior:              AllPageDataPart, the aliases and titles that
+                                {% link %} will use in THIS build.
+        
+        """
+        
+        entry = self.pages.get(page_filename, None)
+        if entry == None:
+            return False
+        for name in entry.templates:
+            if template_hashes.get(name) != self.template_hashes.get(name):
+                return False
+        
+        page_filepathname = os.path.join(base_dir, 'source', 'pages',
+                                         page_filename)
+        stat = os.stat(page_filepathname)
+        source_stat = [stat.st_mtime, stat.st_size]
+        if entry.source_stat != source_stat:
+            # Maybe it was only touched, look at the contents:
+            if entry.source_hash != file_hash(page_filepathname):
+                return False
+            entry.source_stat = source_stat
+            self.changed = True
+        
+        for alias, page_filename_was in entry.lookups.iteritems():
+            if prior.aliases.get(alias, None) != page_filename_was:
+                return False
+        if entry.titles_hash != None:
+            if entry.titles_hash != titles_hash(prior.get_titles()):
+                return False
+        
+        if entry.output:
+            out_filepathname = os.path.join(base_dir, 'build', page_filename)
+            if not os.path.exists(out_filepathname):
+                return False
+        return True
@@ -0,0 +1,230 @@
+# File dehr_output.py
+# 
+# Writes the output files of the build to build/. Each page is rendered into
+# an OutputFile, which hashes it as it is written. Iff the hash and the size
+# are the same as in the build manifest of the last build, the file in build/
+# is left alone, so its mtime does not change and rsync does not upload it
+# again. Otherwise the file is replaced atomically, by writing a temporary
+# file and renaming it, in a background thread of the OutputWriter, so the
+# next page is rendered in the meantime. See build.compile_one_page().
+
+import hashlib
+import os
+import Queue
+import threading
+import traceback
+
+from dehr_helpers import *
+
+
+class OutputError(DehrError):
+    pass
+
+
+# The number of background threads of an OutputWriter:
+OUTPUT_WRITER_THREADS = 2
+
+# An output file bigger than this (bytes) is written to its temporary file
+# WHILE it is rendered, instead of being kept in memory, see OutputFile:
+OUTPUT_SPOOL_BYTES = 2**20
+
+# At most this many output files wait for a thread, then OutputFile.close()
+# waits too, so a slow disk can't fill the memory:
+OUTPUT_QUEUE_SIZE = 64
+
+
+def temp_filepathname(filepathname):
+    """Return the temporary name of an output file, a hidden file next to it"""
+    dir_name, filename = os.path.split(filepathname)
+    return os.path.join(dir_name, '.%s.%s.tmp' % (filename, os.getpid()))
+
+
+def write_atomically(filepathname, data):
+    """Write data to a temporary file, then rename it to filepathname
+    
+    A reader of filepathname, e.g. rsync or the --watch server, sees either the old file or the new one, never half of it.
+    
+    """
+    
+    temp_name = temp_filepathname(filepathname)
+    temp_file = open(temp_name, 'wb')
+    try:
+        temp_file.write(data)
+        temp_file.close()
+        os.rename(temp_name, filepathname)
+    except:
+        temp_file.close()
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
+class OutputFile(object):
+    """One output file of OutputWriter.open(), write() the page into it, then close() it
+    
+    The data is kept in memory up to OUTPUT_SPOOL_BYTES. A bigger file is streamed to its temporary file instead, so the memory used by a huge page stays bounded, see build.write_page().
+    
+    Attributes:
+        writer:         OutputWriter object.
+        
+        key:            String, e.g. the page filename "lexapro.html".
+        
+        filepathname:   String, the output file in build/.
+        
+        sha:            hashlib SHA-1 object of everything written so far.
+        
+        size:           Integer, the number of bytes written so far.
+        
+        chunks:         List of strings, the data, iff it is kept in memory.
+        
+        temp_file:      File object or None, the temporary file iff the data
+                        did not fit in memory.
+    
+    """
+    
+    def __init__(self, writer, key, filepathname):
+        self.writer = writer
+        self.key = key
+        self.filepathname = filepathname
+        self.sha = hashlib.sha1()
+        self.size = 0
+        self.chunks = []
+        self.temp_file = None
+    
+    def write(self, data):
+        if isinstance(data, unicode):
+            # The same as the write() of a file, which encodes unicode with
+            # the default encoding:
+            data = data.encode('ascii')
+        self.sha.update(data)
+        self.size += len(data)
+        if self.temp_file != None:
+            self.temp_file.write(data)
+            return
+        self.chunks.append(data)
+        if self.size > OUTPUT_SPOOL_BYTES:
+            self.temp_file = open(temp_filepathname(self.filepathname), 'wb')
+            self.temp_file.write(''.join(self.chunks))
+            self.chunks = []
+    
+    def close(self):
+        """Leave the file alone iff it did not change, or have it written
+        
+        Returns:
+            written:    Boolean, False iff the file in build/ is the same.
+        
+        """
+        
+        digest = self.sha.hexdigest()
+        written = not self.writer.unchanged(self.key, self.filepathname,
+                                            digest, self.size)
+        if self.temp_file != None:
+            self.temp_file.close()
+            if written:
+                os.rename(self.temp_file.name, self.filepathname)
+            else:
+                os.remove(self.temp_file.name)
+        elif written:
+            self.writer.submit(self.filepathname, ''.join(self.chunks))
+        self.chunks = []
+        self.writer.record(self.key, digest, self.size, written)
+        return written
+    
+    def discard(self):
+        """Forget the data, e.g. because the page failed, and write nothing"""
+        self.chunks = []
+        if self.temp_file != None:
+            self.temp_file.close()
+            os.remove(self.temp_file.name)
+            self.temp_file = None
+
+
+class OutputWriter(object):
+    """Writes the output files of one round of a build
+    
+    The files are written by background threads, see submit(). finish() waits until every file is written, so call it before anything reads build/, e.g. before the manifest is saved.
+    
+    Attributes:
+        prior_hashes:   Dict, key --> [SHA-1 hex digest, size] of the file
+                        that is in build/ now, see dehr_manifest.BuildManifest.output_hashes(). It is updated as files are written.
+        
+        results:        Dict, key --> (SHA-1 hex digest, size, written) of
+                        every file closed since it was last popped, see build.compile_page_entry().
+        
+        num_threads:    Integer. Iff 0, every file is written right away by
+                        submit(), e.g. in the worker processes of build.py -j, which may exit before a thread is done.
+        
+        errors:         List of strings, the traceback of every write that
+                        failed in a thread.
+    
+    """
+    
+    def __init__(self, prior_hashes=None, num_threads=OUTPUT_WRITER_THREADS):
+        self.prior_hashes = dict(prior_hashes or {})
+        self.results = {}
+        self.num_threads = num_threads
+        self.errors = []
+        self.queue = None
+        self.threads = []
+    
+    def open(self, key, filepathname):
+        return OutputFile(self, key, filepathname)
+    
+    def unchanged(self, key, filepathname, digest, size):
+        """Return True iff the file in build/ already has this content"""
+        if self.prior_hashes.get(key) != [digest, size]:
+            return False
+        try:
+            return os.path.getsize(filepathname) == size
+        except OSError:
+            # It was deleted.
+            return False
+    
+    def record(self, key, digest, size, written):
+        self.prior_hashes[key] = [digest, size]
+        self.results[key] = (digest, size, written)
+    
+    def submit(self, filepathname, data):
+        """Write data to filepathname atomically, in a background thread"""
+        if self.num_threads == 0:
+            write_atomically(filepathname, data)
+            return
+        if not self.threads:
+            self.queue = Queue.Queue(OUTPUT_QUEUE_SIZE)
+            for i in range(self.num_threads):
+                thread = threading.Thread(target=self.run_thread,
+                                          name='OutputWriter-%s' % i)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        self.queue.put((filepathname, data))
+    
+    def run_thread(self):
+        while True:
+            job = self.queue.get()
+            if job == None:
+                return
+            filepathname, data = job
+            try:
+                write_atomically(filepathname, data)
+            except Exception:
+                # list.append() is atomic, no lock is needed:
+                self.errors.append("%s:\n%s" % (filepathname,
+                                                traceback.format_exc()))
+    
+    def close(self):
+        """Wait until every submitted file is written, and stop the threads"""
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.queue = None
+    
+    def finish(self):
+        """The same as close(), but raise an OutputError iff a write failed"""
+        self.close()
+        if self.errors:
+            raise OutputError(
+                "Could not write %s output file(s)." % len(self.errors),
+                self.errors[0])
@@ -0,0 +1,158 @@
+# File dehr_parse_cache.py
+# 
+# The parse cache remembers the title, metadata, and rendered content of
+# every page source it has seen, so build.py can skip the lexer and the
+# WholePageNode parse() and render() of a page that did not change. Unlike
+# the build manifest, a hit does not need the rest of the build to be the
+# same: a page whose templates or links changed is still compiled by
+# Django, but from the cached content. See ParseCache.
+
+from collections import OrderedDict
+import hashlib
+import marshal
+import os
+
+from dehr_helpers import *
+
+
+# The directory of the cache, in the source directory:
+PARSE_CACHE_DIRNAME = 'parse_cache'
+
+# The cache is pruned to this many bytes after a build, see ParseCache.prune():
+PARSE_CACHE_MAX_BYTES = 2**26
+
+# The result of a page source depends on this Python code:
+PARSER_DEPENDENCIES = ['dehr_helpers.py', 'dehr_parse_cache.py',
+                       'dehr_parser.py']
+
+# Cache files end with this, so prune() never touches anything else:
+SUFFIX = '.marshal'
+
+
+def parser_version():
+    """Return the SHA-1 hex digest of the parser code and the marshal format"""
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha1('marshal %s\n' % marshal.version)
+    for name in PARSER_DEPENDENCIES:
+        code_file = open(os.path.join(code_dir, name), 'rb')
+        sha.update(code_file.read())
+        code_file.close()
+    return sha.hexdigest()
+
+
+class ParseCache(object):
+    """A directory of parsed pages, one file per page source
+    
+    Each file is named after the SHA-1 of the parser version and the page source, and holds the marshal of (title, meta_dict items, content). marshal is used because it loads several times faster than pickle, and the parse result is only strings and lists.
+    
+    The cache is shared by the worker processes of build.py -j, so every file is written to a temporary name, then renamed. A file is never changed after that, and a reader sees either the whole file or none.
+    
+    The least recently used files are removed first, see prune(). A hit sets the mtime of its file, so the mtime is the time of the last use.
+    
+    Attributes:
+        cache_dir:  String, the directory of the cache files.
+        
+        version:    String, see parser_version().
+        
+        hits:       Integer, the number of get() calls that found the page.
+        
+        misses:     Integer, the number of get() calls that did not.
+        
+        max_bytes:  Integer, see prune().
+    
+    """
+    
+    def __init__(self, cache_dir, max_bytes=PARSE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.version = parser_version()
+        self.hits = 0
+        self.misses = 0
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            try:
+                os.mkdir(cache_dir)
+            except OSError:
+                # Another worker process made it first.
+                if not os.path.isdir(cache_dir):
+                    raise
+    
+    @classmethod
+    def for_base_dir(cls, base_dir):
+        return cls(os.path.join(base_dir, 'source', PARSE_CACHE_DIRNAME))
+    
+    def key(self, page_raw):
+        return hashlib.sha1(self.version + '\n' + page_raw).hexdigest()
+    
+    def filepathname(self, key):
+        return os.path.join(self.cache_dir, key + SUFFIX)
+    
+    def get(self, key):
+        """Return (title, meta_dict, content), or None iff key is not cached"""
+        filepathname = self.filepathname(key)
+        try:
+            cache_file = open(filepathname, 'rb')
+        except IOError:
+            self.misses += 1
+            return None
+        try:
+            title, meta_items, content = marshal.loads(cache_file.read())
+        except (EOFError, ValueError, TypeError):
+            # A broken file, e.g. from a full disk. Parse the page again,
+            # and put() replaces the file.
+            self.misses += 1
+            return None
+        finally:
+            cache_file.close()
+        try:
+            os.utime(filepathname, None)
+        except OSError:
+            # Pruned by another build in the meantime, no harm done.
+            pass
+        self.hits += 1
+        return title, OrderedDict(meta_items), content
+    
+    def put(self, key, title, meta_dict, content):
+        """Save the parse result of the page source with this key"""
+        data = marshal.dumps((title, meta_dict.items(), content))
+        temp_filepathname = '%s.%s.tmp' % (self.filepathname(key),
+                                           os.getpid())
+        temp_file = open(temp_filepathname, 'wb')
+        try:
+            temp_file.write(data)
+        finally:
+            temp_file.close()
+        os.rename(temp_filepathname, self.filepathname(key))
+    
+    def prune(self):
+        """Remove the least recently used files until the cache fits max_bytes
+        
+        Returns:
+            removed:    Integer, the number of files removed.
+        
+        """
+        
+        files = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(SUFFIX):
+                continue
+            filepathname = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(filepathname)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, filepathname, stat.st_size))
+            total_bytes += stat.st_size
+        
+        removed = 0
+        files.sort()
+        for mtime, filepathname, size in files:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(filepathname)
+            except OSError:
+                pass
+            total_bytes -= size
+            removed += 1
+        return removed
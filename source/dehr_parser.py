@@ -5,6 +5,8 @@
 # This file is modeled after this earlier file:
 #     ~/progs/zml/trunk/zml/parser.py
 
+from array import array
+from bisect import bisect_left
 import re
 from collections import OrderedDict
 
@@ -21,7 +23,12 @@ class CrCharacterError(DehrError):
 #=========================== Regexes for the Lexer ============================#
 
 # The escape character is \ which is the backslash.
+# 
+# A page has two regions with different special tokens, see lexer(). The 
+# header is the title and the metadata, up to and including the ----- 
+# separator. Everything after the separator is the body.
 
+# The special tokens of the header:
 special_tokens = r"""
     # First, we will search for escaped special sequences. In regexes, terms 
     # separated by | (OR) are searched from left to right, and the first match 
@@ -61,6 +68,210 @@ token_pat = re.compile(r"""(?xs)                # x: Verbose, s: DOTALL
     )""")
 
 
+# The same pattern WITHOUT the leading ^ anchor. It is used with 
+# scan_pat.match(input_str, pos), which anchors the match at pos. Note that ^ 
+# would only match at the real beginning of the string, never at pos.
+scan_pat = re.compile(r"""(?xs)                 # x: Verbose, s: DOTALL
+    (?P<special>""" + special_tokens + r""")    # Match special tokens
+    |
+    (?:
+      (?P<other>.*?)
+      (?P<next_special>""" + special_tokens + r"""
+        |$
+      )
+    )""")
+
+
+# The special tokens of the body. The ', ' and ': ' of the metadata mean 
+# nothing here, and neither does a '<' in the middle of a line, so a line of 
+# prose is ONE token instead of one per comma, colon, and inline HTML tag:
+body_special_tokens = r"""
+    (?:\\[\n]{2})|      # Matches "\[LF][LF]"
+    (?:\n\n)            # Two newlines in a row
+"""
+
+body_token_pat = re.compile(r"""(?xs)
+    ^
+    (?P<special>""" + body_special_tokens + r""")
+    |
+    (?:
+      (?P<other>.*?)
+      (?P<next_special>""" + body_special_tokens + r"""
+        |$
+      )
+    )""")
+
+body_scan_pat = re.compile(r"""(?xs)
+    (?P<special>""" + body_special_tokens + r""")
+    |
+    (?:
+      (?P<other>.*?)
+      (?P<next_special>""" + body_special_tokens + r"""
+        |$
+      )
+    )""")
+
+# Only the first token of a line of the body decides whether it gets <p> 
+# tags, see OneLineNode. These are matched right after each unescaped 
+# [LF][LF], and never in the middle of a line:
+line_start_pat = re.compile(r"""(?x)
+    (?:\\<)|
+    (?:<nop>)|
+    (?:<)|
+    (?:\{%\ indent\ %\})|
+    (?:\{%\ endindent\ %\})|
+    (?:\{%\ clearfix\ %\})""")
+
+# The first unescaped [LF][LF] of a page ends the title. The header ends at 
+# the first ----- after it, see body_start():
+first_break_pat = re.compile(r"(?<!\\)\n\n")
+
+# The same special tokens as plain strings, in the SAME order as in the 
+# regexes above, for the 'find' engine. Where two tokens start at the same 
+# character, the first one in the list wins, like the first alternative of a 
+# regex:
+HEADER_SPECIALS = ['\\<', '\\\n\n', '<nop>', '<', '\n\n', '-----', ', ', ': ', 
+                   '{% indent %}', '{% endindent %}', '{% clearfix %}']
+BODY_SPECIALS = ['\\\n\n', '\n\n']
+LINE_START_SPECIALS = ['\\<', '<nop>', '<', '{% indent %}', '{% endindent %}', 
+                       '{% clearfix %}']
+
+
+class LexerRegion(object):
+    """The special tokens of one region of a page, see lexer()
+    
+    Attributes:
+        name:           String, 'header' or 'body'.
+        
+        token_pat:      Compiled regex, anchored with ^, for the 'reslice' 
+                        engine.
+        
+        scan_pat:       Compiled regex, anchored by match(input_str, pos), 
+                        for the 'regex' engine.
+        
+        line_start_pat: Compiled regex or None. Iff not None, it is tried 
+                        once right after every '\n\n' token, and a match is its own token.
+        
+        specials:       Dict, the first character of each special token --> 
+                        the list of the special tokens that start with it, in order, for the 'find' engine.
+        
+        line_starts:    The same as specials, for line_start_pat.
+    
+    """
+    
+    def __init__(self, name, token_pat, scan_pat, specials, 
+                 line_start_pat=None, line_starts=()):
+        self.name = name
+        self.token_pat = token_pat
+        self.scan_pat = scan_pat
+        self.line_start_pat = line_start_pat
+        self.specials = by_first_character(specials)
+        self.line_starts = by_first_character(line_starts)
+
+
+def by_first_character(tokens):
+    first_chars = OrderedDict()
+    for token in tokens:
+        first_chars.setdefault(token[0], []).append(token)
+    return first_chars
+
+
+HEADER_REGION = LexerRegion('header', token_pat, scan_pat, HEADER_SPECIALS)
+BODY_REGION = LexerRegion('body', body_token_pat, body_scan_pat, 
+                          BODY_SPECIALS, line_start_pat, LINE_START_SPECIALS)
+
+
+#================================ Token Stream ================================#
+
+# The kind of each token in a TokenStream. The Nodes compare these integers 
+# instead of the token strings. The kinds that OneLineNode does NOT wrap in 
+# <p> tags are the range LT to CLEARFIX, and the tags that may be alone on 
+# their line are the range INDENT to CLEARFIX.
+TEXT = 0
+BREAK = 1               # '\n\n'
+ESCAPED_BREAK = 2       # '\\\n\n'
+SEPARATOR = 3           # '-----'
+COMMA = 4               # ', '
+COLON = 5               # ': '
+ESCAPED_LT = 6          # '\\<'
+LT = 7                  # '<'
+NOP = 8                 # '<nop>'
+INDENT = 9              # '{% indent %}'
+ENDINDENT = 10          # '{% endindent %}'
+CLEARFIX = 11           # '{% clearfix %}'
+
+TOKEN_KINDS = {
+    '\n\n': BREAK,
+    '\\\n\n': ESCAPED_BREAK,
+    '-----': SEPARATOR,
+    ', ': COMMA,
+    ': ': COLON,
+    '\\<': ESCAPED_LT,
+    '<': LT,
+    '<nop>': NOP,
+    '{% indent %}': INDENT,
+    '{% endindent %}': ENDINDENT,
+    '{% clearfix %}': CLEARFIX,
+}
+
+
+class TokenStream(object):
+    """The tokens of a page as kinds and offsets into the source string
+    
+    This is what lexer(typed=True) returns. The tokens are contiguous, token i is source[offsets[i]:offsets[i + 1]], so the text of a token is only copied out of the source when a Node asks for it, and the text of a span of tokens is ONE slice. Each token costs 9 bytes, 1 for its kind and 8 for its offset, instead of a str object and a list slot.
+    
+    Attributes:
+        source:     String, the input of lexer() after its final and excess 
+                    newlines are removed.
+        
+        kinds:      bytearray, the kind of each token, e.g. BREAK. It is a 
+                    bytearray instead of an array('B') because bytearray.find() scans for one kind in C.
+        
+        offsets:    array('l'), one more than there are tokens, offsets[0] 
+                    is 0 and offsets[-1] is len(source).
+    
+    """
+    
+    __slots__ = ('source', 'kinds', 'offsets')
+    
+    def __init__(self, source):
+        self.source = source
+        self.kinds = bytearray()
+        self.offsets = array('l', [0])
+    
+    @classmethod
+    def from_tokens(cls, tokens):
+        """Return the TokenStream of a list of token strings"""
+        stream = cls(''.join(tokens))
+        kind_of = TOKEN_KINDS.get
+        pos = 0
+        for token in tokens:
+            pos += len(token)
+            stream.kinds.append(kind_of(token, TEXT))
+            stream.offsets.append(pos)
+        return stream
+    
+    def __len__(self):
+        return len(self.kinds)
+    
+    def text(self, index):
+        return self.source[self.offsets[index]:self.offsets[index + 1]]
+    
+    def join(self, start, end):
+        """Return ''.join() of the texts of tokens start to end - 1"""
+        return self.source[self.offsets[start]:self.offsets[end]]
+    
+    def texts(self, start=0, end=None):
+        """Return a list of the texts of the tokens, for errors and tests"""
+        if end == None:
+            end = len(self.kinds)
+        return [self.text(index) for index in xrange(start, end)]
+    
+    def find(self, kind, start, end):
+        """Return the index of the first token of kind in [start, end), or -1"""
+        return self.kinds.find(chr(kind), start, end)
+
+
 #================================== Grammar ===================================#
 
 """
@@ -106,31 +317,256 @@ ValueListNode  -->  ValueNode  (', '  ValueListNode)?
 
 #=================================== Lexer ====================================#
 
-def lexer(input_str):
+def lexer(input_str, engine='find', typed=False, normalized=False):
     """The lexer takes in a raw pseudo-HTML string and outputs a list of tokens
     
+    The header of the page is split at every special token, see HEADER_REGION. The body, after the ----- separator, is only split at [LF][LF] and at the first token of each line, see BODY_REGION, because nothing else changes how it is parsed. So the body of a page of prose has about half as many tokens, and the rendered output is the same. Iff the input has no header (e.g. a test of MultiParagraphNode alone), all of it is lexed as header.
+    
     Arguments:
         input_str:  String, raw pseudo-HTML.
+        
+        engine:     String, optional, the name of the scanning function in 
+                    LEXER_ENGINES. Every engine outputs the SAME token list.
+        
+        typed:      Boolean, optional. Iff True, a TokenStream is returned 
+                    instead of a list. The engines in TYPED_LEXER_ENGINES then never make a string per token, see scan_find_typed().
+        
+        normalized: Boolean, optional. Iff True, input_str is already the 
+                    output of normalize_source(), e.g. from build.read_page_raw(), so it is not scanned again.
     
     Returns:
-        token_list: A list of strings, each string is a token.
+        token_list: A list of strings, each string is a token, or a 
+                    TokenStream of the same tokens.
+    
+    """
+    
+    if engine not in LEXER_ENGINES:
+        raise ParserError(
+            "There is no lexer engine named %r. The choices are: %s" % 
+            (engine, ', '.join(LEXER_ENGINES)))
+    
+    if normalized:
+        input_str3 = input_str
+    else:
+        input_str3, problems = normalize_source(input_str)
+        if problems:
+            raise CrCharacterError(
+                "There was at least one CR character in the input, but this "
+                "is forbidden. You may NOT use CR characters. Here is the "
+                "beginning of the offending string:\n\n%r" % input_str[0:60], 
+                '\n'.join(str(problem) for problem in problems))
+    
+    split = body_start(input_str3)
+    if split == None:
+        spans = [(HEADER_REGION, 0, len(input_str3))]
+    else:
+        spans = [(HEADER_REGION, 0, split), 
+                 (BODY_REGION, split, len(input_str3))]
+    if typed and engine in TYPED_LEXER_ENGINES:
+        scan_typed_engine = TYPED_LEXER_ENGINES[engine]
+        stream = TokenStream(input_str3)
+        for region, start, end in spans:
+            scan_typed_engine(input_str3, region, start, end, stream)
+        return stream
+    
+    scan = LEXER_ENGINES[engine]
+    tokens = []
+    for region, start, end in spans:
+        tokens.extend(scan(input_str3, region, start, end))
+    if typed:
+        return TokenStream.from_tokens(tokens)
+    return tokens
+
+
+def body_start(input_str):
+    """Return the index just past the ----- separator, or None iff there is none
+    
+    This is the ----- that WholePageNode.parse_header() takes as the separator: the first one after the first '\n\n' token. Every header token ends before it or at it, so the header tokens are exactly the ones that lexing the whole page as header would give.
+    
+    """
+    
+    mtch = first_break_pat.search(input_str)
+    if mtch == None:
+        return None
+    pos = input_str.find('-----', mtch.end())
+    if pos == -1:
+        return None
+    return pos + 5
+
+
+def scan_regex(input_str, region, start, end):
+    """Split input_str[start:end] into tokens in one pass, without copying it
+    
+    This is the 'regex' engine for lexer(). It walks through input_str with an integer offset and calls region.scan_pat.match(input_str, pos, end), so each character is only scanned once and the run time is linear in the length of the page.
+    
+    Whenever a match has an 'other' group, the 'next_special' group is the very same token that a match at the end of 'other' would find, so both tokens are appended at once.
+    
+    """
+    
+    tokens = []
+    append = tokens.append
+    match = region.scan_pat.match
+    line_start = region.line_start_pat
+    pos = start
+    
+    while pos < end:
+        mtch = match(input_str, pos, end)
+        if mtch == None:
+            raise ParserError(
+                "VERY weird, scan_pat did not find a match.\n"
+                "pos = %r\n"
+                "remainder = %r" % (pos, input_str[pos:pos+60]))
+        special = mtch.group("special")
+        if special:
+            # The remainder starts with a special token:
+            append(special)
+        else:
+            # The remainder does NOT start with a special token:
+            append(mtch.group("other"))
+            special = mtch.group("next_special")
+            if special:
+                append(special)
+        pos = mtch.end()
+        if special == '\n\n' and line_start != None:
+            mtch = line_start.match(input_str, pos, end)
+            if mtch != None:
+                append(mtch.group())
+                pos = mtch.end()
+    
+    return tokens
+
+
+def scan_typed(input_str, region, start, end, stream):
+    """The same as scan_regex(), but it appends the tokens to a TokenStream
+    
+    Only the offsets of each match are kept. The special tokens are short, and their kind is looked up in TOKEN_KINDS, but the text between them is never copied out of input_str.
+    
+    """
+    
+    append_kind = stream.kinds.append
+    append_offset = stream.offsets.append
+    kind_of = TOKEN_KINDS.__getitem__
+    match = region.scan_pat.match
+    line_start = region.line_start_pat
+    pos = start
+    
+    while pos < end:
+        mtch = match(input_str, pos, end)
+        if mtch == None:
+            raise ParserError(
+                "VERY weird, scan_pat did not find a match.\n"
+                "pos = %r\n"
+                "remainder = %r" % (pos, input_str[pos:pos+60]))
+        special = mtch.group("special")
+        if special:
+            append_kind(kind_of(special))
+        else:
+            append_kind(TEXT)
+            append_offset(mtch.end("other"))
+            special = mtch.group("next_special")
+            if special:
+                append_kind(kind_of(special))
+        pos = mtch.end()
+        if special:
+            append_offset(pos)
+        if special == '\n\n' and line_start != None:
+            mtch = line_start.match(input_str, pos, end)
+            if mtch != None:
+                append_kind(kind_of(mtch.group()))
+                pos = mtch.end()
+                append_offset(pos)
+    
+    return stream
+
+
+def scan_find(input_str, region, start, end):
+    """Split input_str[start:end] into tokens with str.find(), without any regex
+    
+    This is the default engine for lexer(), see scan_find_typed(). Every engine outputs the same tokens, and this one is about twice as fast as scan_regex() on pages of every size, see dehr_bench.py --lexer.
+    
+    """
+    
+    stream = TokenStream(input_str)
+    stream.offsets[0] = start
+    offsets = scan_find_typed(input_str, region, start, end, stream).offsets
+    return [input_str[offsets[i]:offsets[i + 1]] 
+            for i in xrange(len(offsets) - 1)]
+
+
+def scan_find_typed(input_str, region, start, end, stream):
+    """The 'find' engine, it appends the tokens of input_str[start:end] to a TokenStream
+    
+    Every special token starts with one of a few characters, e.g. '<' or '\n', so the text in between is skipped with one str.find() per such character, instead of trying every alternative of scan_pat at every character. The next position of each character is remembered, and only looked up again once pos has passed it, so each str.find() scans a stretch of input_str only once.
+    
+    At each candidate character, the special tokens that start with it are tried in order with str.startswith(). The earliest match is the same token that scan_regex() finds.
     
     """
     
-    if '\r' in input_str:
-        raise CrCharacterError(
-            "There was at least one CR character in the input, but this is "
-            "forbidden. You may NOT use CR characters. Here is the beginning "
-            "of the offending string:\n\n%r" % input_str[0:60])
+    append_kind = stream.kinds.append
+    append_offset = stream.offsets.append
+    kind_of = TOKEN_KINDS.__getitem__
+    find = input_str.find
+    startswith = input_str.startswith
+    specials = region.specials
+    line_starts = region.line_starts
+    
+    # [position, character] of the next candidate of each character. A 
+    # character is dropped once there is none before end:
+    candidates = [[find(char, start, end), char] for char in specials]
+    candidates = [candidate for candidate in candidates if candidate[0] != -1]
+    pos = start
+    
+    while candidates:
+        candidate = min(candidates)
+        index, char = candidate
+        for special in specials[char]:
+            if startswith(special, index, end):
+                break
+        else:
+            # Not a special token, look for the next one of this character:
+            candidate[0] = find(char, index + 1, end)
+            if candidate[0] == -1:
+                candidates.remove(candidate)
+            continue
+        
+        if index > pos:
+            append_kind(TEXT)
+            append_offset(index)
+        pos = index + len(special)
+        append_kind(kind_of(special))
+        append_offset(pos)
+        if special == '\n\n' and line_starts:
+            for line_start in line_starts.get(input_str[pos:pos+1], ()):
+                if startswith(line_start, pos, end):
+                    pos += len(line_start)
+                    append_kind(kind_of(line_start))
+                    append_offset(pos)
+                    break
+        # Every candidate before pos is inside a token, move it on:
+        for candidate in candidates[:]:
+            if candidate[0] < pos:
+                candidate[0] = find(candidate[1], pos, end)
+                if candidate[0] == -1:
+                    candidates.remove(candidate)
+    
+    if pos < end:
+        append_kind(TEXT)
+        append_offset(end)
+    return stream
+
+
+def scan_reslice(input_str, region, start, end):
+    """The original lexer loop, it re-slices the remainder after every token
+    
+    DEPRECATED, use scan_regex() instead. Every token copies the rest of the page, so the run time is quadratic in the length of the page. This is kept so the other engines can be tested against it.
     
-    input_str2 = deal_with_final_newlines(input_str)
-    input_str3 = deal_with_excess_newlines(input_str2)
+    """
     
     tokens = []
-    remainder = input_str3
+    remainder = input_str[start:end]
     
     while remainder:
-        mtch = token_pat.match(remainder)
+        mtch = region.token_pat.match(remainder)
         if mtch == None:
             raise ParserError(
                 "VERY weird, token_pat did not find a match.\n"
@@ -145,28 +581,131 @@ def lexer(input_str):
             # The remainder does NOT start with a special token:
             tokens.append(mtch.group("other"))
             remainder = remainder[mtch.end("other"):]
+        if tokens[-1] == '\n\n' and region.line_start_pat != None:
+            mtch = region.line_start_pat.match(remainder)
+            if mtch != None:
+                tokens.append(mtch.group())
+                remainder = remainder[mtch.end():]
     
     return tokens
 
 
+LEXER_ENGINES = OrderedDict([
+    ('find', scan_find),
+    ('regex', scan_regex),
+    ('reslice', scan_reslice),
+])
+
+# The engines that fill a TokenStream themselves, for lexer(typed=True). The 
+# others are converted with TokenStream.from_tokens():
+TYPED_LEXER_ENGINES = {
+    'find': scan_find_typed,
+    'regex': scan_typed,
+}
+
+
+#============================ Source Normalization ============================#
+
+# The names of the characters that normalize_source() may forbid:
+CHARACTER_NAMES = {
+    '\r': 'a CR character',
+    '\t': 'a hard tab character',
+}
+
+# normalize_source() compiles one of these per set of forbidden characters:
+source_scan_pats = {}
+
+
+class SourceProblem(object):
+    """One forbidden character in a page source, see normalize_source()
+    
+    Attributes:
+        line:       Integer, the line number, from 1.
+        
+        column:     Integer, the column number in bytes, from 1.
+        
+        message:    String, e.g. 'a CR character'.
+    
+    """
+    
+    __slots__ = ('line', 'column', 'message')
+    
+    def __init__(self, line, column, message):
+        self.line = line
+        self.column = column
+        self.message = message
+    
+    def __str__(self):
+        return "line %d, column %d: %s" % (self.line, self.column, self.message)
+
+
+def normalize_source(input_str, forbidden='\r'):
+    """Validate and normalize a page source in ONE scan, for lexer()
+    
+    Every forbidden character is found, with its line and column, instead of stopping at the first one. In the same scan, every run of 3+ LF characters is replaced with exactly 2, see deal_with_excess_newlines(). The final LF characters are removed first, from the end only, see deal_with_final_newlines(). Iff nothing changes, input_str itself is returned, so a clean page is never copied.
+    
+    Arguments:
+        input_str:  String, raw pseudo-HTML.
+        
+        forbidden:  String, optional, the forbidden characters, each one of 
+                    CHARACTER_NAMES. lexer() only forbids CR, build.read_page_raw() forbids hard tabs too.
+    
+    Returns:
+        normalized: String, input_str without final and excess newlines.
+        
+        problems:   List of SourceProblem objects, in order, empty iff 
+                    input_str has no forbidden character.
+    
+    """
+    
+    scan_pat = source_scan_pats.get(forbidden, None)
+    if scan_pat == None:
+        scan_pat = re.compile('[%s]|\n{3,}' % re.escape(forbidden))
+        source_scan_pats[forbidden] = scan_pat
+    
+    end = len(input_str)
+    while end and input_str[end - 1] == '\n':
+        end -= 1
+    
+    pieces = []
+    problems = []
+    pos = 0
+    # The line number at line_pos, and the index where that line starts:
+    line = 1
+    line_pos = 0
+    line_start = 0
+    for mtch in scan_pat.finditer(input_str, 0, end):
+        index = mtch.start()
+        char = input_str[index]
+        if char == '\n':
+            pieces.append(input_str[pos:index])
+            pieces.append('\n\n')
+            pos = mtch.end()
+            continue
+        newlines = input_str.count('\n', line_pos, index)
+        if newlines:
+            line += newlines
+            line_start = input_str.rfind('\n', line_pos, index) + 1
+        line_pos = index
+        problems.append(SourceProblem(line, index - line_start + 1, 
+                                      CHARACTER_NAMES[char]))
+    
+    if pos == 0 and end == len(input_str):
+        return input_str, problems
+    pieces.append(input_str[pos:end])
+    return ''.join(pieces), problems
+
+
 def deal_with_final_newlines(input_str):
     """Remove all LF characters from the end of input_str
     
     The function lexer() chokes if input_str ends in a newline character. Writing regexes that handle terminal newline(s) correctly is VERY HARD, so I won't even attempt it.
     
-    We will remove any number of final newline characters and output a string that ends in a DIFFERENT character.
+    We will remove any number of final newline characters and output a string that ends in a DIFFERENT character. lexer() does this in normalize_source() instead.
     
     """
     
-    done = False
-    
-    while (not done):
-        if input_str[-1] == '\n':
-            input_str = input_str[:-1]
-        else:
-            done = True
-    
-    return input_str
+    return input_str.rstrip('\n')
 
 
 excess_newlines_pat = re.compile(r"[\n]{3,}")
@@ -174,7 +713,7 @@ excess_newlines_pat = re.compile(r"[\n]{3,}")
 def deal_with_excess_newlines(input_str):
     """The parser chokes if there are 3+ LF characters in a row
     
-    Whenever you see 3+ LF characters in a row, replace with exactly 2 LF characters to avoid problems.
+    Whenever you see 3+ LF characters in a row, replace with exactly 2 LF characters to avoid problems. lexer() does this in normalize_source() instead.
     
     """
     
@@ -186,25 +725,74 @@ def deal_with_excess_newlines(input_str):
 class Node(object):
     """A fully-parsed input is a branched tree of Nodes
     
+    Every Node in the tree shares ONE TokenStream, see lexer(typed=True). A Node only remembers the span (self.start, self.end) of the tokens that it covers, so parsing never copies the tokens. The Nodes look at the kind of each token, an integer, and only copy its text out of the source when they output it.
+    
     Attributes:
         children:   List of Nodes or None. Iff this is a terminal Node, then 
                     children == None. Iff this is a nonterminal Node, then children is a list of Nodes, or more precisely, it is a list of objects that inherit from Node.
+        tokens:     TokenStream, shared by the whole tree.
+        start:      Integer, index of the first token of this Node.
+        end:        Integer, index just past the last token of this Node.
         input:      List of tokens (strings), all the raw input that 
-                    produced this Node.
+                    produced this Node. It is a COPY of the texts of tokens start to end - 1, so only use it for error messages and tests.
         output:     List of strings, all the raw HTML to be output in its 
                     final form. Just concatenate the output and you are done.
+                    Only set by render().
     
     Methods:
         parse:          First function to get called. It looks at self.input 
                         and (generally) turns the input into one or more Nodes, and those Nodes are stored in self.children. Then, node.parse() is called on each of the child Nodes. The exception is iff this will become a TerminalNode, in which case the input is NOT turned into any Nodes and self.children == None.
         render:         Last function to get called. It turns this Node into a 
                         string of output HTML, and the output string is stored in self.output. To do this, it must recursively call node.render() on each of its children.
+        iter_output:    Instead of render(), a generator that yields the same 
+                        strings that render() would store in self.output, one at a time. Nothing is stored, and no list of the output of the whole subtree is ever built.
+    
+    A big page has hundreds of thousands of Nodes, so every Node class has __slots__ instead of a __dict__. That makes the tree of a big page less than half as big. A subclass must declare __slots__ for its own attributes, or it gets a __dict__ again.
+    
+    """
+    
+    __slots__ = ('tokens', 'start', 'end', 'children', 'output')
+    
+    def __init__(self, input, start=0, end=None):
+        """The argument 'input' is a TokenStream, or a list of tokens (raw input strings)
+        
+        A list is converted to a TokenStream, so only the root Node of a tree should get one. Iff start and end are given, this Node only covers input[start:end].
+        
+        """
+        
+        if type(input) is not TokenStream:
+            input = TokenStream.from_tokens(input)
+        self.tokens = input
+        self.start = start
+        if end == None:
+            end = len(input)
+        self.end = end
+    
+    @property
+    def input(self):
+        return self.tokens.texts(self.start, self.end)
+
+
+def token_positions(tokens, kind, start, end):
+    """Return the index of every token of this kind from start to end - 1
+    
+    This is ONE pass over the span, bytearray.find() does the scanning in C.
     
     """
     
-    def __init__(self, input):
-        """The argument 'input' is a list of tokens (raw input strings)"""
-        self.input = input
+    positions = []
+    find = tokens.kinds.find
+    target = chr(kind)
+    pos = find(target, start, end)
+    while pos != -1:
+        positions.append(pos)
+        pos = find(target, pos + 1, end)
+    return positions
+
+
+def positions_in_span(positions, start, end):
+    """Return the items of the sorted list positions with start <= x < end"""
+    return positions[bisect_left(positions, start):bisect_left(positions, end)]
 
 
 class TerminalNode(Node):
@@ -215,16 +803,21 @@ class TerminalNode(Node):
     
     """
     
+    __slots__ = ('content',)
+    
     def parse(self):
-        if len(self.input) != 1:
+        if self.end - self.start != 1:
             raise ParserError(
                 "TerminalNode.parse() was called, but the TerminalNode's "
                 "input was not exactly 1 token.\ninput = %r." % self.input)
         self.children = None
-        self.content = self.input[0]
+        self.content = self.tokens.text(self.start)
     
     def render(self):
         self.output = [self.content]
+    
+    def iter_output(self):
+        yield self.content
 
 
 class OneParagraphNode(Node):
@@ -232,19 +825,36 @@ class OneParagraphNode(Node):
     
     When rendered, it will get wrapped in <p> tags.
     
+    Attributes:
+        lead:       String or None. Iff not None, it is output before the 
+                    tokens, e.g. the '<' of an escaped '\<'.
+    
     """
     
+    __slots__ = ('lead',)
+    
+    def __init__(self, input, start=0, end=None, lead=None):
+        Node.__init__(self, input, start, end)
+        self.lead = lead
+    
     def parse(self):
-        if len(self.input) < 1:
+        if self.end - self.start < 1 and self.lead == None:
             raise ParserError(
                 "OneParagraphNode.parse() was called, but the input was not "
                 "at least 1 token long.\ninput = %r." % self.input)
         self.children = None
     
     def render(self):
-        self.output = ['<p>\n']
-        self.output.extend(self.input)
-        self.output.append('\n</p>')
+        self.output = list(self.iter_output())
+    
+    def iter_output(self):
+        yield '<p>\n'
+        if self.lead != None:
+            yield self.lead
+        for fragment in iter_unescape_double_newline(self.tokens, self.start, 
+                                                     self.end):
+            yield fragment
+        yield '\n</p>'
 
 
 class NonParagraphLineNode(Node):
@@ -256,40 +866,39 @@ class NonParagraphLineNode(Node):
     
     """
     
+    __slots__ = ()
+    
     def parse(self):
-        if len(self.input) < 1:
+        if self.end - self.start < 1:
             raise ParserError(
                 "NonParagraphLineNode.parse() was called, but the input was "
                 "not at least 1 token long.\ninput = %r." % self.input)
         self.children = None
     
     def render(self):
-        self.output = self.input[:]
+        self.output = list(self.iter_output())
+    
+    def iter_output(self):
+        return iter_unescape_double_newline(self.tokens, self.start, self.end)
 
 
-def unescape_double_newline(input_token_list):
-    """Finds all '\[LF][LF]' tokens and removes the \ escape character
+def iter_unescape_double_newline(tokens, start, end):
+    """Yield the text of tokens start to end - 1, without the \ of each '\[LF][LF]'
     
-    Input:
-        input_token_list:   List of tokens (strings).
-    
-    Output:
-        clean_token_list:   List of tokens (strings).
+    The text between two ESCAPED_BREAK tokens is yielded as ONE slice of the source, so a line of many tokens is still one string.
     
     """
     
-    clean_token_list = []
-    for token in input_token_list:
-        if token == '\\\n\n':
-            clean_token_list.append('\n\n')
-        else:
-            clean_token_list.append(token)
-    return clean_token_list
-
-
-NON_P_TOKENS = ['{% indent %}', '{% endindent %}', '{% clearfix %}']
-ALL_NON_P_TOKENS = ['<', '<nop>', '{% indent %}', '{% endindent %}', 
-                    '{% clearfix %}']
+    source = tokens.source
+    offsets = tokens.offsets
+    pos = start
+    for escaped in token_positions(tokens, ESCAPED_BREAK, start, end):
+        if escaped > pos:
+            yield source[offsets[pos]:offsets[escaped]]
+        yield '\n\n'
+        pos = escaped + 1
+    if pos < end:
+        yield source[offsets[pos]:offsets[end]]
 
 class OneLineNode(Node):
     """A nonterminal node
@@ -300,8 +909,16 @@ class OneLineNode(Node):
     
     """
     
+    __slots__ = ()
+    
     def parse(self):
-        if self.input[0] in ALL_NON_P_TOKENS:
+        if self.start >= self.end:
+            raise ParserError(
+                "OneLineNode.parse() was called, but the input was empty.")
+        tokens = self.tokens
+        first = tokens.kinds[self.start]
+        
+        if LT <= first <= CLEARFIX:
             # This is a NonParagraphLineNode.
             # This will NOT be wrapped in <p> tags.
             # 
@@ -312,33 +929,34 @@ class OneLineNode(Node):
             # or in a programming language. The no op (nop) code in Python 
             # is 'pass', and in C it is a semicolon.
             
-            if self.input[0] == '<':
-                self.children = [TerminalNode(['<'])]
-            elif self.input[0] == '<nop>':
+            if first == LT:
+                self.children = [TerminalNode(tokens, self.start, 
+                                              self.start + 1)]
+            elif first == NOP:
                 # Discard the string '<nop>'
                 self.children = []
-            elif self.input[0] in NON_P_TOKENS:
-                self.children = [TerminalNode([self.input[0]])]
-                if len(self.input) == 1:
-                    self.input.append('')
-                    # We need filler for the NonParagraphLineNode.
+            elif INDENT <= first <= CLEARFIX:
+                self.children = [TerminalNode(tokens, self.start, 
+                                              self.start + 1)]
             else:
                 raise ParserError(
                     "This code should be unreachable.")
-            child_input = unescape_double_newline(self.input[1:])
-            self.children.append(NonParagraphLineNode(child_input))
+            if INDENT <= first <= CLEARFIX and self.end - self.start == 1:
+                # The tag is alone on its line, there is nothing after it.
+                pass
+            else:
+                self.children.append(
+                    NonParagraphLineNode(tokens, self.start + 1, self.end))
         
-        elif self.input[0] == '\\<':
+        elif first == ESCAPED_LT:
             # This is a OneParagraphNode.
-            child_input = ['<']         # We remove the \ escape character
-            more_input = unescape_double_newline(self.input[1:])
-            child_input.extend(more_input)
-            self.children = [OneParagraphNode(child_input)]
+            # We remove the \ escape character:
+            self.children = [
+                OneParagraphNode(tokens, self.start + 1, self.end, lead='<')]
         
         else:
             # This is a OneParagraphNode.
-            child_input = unescape_double_newline(self.input)
-            self.children = [OneParagraphNode(child_input)]
+            self.children = [OneParagraphNode(tokens, self.start, self.end)]
         
         for child in self.children:
             child.parse()
@@ -349,6 +967,11 @@ class OneLineNode(Node):
             child.render()
             output.extend(child.output)
         self.output = output
+    
+    def iter_output(self):
+        for child in self.children:
+            for fragment in child.iter_output():
+                yield fragment
 
 
 class MultiParagraphNode(Node):
@@ -358,29 +981,40 @@ class MultiParagraphNode(Node):
     
     Modeled after zml.parser.RegularTextNode.
     
+    Attributes:
+        breaks:     List of integers or None, the index of every BREAK token 
+                    in self.tokens. Iff None, parse() finds them itself.
+    
     """
     
+    __slots__ = ('breaks',)
+    
+    def __init__(self, input, start=0, end=None, breaks=None):
+        Node.__init__(self, input, start, end)
+        self.breaks = breaks
+    
     def parse(self):
         self.children = []
-        while self.input:
-            self.parse_chunk()
+        if self.breaks == None:
+            breaks = token_positions(self.tokens, BREAK, self.start, self.end)
+        else:
+            breaks = positions_in_span(self.breaks, self.start, self.end)
+        pos = self.start
+        for break_index in breaks:
+            self.parse_chunk(pos, break_index)
+            pos = break_index + 1
+        if pos < self.end:
+            # The last chunk contains exactly one OneLineNode.
+            self.children.append(OneLineNode(self.tokens, pos, self.end))
         for child in self.children:
             child.parse()
     
-    def parse_chunk(self):
-        if '\n\n' in self.input:
-            # This contains two or more OneLineNodes.
-            break_index = self.input.index('\n\n')
-            first_child = OneLineNode(self.input[:break_index])
-            second_child = TerminalNode([self.input[break_index]])
-            self.children.append(first_child)
-            self.children.append(second_child)
-            next_index = break_index + 1
-            self.input = self.input[next_index:]
-        else:
-            # This contains exactly one OneLineNode.
-            self.children.append(OneLineNode(self.input))
-            self.input = []
+    def parse_chunk(self, pos, break_index):
+        """Add the OneLineNode in tokens[pos:break_index] and the '\n\n'"""
+        first_child = OneLineNode(self.tokens, pos, break_index)
+        second_child = TerminalNode(self.tokens, break_index, break_index + 1)
+        self.children.append(first_child)
+        self.children.append(second_child)
     
     def render(self):
         output = []
@@ -388,6 +1022,11 @@ class MultiParagraphNode(Node):
             child.render()
             output.extend(child.output)
         self.output = output
+    
+    def iter_output(self):
+        for child in self.children:
+            for fragment in child.iter_output():
+                yield fragment
 
 
 class TitleNode(Node):
@@ -401,9 +1040,11 @@ class TitleNode(Node):
     
     """
     
+    __slots__ = ('title',)
+    
     def parse(self):
         self.children = None
-        self.title = ''.join(self.input)
+        self.title = self.tokens.join(self.start, self.end)
     
     def render(self):
         self.output = ['<h1>', self.title, '</h1>']
@@ -420,9 +1061,11 @@ class ValueNode(Node):
     
     """
     
+    __slots__ = ('value',)
+    
     def parse(self):
         self.children = None
-        self.value = ''.join(self.input)
+        self.value = self.tokens.join(self.start, self.end)
     
     def render(self):
         pass
@@ -446,31 +1089,27 @@ class ValueListNode(Node):
     
     """
     
+    __slots__ = ('value_list',)
+    
     def parse(self):
         self.children = []
         self.value_list = []
-        while self.input:
-            self.parse_chunk()
-        for child in self.children:
-            child.parse()
-            self.value_list.append(child.value)
-    
-    def parse_chunk(self):
-        if ', ' in self.input:
+        pos = self.start
+        for break_index in token_positions(self.tokens, COMMA, self.start, 
+                                           self.end):
             # This contains two or more ValueNodes.
-            break_index = self.input.index(', ')
-            new_child = ValueNode(self.input[:break_index])
-            self.children.append(new_child)
-            next_index = break_index + 1
-            self.input = self.input[next_index:]
-        else:
+            self.children.append(ValueNode(self.tokens, pos, break_index))
+            pos = break_index + 1
+        if pos < self.end:
             # This contains exactly one ValueNode.
-            remainder = ''.join(self.input)
+            remainder = self.tokens.join(pos, self.end)
             if remainder[-1] == '.':
                 # If there is a period at the end, remove it.
                 remainder = remainder[:-1]
-            self.children.append(ValueNode(remainder))
-            self.input = []
+            self.children.append(ValueNode([remainder]))
+        for child in self.children:
+            child.parse()
+            self.value_list.append(child.value)
     
     def render(self):
         pass
@@ -490,9 +1129,11 @@ class KeyNode(Node):
     
     """
     
+    __slots__ = ('key',)
+    
     def parse(self):
         self.children = None
-        self.key = ''.join(self.input)
+        self.key = self.tokens.join(self.start, self.end)
     
     def render(self):
         pass
@@ -514,21 +1155,22 @@ class DictPairNode(Node):
     
     """
     
+    __slots__ = ('key', 'value_list')
+    
     def parse(self):
         self.children = []
-        if ': ' in self.input:
-            break_index = self.input.index(': ')
-            key_node = KeyNode(self.input[:break_index])
-            next_index = break_index + 1
-            value_list_node = ValueListNode(self.input[next_index:])
-            self.children.append(key_node)
-            self.children.append(value_list_node)
-        else:
-            input_str = ''.join(self.input)
+        break_index = self.tokens.find(COLON, self.start, self.end)
+        if break_index == -1:
+            input_str = self.tokens.join(self.start, self.end)
             raise ParserError(
                 "DictPairNode.parse() failed because there is no token with "
                 "a colon followed by a space in the input. The offending "
                 "input is:\n\n%r" % input_str[0:60])
+        key_node = KeyNode(self.tokens, self.start, break_index)
+        next_index = break_index + 1
+        value_list_node = ValueListNode(self.tokens, next_index, self.end)
+        self.children.append(key_node)
+        self.children.append(value_list_node)
         for child in self.children:
             child.parse()
         self.key = self.children[0].key
@@ -551,31 +1193,36 @@ class MetaDictNode(Node):
     
     Attributes:
         meta_dict:      OrderedDict of key - value_list pairs.
+        
+        breaks:         List of integers or None, see MultiParagraphNode.
     
     """
     
+    __slots__ = ('meta_dict', 'breaks')
+    
+    def __init__(self, input, start=0, end=None, breaks=None):
+        Node.__init__(self, input, start, end)
+        self.breaks = breaks
+    
     def parse(self):
         self.children = []
         self.meta_dict = OrderedDict()
-        while self.input:
-            self.parse_chunk()
+        if self.breaks == None:
+            breaks = token_positions(self.tokens, BREAK, self.start, self.end)
+        else:
+            breaks = positions_in_span(self.breaks, self.start, self.end)
+        pos = self.start
+        for break_index in breaks:
+            # This contains two or more DictPairNodes.
+            self.children.append(DictPairNode(self.tokens, pos, break_index))
+            pos = break_index + 1
+        if pos < self.end:
+            # This contains exactly one DictPairNode.
+            self.children.append(DictPairNode(self.tokens, pos, self.end))
         for child in self.children:
             child.parse()
             self.meta_dict[child.key] = child.value_list
     
-    def parse_chunk(self):
-        if '\n\n' in self.input:
-            # This contains two or more DictPairNodes.
-            break_index = self.input.index('\n\n')
-            new_child = DictPairNode(self.input[:break_index])
-            self.children.append(new_child)
-            next_index = break_index + 1
-            self.input = self.input[next_index:]
-        else:
-            # This contains exactly one DictPairNode.
-            self.children.append(DictPairNode(self.input))
-            self.input = []
-    
     def render(self):
         pass
     
@@ -600,55 +1247,75 @@ class WholePageNode(Node):
         
         content:    String, NOT a list of strings, ready to be passed to 
                     the Django template engine. Does NOT include the title.
+        
+        body_start: Integer, index of the first token after the ----- 
+                    separator and its [LF][LF].
     
     """
     
+    __slots__ = ('title', 'meta_dict', 'content', 'body_start')
+    
+    @property
+    def input_str(self):
+        return self.tokens.join(self.start, self.end)
+    
     def easy_error(self, msg_str):
         raise ParserError(
             "WholePageNode.parse() failed because of invalid syntax in the "
             "input file. The offending input file starts like this:\n\n%s "
             "\n\nThe error was this:\n\n%s" % (self.input_str[0:60], msg_str))
     
-    def parse(self):
-        self.input_str = ''.join(self.input)
+    def parse_header(self):
+        """Parse the title and the metadata, but NOT the body of the page
+        
+        This sets self.title and self.meta_dict, exactly as parse() does, but it never looks at the tokens after the ----- token. It is used by build.py to index the titles and aliases of every page before any page is rendered.
+        
+        """
+        
+        tokens = self.tokens
+        kinds = tokens.kinds
         self.children = []
-        if '\n\n' in self.input:
-            break_index = self.input.index('\n\n')
-            title_node = TitleNode(self.input[:break_index])
-            second_child = TerminalNode([self.input[break_index]])
-            self.children.append(title_node)
-            self.children.append(second_child)
-            next_index = break_index + 1
-            self.input = self.input[next_index:]
-        else:
+        
+        break_index = tokens.find(BREAK, self.start, self.end)
+        if break_index == -1:
             self.easy_error("There is no token with two newlines in a row.")
+        title_node = TitleNode(tokens, self.start, break_index)
+        second_child = TerminalNode(tokens, break_index, break_index + 1)
+        self.children.append(title_node)
+        self.children.append(second_child)
+        pos = break_index + 1
         
-        if '-----' in self.input:
-            break_index = self.input.index('-----')
-            if self.input[break_index-1] == '\n\n':
-                # This is correct.
-                pass
-            else:
-                self.easy_error("The ----- token is NOT preceded by [LF][LF].")
-            if self.input[break_index+1] == '\n\n':
-                # This is correct.
-                pass
-            else:
-                self.easy_error("The ----- token is NOT followed by [LF][LF].")
-            meta_dict_node = MetaDictNode(self.input[:(break_index-1)])
-            self.children.append(meta_dict_node)
-            self.input = self.input[(break_index+2):]
-        else:
+        break_index = tokens.find(SEPARATOR, pos, self.end)
+        if break_index == -1:
             self.easy_error("There is no token with five hyphens in a row.")
-        
-        multi_paragraph_node = MultiParagraphNode(self.input)
-        self.children.append(multi_paragraph_node)
+        if break_index - 1 >= pos and kinds[break_index-1] == BREAK:
+            # This is correct.
+            pass
+        else:
+            self.easy_error("The ----- token is NOT preceded by [LF][LF].")
+        if break_index + 1 < self.end and kinds[break_index+1] == BREAK:
+            # This is correct.
+            pass
+        else:
+            self.easy_error("The ----- token is NOT followed by [LF][LF].")
+        meta_dict_node = MetaDictNode(tokens, pos, break_index - 1)
+        self.children.append(meta_dict_node)
+        self.body_start = break_index + 2
         
         for child in self.children:
             child.parse()
         self.title = self.children[0].title
         self.meta_dict = self.children[2].meta_dict
     
+    def parse(self):
+        self.parse_header()
+        # Each Node finds the BREAK tokens in its own span, so the whole 
+        # page is still scanned only once:
+        multi_paragraph_node = MultiParagraphNode(self.tokens, self.body_start, 
+                                                  self.end)
+        self.children.append(multi_paragraph_node)
+        multi_paragraph_node.parse()
+    
     def render(self):
         """This is an UNUSUAL render() method
         
@@ -669,11 +1336,79 @@ class WholePageNode(Node):
         # self.title has already been set.
         # self.meta_dict has already been set.
         content_node = self.children[3]     # Ignore the first 3 nodes.
-        content_node.render()
-        self.content = ''.join(content_node.output)
+        # Join the fragments as they are yielded, the nested output lists of 
+        # content_node.render() are never built:
+        self.content = ''.join(content_node.iter_output())
     
     @property
     def output(self):
         raise ParserError(
             "Unlike most Node objects, WholePageNode instances do NOT "
             "have a node.output attribute. Do not attempt to use it.")
+
+
+#================================ Page Header =================================#
+
+# The first read_page_header() block, in bytes. Each later block is twice as 
+# big, so a file is never re-read more than about twice.
+HEADER_BLOCK_SIZE = 2**12
+
+# A ----- separator that is followed by [LF][LF] and then by the first 
+# character of the body. A match can't be cut short by the end of a block, 
+# because the lookahead needs one more character.
+header_end_pat = re.compile(r"-----\n\n+(?=[^\n])")
+
+def read_page_header(a_file, block_size=HEADER_BLOCK_SIZE):
+    """Return the title and metadata of a page WITHOUT reading the whole body
+    
+    The file is read in blocks, only until the ----- separator. Only the text before the separator is lexed and parsed, see WholePageNode.parse_header(). The result is exactly the same as the title and meta_dict of a full WholePageNode.parse() of the whole file. Iff the header is invalid, the whole file is read, and the error is the same as that of a full parse. Note that CR characters in the body are NOT noticed, since the body is never lexed.
+    
+    This works because no special token contains '-', so lexing the page up to the first character after the [LF][LF] of the separator gives the same tokens as lexing the whole page, except for the last token.
+    
+    Arguments:
+        a_file:         File object, open for reading in binary mode, or 
+                        anything else with a read(size) method.
+        
+        block_size:     Integer, optional, the size of the first block.
+    
+    Returns:
+        title:          String, see WholePageNode.title.
+        
+        meta_dict:      OrderedDict, see WholePageNode.meta_dict.
+    
+    """
+    
+    def parse_whole(text):
+        whole_page_node = WholePageNode(lexer(text, typed=True))
+        whole_page_node.parse_header()
+        return whole_page_node.title, whole_page_node.meta_dict
+    
+    text = ''
+    search_pos = 0
+    while True:
+        block = a_file.read(block_size)
+        if not block:
+            # There is no valid separator, raise the same error as a full 
+            # parse:
+            return parse_whole(text)
+        # A separator may start in the previous block, so back up over its 
+        # trailing newlines and hyphens:
+        search_pos = max(search_pos, len(text.rstrip('\n')) - 5)
+        text += block
+        block_size *= 2
+        for mtch in header_end_pat.finditer(text, search_pos):
+            search_pos = mtch.start() + 1
+            try:
+                tokens = lexer(text[:mtch.end() + 1], typed=True)
+                # Leave out the last token, the first character of the body:
+                end = len(tokens) - 1
+                if tokens.find(SEPARATOR, tokens.find(BREAK, 0, end), 
+                               end) == -1:
+                    # This ----- is in the title, keep looking.
+                    continue
+                whole_page_node = WholePageNode(tokens, 0, end)
+                whole_page_node.parse_header()
+            except DehrError:
+                # The error message shows the start of the WHOLE page:
+                return parse_whole(text + a_file.read())
+            return whole_page_node.title, whole_page_node.meta_dict
@@ -0,0 +1,232 @@
+# File dehr_profile.py
+# 
+# Wall time of every phase of a build, see build.py --profile. Each page is
+# timed by its own PhaseTimer, in whichever process compiled it, and the
+# results are collected in one BuildProfile, which is saved as a JSON report
+# and as a Chrome trace (open it at chrome://tracing or ui.perfetto.dev).
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import time
+
+
+# The phases of compile_one_page(), in order:
+PAGE_PHASES = ['read', 'parse cache', 'lexer', 'parse', 'render',
+               'template compile', 'django render', 'write']
+
+# The column headings of BuildProfile.summary(), one per phase:
+PAGE_PHASE_LABELS = ['read', 'cache', 'lexer', 'parse', 'render', 'compile',
+                     'django', 'write']
+
+
+class NullTimer(object):
+    """A PhaseTimer that records nothing, it is used when not profiling"""
+    
+    @contextmanager
+    def phase(self, name):
+        yield
+    
+    def wrap_file(self, a_file):
+        return a_file
+
+NULL_TIMER = NullTimer()
+
+
+class TimedFile(object):
+    """Wraps a file, adds the time of each write() to PhaseTimer.write_seconds"""
+    
+    def __init__(self, a_file, timer):
+        self.a_file = a_file
+        self.timer = timer
+    
+    def write(self, data):
+        start = time.time()
+        self.a_file.write(data)
+        self.timer.write_seconds += time.time() - start
+
+
+class PhaseTimer(object):
+    """Records the wall time of each phase of one page, or of a whole build
+    
+    The output of a page is written WHILE it is rendered, see build.write_page(). So the time spent in the write() of a file from wrap_file() is taken out of the phase it happened in, and recorded as a 'write' event of its own, right after that phase.
+    
+    Attributes:
+        events:         List of [name, start, seconds], in order. start is a
+                        time.time(), so the events of different processes can be compared.
+        
+        write_seconds:  Float, the total time of every TimedFile.write().
+    
+    """
+    
+    def __init__(self):
+        self.events = []
+        self.write_seconds = 0.0
+    
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        write_seconds = self.write_seconds
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            written = self.write_seconds - write_seconds
+            self.events.append([name, start, seconds - written])
+            if written:
+                self.events.append(['write', start + seconds - written,
+                                    written])
+    
+    def wrap_file(self, a_file):
+        return TimedFile(a_file, self)
+
+
+def phase_totals(events):
+    """Return an OrderedDict, phase name --> total seconds, in event order"""
+    totals = OrderedDict()
+    for name, start, seconds in events:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return totals
+
+
+def page_timing(page_filename, start, seconds, timer):
+    """Return the timing of one page, as a dict that JSON and pickle can take
+    
+    Arguments:
+        page_filename:  String, e.g. "lexapro.html".
+        
+        start:          Float, time.time() when the page started.
+        
+        seconds:        Float, the wall time of the whole page, including
+                        what is not in a phase, e.g. hashing the source for the manifest.
+        
+        timer:          PhaseTimer object of the page.
+    
+    """
+    
+    return OrderedDict([
+        ('page', page_filename),
+        ('pid', os.getpid()),
+        ('start', start),
+        ('seconds', seconds),
+        ('phases', phase_totals(timer.events)),
+        ('events', timer.events),
+    ])
+
+
+class BuildProfile(object):
+    """The timings of one build, see build_all()
+    
+    Attributes:
+        start:      Float, time.time() when the build started.
+        
+        seconds:    Float, the wall time of the whole build.
+        
+        build:      PhaseTimer of the build itself, e.g. 'load prior'.
+        
+        pages:      List of page_timing() dicts, one per compiled page.
+    
+    """
+    
+    def __init__(self):
+        self.start = time.time()
+        self.seconds = None
+        self.build = PhaseTimer()
+        self.pages = []
+    
+    def finish(self):
+        self.seconds = time.time() - self.start
+    
+    def slowest(self, top):
+        return sorted(self.pages, key=lambda timing: -timing['seconds'])[:top]
+    
+    def to_json_dict(self):
+        page_totals = OrderedDict((name, 0.0) for name in PAGE_PHASES)
+        for timing in self.pages:
+            for name, seconds in timing['phases'].items():
+                page_totals[name] = page_totals.get(name, 0.0) + seconds
+        return OrderedDict([
+            ('start', self.start),
+            ('seconds', self.seconds),
+            ('build_phases', phase_totals(self.build.events)),
+            ('page_phases', page_totals),
+            ('pages', self.pages),
+        ])
+    
+    def to_chrome_trace(self):
+        """Return the Trace Event Format dict, one track per process
+        
+        See https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+        
+        """
+        
+        def event(name, category, pid, start, seconds, args=None):
+            trace_event = OrderedDict([
+                ('name', name),
+                ('cat', category),
+                ('ph', 'X'),
+                ('ts', round(1e6 * (start - self.start), 1)),
+                ('dur', round(1e6 * seconds, 1)),
+                ('pid', pid),
+                ('tid', pid),
+            ])
+            if args != None:
+                trace_event['args'] = args
+            return trace_event
+        
+        trace_events = []
+        pid = os.getpid()
+        trace_events.append(event('build', 'build', pid, self.start,
+                                  self.seconds))
+        for name, start, seconds in self.build.events:
+            trace_events.append(event(name, 'build', pid, start, seconds))
+        for timing in self.pages:
+            trace_events.append(event(timing['page'], 'page', timing['pid'],
+                                      timing['start'], timing['seconds']))
+            for name, start, seconds in timing['events']:
+                trace_events.append(event(name, 'phase', timing['pid'],
+                                          start, seconds,
+                                          {'page': timing['page']}))
+        return OrderedDict([
+            ('traceEvents', trace_events),
+            ('displayTimeUnit', 'ms'),
+        ])
+    
+    def save(self, report_filepathname, trace_filepathname):
+        """Save the JSON report, and the Chrome trace, which is not indented"""
+        report_file = open(report_filepathname, 'wb')
+        json.dump(self.to_json_dict(), report_file, indent=1)
+        report_file.close()
+        trace_file = open(trace_filepathname, 'wb')
+        json.dump(self.to_chrome_trace(), trace_file, separators=(',', ':'))
+        trace_file.close()
+    
+    def summary(self, top=10):
+        """Return a human-readable summary, with the top slowest pages"""
+        
+        def ms(seconds):
+            return '%.1f' % (1e3 * seconds)
+        
+        json_dict = self.to_json_dict()
+        o = ["Built in %s ms, %s page(s) compiled." % (
+            ms(self.seconds), len(self.pages))]
+        o.append("Build phases (ms): " + ', '.join(
+            '%s %s' % (name, ms(seconds))
+            for name, seconds in json_dict['build_phases'].items()))
+        o.append("Page phases, all pages (ms): " + ', '.join(
+            '%s %s' % (name, ms(seconds))
+            for name, seconds in json_dict['page_phases'].items()))
+        if not self.pages:
+            return '\n'.join(o)
+        
+        o.append("Slowest %s page(s) (ms):" % min(top, len(self.pages)))
+        width = max(len(timing['page']) for timing in self.slowest(top))
+        o.append('    %-*s %8s' % (width, 'page', 'total') + ''.join(
+            ' %8s' % label for label in PAGE_PHASE_LABELS))
+        for timing in self.slowest(top):
+            o.append('    %-*s %8s' % (width, timing['page'],
+                                       ms(timing['seconds'])) + ''.join(
+                ' %8s' % ms(timing['phases'].get(name, 0.0))
+                for name in PAGE_PHASES))
+        return '\n'.join(o)
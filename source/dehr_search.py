@@ -0,0 +1,247 @@
+# File dehr_search.py
+# 
+# The full-text search index of the website. build.py writes it to
+# build/search after every build that changed a page, and the page
+# search.html loads it in the browser, see templates/search_box.html. The
+# index is sharded by a hash of each term, so a query only loads the shards
+# of its own terms.
+# 
+# Files, all JSON:
+# 
+#     pages.json      {"version": 1, "shards": N, "pages": [[title, url],
+#                     ...]}. A page is its position in "pages".
+#     shard_K.json    {term: [page, score, page, score, ...], ...}, every term
+#                     whose term_shard() is K, pages in order.
+
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+
+from dehr_helpers import *
+
+
+class SearchIndexError(DehrError):
+    pass
+
+
+# The directory of the index, in build/:
+SEARCH_DIRNAME = 'search'
+
+# Changed whenever the files change, search_box.html checks it:
+SEARCH_VERSION = 1
+
+# Each time a term is in the title of a page counts this many times as much
+# as in its text, and the same for each alias:
+TITLE_WEIGHT = 10
+ALIAS_WEIGHT = 5
+
+# Shorter terms are not indexed:
+MIN_TERM_LENGTH = 2
+
+# The number of shards is a power of two, about one per this many pages:
+PAGES_PER_SHARD = 64
+MAX_SHARDS = 256
+
+# A term is a run of ASCII letters and digits, or of any letter above
+# U+00C0. search_box.html splits queries with the SAME regex:
+term_pat = re.compile(u'[a-z0-9\u00c0-\uffff]+')
+
+# HTML tags, entities, and Django variables and comments, none of which is
+# text of the page:
+markup_pat = re.compile(r'(?s)<[^>]*>|&#?\w+;|\{\{.*?\}\}|\{#.*?#\}')
+
+# A Django tag, e.g. {% link "heroin" "smack" %}. Only its quoted arguments
+# are text of the page:
+tag_pat = re.compile(r'(?s)\{%.*?%\}')
+quoted_pat = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+
+
+def tag_text(mtch):
+    return ' '.join(double or single
+                    for double, single in quoted_pat.findall(mtch.group(0)))
+
+
+def text_terms(text):
+    """Return the list of the terms of a string, in order, with repeats
+    
+    text may be HTML with Django tags, e.g. WholePageNode.content.
+    
+    """
+    
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    text = markup_pat.sub(u' ', tag_pat.sub(tag_text, text))
+    return [term for term in term_pat.findall(text.lower())
+            if len(term) >= MIN_TERM_LENGTH]
+
+
+def term_shard(term, num_shards):
+    """Return the shard of a unicode term, from 0 to num_shards - 1
+    
+    This is the 32-bit FNV-1a hash of the UTF-16 code units of the term, which is what a JavaScript string is made of, so search_box.html computes the same hash with charCodeAt().
+    
+    """
+    
+    data = term.encode('utf-16-le')
+    hash_value = 0x811c9dc5
+    for pos in xrange(0, len(data), 2):
+        hash_value ^= ord(data[pos]) | (ord(data[pos + 1]) << 8)
+        hash_value = (hash_value * 0x01000193) & 0xFFFFFFFF
+    return hash_value % num_shards
+
+
+def num_shards_for(num_pages):
+    num_shards = 1
+    while num_shards * PAGES_PER_SHARD < num_pages and num_shards < MAX_SHARDS:
+        num_shards *= 2
+    return num_shards
+
+
+class SearchIndexWriter(object):
+    """Writes the search index one page at a time, with bounded memory
+    
+    add_page() scores the terms of one page, and appends its postings to a temporary spill file per shard. finish() then reads back one spill file at a time, and writes its shard. So only one page, or one shard, is ever in memory.
+    
+    Everything is written to a temporary directory next to search_dir, which finish() renames to search_dir. A browser that loads the index gets the old shards or the new ones, never a mix of the two.
+    
+    Attributes:
+        search_dir:     String, e.g. ".../build/search".
+        
+        num_shards:     Integer, see num_shards_for().
+        
+        temp_dir:       String, the temporary directory.
+        
+        pages:          List of [title, url], one per page added.
+    
+    """
+    
+    def __init__(self, search_dir, num_shards):
+        self.search_dir = search_dir
+        self.num_shards = num_shards
+        self.temp_dir = tempfile.mkdtemp(
+            prefix='.%s-' % os.path.basename(search_dir),
+            dir=os.path.dirname(search_dir))
+        self.pages = []
+        self.spill_files = [
+            open(os.path.join(self.temp_dir, 'spill_%s.txt' % shard), 'wb')
+            for shard in range(num_shards)]
+    
+    def add_page(self, title, url, content, aliases):
+        """Add one page to the index
+        
+        Arguments:
+            title:      String, WholePageNode.title.
+            
+            url:        String, e.g. "lexapro.html".
+            
+            content:    String, WholePageNode.content.
+            
+            aliases:    List of the lowercase aliases of the page, see
+                        build.add_page_names().
+        
+        """
+        
+        page = len(self.pages)
+        self.pages.append([title, url])
+        scores = {}
+        for term in text_terms(content):
+            scores[term] = scores.get(term, 0) + 1
+        for term in text_terms(title):
+            scores[term] = scores.get(term, 0) + TITLE_WEIGHT
+        for alias in aliases:
+            if alias == title.lower():
+                continue
+            for term in text_terms(alias):
+                scores[term] = scores.get(term, 0) + ALIAS_WEIGHT
+        for term, score in scores.items():
+            self.spill_files[term_shard(term, self.num_shards)].write(
+                '%s\t%s\t%s\n' % (term.encode('utf-8'), page, score))
+    
+    def finish(self):
+        """Write every shard and pages.json, then move them to search_dir"""
+        for shard, spill_file in enumerate(self.spill_files):
+            spill_file.close()
+            spill_filepathname = spill_file.name
+            postings = {}
+            spill_file = open(spill_filepathname, 'rb')
+            for line in spill_file:
+                term, page, score = line.rstrip('\n').split('\t')
+                postings.setdefault(term.decode('utf-8'), []).extend(
+                    [int(page), int(score)])
+            spill_file.close()
+            os.remove(spill_filepathname)
+            self.write_json('shard_%s.json' % shard, postings)
+            del postings
+        self.write_json('pages.json', {'version': SEARCH_VERSION,
+                                       'shards': self.num_shards,
+                                       'pages': self.pages})
+        
+        old_dir = None
+        if os.path.isdir(self.search_dir):
+            old_dir = self.temp_dir + '.old'
+            os.rename(self.search_dir, old_dir)
+        os.rename(self.temp_dir, self.search_dir)
+        if old_dir != None:
+            shutil.rmtree(old_dir)
+    
+    def abort(self):
+        """Remove the temporary directory, and leave search_dir as it was"""
+        for spill_file in self.spill_files:
+            spill_file.close()
+        shutil.rmtree(self.temp_dir, True)
+    
+    def write_json(self, filename, json_obj):
+        json_file = open(os.path.join(self.temp_dir, filename), 'wb')
+        json.dump(json_obj, json_file, sort_keys=True, separators=(',', ':'))
+        json_file.close()
+
+
+def load_shard(search_dir, shard):
+    """Return the dict of one shard, term --> [page, score, ...]"""
+    filepathname = os.path.join(search_dir, 'shard_%s.json' % shard)
+    try:
+        shard_file = open(filepathname, 'rb')
+    except IOError as err:
+        raise SearchIndexError("Could not open the search shard %s." %
+                               filepathname, str(err))
+    try:
+        return json.load(shard_file)
+    finally:
+        shard_file.close()
+
+
+def search(search_dir, query, limit=20):
+    """Return the best [title, url] of every page that has EVERY query term
+    
+    This is what search_box.html does in the browser, it is used by the tests and for debugging. Each page gets the sum of score * log(1 + num_pages / pages with the term) over the query terms.
+    
+    """
+    
+    pages_file = open(os.path.join(search_dir, 'pages.json'), 'rb')
+    meta = json.load(pages_file)
+    pages_file.close()
+    terms = sorted(set(text_terms(query)))
+    if not terms:
+        return []
+    
+    shards = {}
+    totals = None
+    for term in terms:
+        shard = term_shard(term, meta['shards'])
+        if shard not in shards:
+            shards[shard] = load_shard(search_dir, shard)
+        postings = shards[shard].get(term, [])
+        weight = math.log(1 + len(meta['pages']) / (len(postings) / 2.0 or 1))
+        scores = {}
+        for pos in range(0, len(postings), 2):
+            scores[postings[pos]] = postings[pos + 1] * weight
+        if totals == None:
+            totals = scores
+        else:
+            totals = dict((page, total + scores[page])
+                          for page, total in totals.items() if page in scores)
+    best = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+    return [meta['pages'][page] for page, total in best[:limit]]
@@ -0,0 +1,120 @@
+# File dehr_synthetic.py
+# 
+# Generates synthetic pages in the same format as the files in source/pages. 
+# They are used by the unit tests and by dehr_bench.py.
+
+import os
+import random
+
+
+WORDS = ['dopamine', 'receptor', 'agonist', 'the', 'of', 'and', 'reuptake',
+         'serotonin', 'dose', 'a', 'is', 'in', 'heart', 'rate', 'effects']
+
+def make_paragraph(rng, link_targets=None):
+    """Return one paragraph of fake prose, it uses most of the special tokens
+    
+    Iff link_targets is a list of aliases, every {% link %} goes to one of them. Otherwise, the links go to random words, which are mostly broken links.
+    
+    """
+    
+    words = [rng.choice(WORDS) for i in range(rng.randint(8, 40))]
+    for i in range(rng.randint(0, 3)):
+        where = rng.randint(0, len(words) - 1)
+        # Always decorate a fresh word. Decorating words[where] again could 
+        # nest a {% link %} inside another one, which Django can't parse.
+        word = rng.choice(WORDS)
+        decorated = rng.choice([
+            word + ',',
+            word + ':',
+            '<b>%s</b>' % word,
+            '{%% link "%s" %%}' % word])
+        if decorated[:2] == '{%' and link_targets:
+            decorated = '{%% link "%s" %%}' % rng.choice(link_targets)
+        words[where] = decorated
+    line = ' '.join(words).capitalize() + '.'
+    kind = rng.randint(0, 9)
+    if kind == 0:
+        return '<h2>%s</h2>' % line
+    elif kind == 1:
+        return '<nop>%s' % line
+    elif kind == 2:
+        return '\\' + '<i>%s</i>' % line
+    elif kind == 3:
+        return '{% indent %}\n\n' + line + '\n\n{% endindent %}'
+    return line
+
+
+def make_synthetic_page(target_size, seed=0, title=None, hidden_names=None, 
+                        link_targets=None):
+    """Return a string in the DEHR page format, about target_size bytes long
+    
+    The same arguments always produce the same page.
+    
+    Arguments:
+        target_size:    Integer, the page is at least this many bytes.
+        
+        seed:           Integer, the seed of the random prose.
+        
+        title:          String or None, the default is based on target_size.
+        
+        hidden_names:   List of strings or None, extra aliases of the page. 
+                        Iff not None, they are listed as "Hidden names".
+        
+        link_targets:   List of strings or None, see make_paragraph().
+    
+    """
+    
+    if title == None:
+        title = 'Synthetic Page %s' % target_size
+    rng = random.Random(seed)
+    o = ['%s\n\n' % title]
+    o.append('Page type: Concept\n\n')
+    o.append('Related names: Foo, Bar, Baz.\n\n')
+    if hidden_names:
+        o.append('Hidden names: %s.\n\n' % ', '.join(hidden_names))
+    o.append('-----\n\n')
+    size = sum(len(x) for x in o)
+    while size < target_size:
+        paragraph = make_paragraph(rng, link_targets) + '\n\n'
+        o.append(paragraph)
+        size += len(paragraph)
+    return ''.join(o)
+
+
+def synthetic_hidden_names(page_number, num_names):
+    return ['Alias %s of page %s' % (j, page_number) for j in range(num_names)]
+
+
+def write_synthetic_corpus(pages_dir, num_pages, page_size=2**11, 
+                           aliases_per_page=0):
+    """Write num_pages synthetic pages to pages_dir, e.g. source/pages
+    
+    Every page has its own title, so every page has its own alias. The pages are named page00000.html, page00001.html, etc.
+    
+    Iff aliases_per_page > 0, each page also has that many hidden names, and every {% link %} goes to a title or hidden name of some page, so no link is broken. The more aliases, the bigger all_page_data.py and the alias index.
+    
+    Returns:
+        page_filenames:     List of strings, the pages that were written.
+    
+    """
+    
+    link_targets = None
+    if aliases_per_page > 0:
+        link_targets = []
+        for i in range(num_pages):
+            link_targets.append('Synthetic Page %s' % i)
+            link_targets.extend(synthetic_hidden_names(i, aliases_per_page))
+    
+    page_filenames = []
+    for i in range(num_pages):
+        page_filename = 'page%05d.html' % i
+        hidden_names = None
+        if aliases_per_page > 0:
+            hidden_names = synthetic_hidden_names(i, aliases_per_page)
+        page_file = open(os.path.join(pages_dir, page_filename), 'wb')
+        page_file.write(make_synthetic_page(page_size, i, 
+                                            'Synthetic Page %s' % i, 
+                                            hidden_names, link_targets))
+        page_file.close()
+        page_filenames.append(page_filename)
+    return page_filenames
@@ -14,7 +14,11 @@
 # case it breaks with a future release of Django. I will need to load this 
 # tag file when I configure the Django Template Engine in build.py.
 
+import re
+
 from django import template
+from django.template.base import BLOCK_TAG_START, tag_re
+from django.utils.encoding import force_text
 from django.utils.safestring import mark_safe
 
 from dehr_helpers import *
@@ -105,3 +109,130 @@ def link(context, target, display=None):
     else:
         html_str = '<a href="%s">%s</a>' % (url_str, display)
     return mark_safe(html_str)
+
+
+#=============================== Static Expansion =============================#
+
+# The tags that expand_static_tags() can replace with their output, before 
+# Django ever sees the page. Each one only depends on its arguments (and 
+# link on the page's AllPageData), never on the rest of the Context:
+STATIC_TAGS = {
+    'indent': indent,
+    'endindent': endindent,
+    'clearfix': clearfix,
+    'wiki': wiki,
+    'link': link,
+}
+
+# The number of arguments of each static tag, (min, max):
+STATIC_TAG_ARGS = {
+    'indent': (0, 0),
+    'endindent': (0, 0),
+    'clearfix': (0, 0),
+    'wiki': (1, 2),
+    'link': (1, 2),
+}
+
+# Block tags that do not stop {% link %} from being expanded, see 
+# expand_static_tags(). The contents of {% verbatim %} are only text:
+PASSIVE_BLOCK_TAGS = set(STATIC_TAGS) | set(['load', 'verbatim', 
+                                             'endverbatim'])
+
+# The contents of a static tag whose arguments are all plain string 
+# literals. A literal with a backslash is left to Django, which unescapes it. 
+# So is a literal with { or }, because its output must never look like 
+# template syntax once it is part of the template:
+static_tag_pat = re.compile(r"""(?x)
+^(\w+)
+((?:\s+(?:"[^"\\{}]*"|'[^'\\{}]*'))*)
+$""")
+
+literal_pat = re.compile(r""""([^"]*)"|'([^']*)'""")
+
+
+def split_template(template_str):
+    """Split a template the way the Django Lexer does
+    
+    Returns:
+        bits:   List of [kind, string] pairs, kind is 'text', 'block', or 
+                'other' (a variable or a comment). The strings joined are template_str. The contents of {% verbatim %} are text, exactly as in django.template.base.Lexer.create_token().
+    
+    """
+    
+    bits = []
+    in_tag = False
+    verbatim = False
+    for bit in tag_re.split(template_str):
+        if bit:
+            kind = 'text'
+            if in_tag and bit.startswith(BLOCK_TAG_START):
+                block_content = bit[2:-2].strip()
+                if verbatim and block_content == verbatim:
+                    verbatim = False
+            if in_tag and not verbatim:
+                if bit.startswith(BLOCK_TAG_START):
+                    if block_content[:9] in ('verbatim', 'verbatim '):
+                        verbatim = 'end%s' % block_content
+                    kind = 'block'
+                else:
+                    kind = 'other'
+            bits.append([kind, bit])
+        in_tag = not in_tag
+    return bits
+
+
+def static_tag_call(block_content):
+    """Return (tag name, list of arguments), or None iff it is not static"""
+    mtch = static_tag_pat.match(block_content)
+    if not mtch or mtch.group(1) not in STATIC_TAGS:
+        return None
+    name = mtch.group(1)
+    args = [double or single for double, single in 
+            literal_pat.findall(mtch.group(2))]
+    min_args, max_args = STATIC_TAG_ARGS[name]
+    if not min_args <= len(args) <= max_args:
+        # Let Django raise its TemplateSyntaxError.
+        return None
+    return name, args
+
+
+def expand_static_tags(template_str, apd):
+    """Replace the static tags of a page body with their HTML output
+    
+    Most tags in a page body are {% link "..." %}, {% wiki "..." %}, {% indent %}, {% endindent %}, and {% clearfix %} with only string literals as arguments. Their output is known before the page is rendered, so they are replaced by it here, and the Django Parser and the simple_tag machinery only see the rest. The tag functions themselves make the output, so it is exactly what Django would render.
+    
+    {% link %} is only expanded iff the page has no other block tags (except {% load %}), because e.g. a {% link %} in an {% if %} that is false must NOT look up its target: the lookups are recorded for the build manifest, and for the broken links.
+    
+    Arguments:
+        template_str:   String, the page body, e.g. WholePageNode.content.
+        
+        apd:            AllPageData object of the page, for {% link %}.
+    
+    Returns:
+        A unicode string, the same template with the static tags expanded.
+    
+    """
+    
+    bits = split_template(force_text(template_str))
+    calls = {}
+    expand_links = True
+    for i, (kind, bit) in enumerate(bits):
+        if kind != 'block':
+            continue
+        call = static_tag_call(bit[2:-2].strip())
+        if call != None:
+            calls[i] = call
+        elif (bit[2:-2].split() or [''])[0] not in PASSIVE_BLOCK_TAGS:
+            expand_links = False
+    
+    context = {'apd': apd}
+    o = []
+    for i, (kind, bit) in enumerate(bits):
+        call = calls.get(i)
+        if call == None or (call[0] == 'link' and not expand_links):
+            o.append(bit)
+        elif call[0] == 'link':
+            o.append(link(context, *call[1]))
+        else:
+            o.append(STATIC_TAGS[call[0]](*call[1]))
+    return u''.join(o)
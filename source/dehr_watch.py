@@ -0,0 +1,368 @@
+# File dehr_watch.py
+# 
+# The watch mode of build.py: it waits for changes to the files in
+# source/pages and source/templates, calls back into build.py to recompile,
+# and serves the build directory over HTTP. Every page served has a small
+# script added that reloads it after each rebuild. See watch().
+
+import BaseHTTPServer
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import SimpleHTTPServer
+import SocketServer
+import struct
+import threading
+import time
+import traceback
+import urlparse
+
+from dehr_helpers import *
+
+
+class WatchError(DehrError):
+    pass
+
+
+# After the first change, wait this many seconds for more. An editor that
+# saves a file often makes several events (write, rename, chmod, ...):
+SETTLE_SECONDS = 0.02
+
+# How often PollingWatcher looks at the directories:
+POLL_SECONDS = 0.1
+
+
+#================================== Watchers ==================================#
+
+class InotifyWatcher(object):
+    """Waits for changes to the files in some directories, using Linux inotify
+    
+    inotify is called through ctypes, so nothing needs to be installed. On other systems, or iff inotify fails, the constructor raises a WatchError, see make_watcher().
+    
+    Attributes:
+        dirs:       Dict, inotify watch descriptor --> directory.
+    
+    """
+    
+    # From <sys/inotify.h>:
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    
+    # IN_MODIFY is NOT watched, it fires before the editor finished writing.
+    # IN_CLOSE_WRITE fires after:
+    MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE)
+    
+    # wd, mask, cookie, length of the name, then the name itself:
+    EVENT_FORMAT = 'iIII'
+    EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+    
+    def __init__(self, dirs):
+        libc_name = ctypes.util.find_library('c')
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            inotify_init = libc.inotify_init
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError) as err:
+            raise WatchError("inotify is not available.", str(err))
+        self.fd = inotify_init()
+        if self.fd < 0:
+            raise WatchError("inotify_init() failed.",
+                             os.strerror(ctypes.get_errno()))
+        self.dirs = {}
+        for dir_path in dirs:
+            wd = inotify_add_watch(self.fd, dir_path, self.MASK)
+            if wd < 0:
+                self.close()
+                raise WatchError("inotify_add_watch() failed for %s." %
+                                 dir_path, os.strerror(ctypes.get_errno()))
+            self.dirs[wd] = dir_path
+    
+    def close(self):
+        os.close(self.fd)
+    
+    def read_events(self, changed):
+        """Read the waiting events, add (dir_path, filename) pairs to changed"""
+        data = os.read(self.fd, 2**16)
+        pos = 0
+        while pos + self.EVENT_SIZE <= len(data):
+            wd, mask, cookie, name_length = struct.unpack_from(
+                self.EVENT_FORMAT, data, pos)
+            pos += self.EVENT_SIZE
+            name = data[pos:pos+name_length].rstrip('\0')
+            pos += name_length
+            if wd in self.dirs and name:
+                changed.add((self.dirs[wd], name))
+    
+    def changes(self, timeout):
+        """Wait for changes, return a set of (dir_path, filename) pairs
+        
+        The set is empty iff nothing changed for timeout seconds.
+        
+        """
+        
+        changed = set()
+        wait = timeout
+        while True:
+            try:
+                readable = select.select([self.fd], [], [], wait)[0]
+            except select.error as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+                readable = []
+            if not readable:
+                return changed
+            self.read_events(changed)
+            wait = SETTLE_SECONDS
+
+
+class PollingWatcher(object):
+    """The same as InotifyWatcher, but it stats every file every POLL_SECONDS
+    
+    Attributes:
+        dirs:       List of directories.
+        
+        snapshot:   Dict, (dir_path, filename) --> (mtime, size).
+    
+    """
+    
+    def __init__(self, dirs):
+        self.dirs = list(dirs)
+        self.snapshot = self.take_snapshot()
+    
+    def close(self):
+        pass
+    
+    def take_snapshot(self):
+        snapshot = {}
+        for dir_path in self.dirs:
+            for filename in os.listdir(dir_path):
+                try:
+                    stat = os.stat(os.path.join(dir_path, filename))
+                except OSError:
+                    # Deleted since listdir()
+                    continue
+                snapshot[(dir_path, filename)] = (stat.st_mtime, stat.st_size)
+        return snapshot
+    
+    def changes(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            snapshot = self.take_snapshot()
+            changed = set()
+            for key in set(snapshot) | set(self.snapshot):
+                if snapshot.get(key) != self.snapshot.get(key):
+                    changed.add(key)
+            self.snapshot = snapshot
+            if changed or time.time() >= deadline:
+                return changed
+            time.sleep(min(POLL_SECONDS, max(0, deadline - time.time())))
+
+
+def make_watcher(dirs):
+    """Return an InotifyWatcher, or a PollingWatcher iff inotify fails"""
+    try:
+        return InotifyWatcher(dirs)
+    except WatchError:
+        return PollingWatcher(dirs)
+
+
+#=============================== Reload Server ================================#
+
+# Added to every HTML page that the ReloadServer sends. It asks the server
+# for the build version, which blocks until the next rebuild, then reloads:
+RELOAD_SCRIPT = """<script>
+(function (version) {
+    function poll() {
+        var request = new XMLHttpRequest();
+        request.open('GET', '/__reload?version=' + version);
+        request.onload = function () {
+            if (request.responseText != String(version)) {
+                location.reload();
+            } else {
+                poll();
+            }
+        };
+        request.onerror = function () { setTimeout(poll, 1000); };
+        request.send();
+    }
+    poll();
+})(%s);
+</script>
+"""
+
+# Seconds, a /__reload request is answered after this long even iff nothing
+# was rebuilt, so no proxy or browser times it out:
+RELOAD_POLL_SECONDS = 25
+
+
+class ReloadRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Serves the build directory, and the /__reload long poll"""
+    
+    def translate_path(self, path):
+        # SimpleHTTPRequestHandler serves the current directory, serve the
+        # build directory instead:
+        rel_path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(
+            self, path)[len(os.getcwd()):]
+        return self.server.build_dir + rel_path
+    
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == '/__reload':
+            query = urlparse.parse_qs(url.query)
+            try:
+                version = int(query.get('version', ['0'])[0])
+            except ValueError:
+                version = 0
+            self.send_text(str(self.server.wait_for_version(
+                version, RELOAD_POLL_SECONDS)), 'text/plain')
+            return
+        
+        file_path = self.translate_path(url.path)
+        if os.path.isdir(file_path):
+            file_path = os.path.join(file_path, 'index.html')
+        if file_path.endswith('.html') and os.path.isfile(file_path):
+            # Read the version BEFORE the page, so a rebuild in between
+            # reloads the page once more instead of never:
+            version = self.server.version
+            html_file = open(file_path, 'rb')
+            html = html_file.read()
+            html_file.close()
+            self.send_text(add_reload_script(html, version),
+                           'text/html; charset=UTF-8')
+            return
+        SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+    
+    def send_text(self, text, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(text)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(text)
+    
+    def log_message(self, format, *args):
+        # Don't print a line for every request.
+        pass
+
+
+def add_reload_script(html, version):
+    """Return html with RELOAD_SCRIPT before its </body>, or at its end"""
+    script = RELOAD_SCRIPT % version
+    pos = html.rfind('</body>')
+    if pos == -1:
+        return html + script
+    return html[:pos] + script + html[pos:]
+
+
+class ReloadServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server for the build directory, it tells browsers to reload
+    
+    Each request is handled in its own thread, so the /__reload long polls don't block each other.
+    
+    Attributes:
+        build_dir:  String, the directory that is served.
+        
+        version:    Integer, incremented by notify() after every rebuild.
+    
+    """
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, address, build_dir):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ReloadRequestHandler)
+        self.build_dir = build_dir
+        self.version = 0
+        self.condition = threading.Condition()
+    
+    def notify(self):
+        """Tell every waiting browser to reload"""
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+    
+    def wait_for_version(self, version, timeout):
+        """Wait until self.version != version, return self.version"""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.version == version and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            return self.version
+
+
+#==================================== Watch ===================================#
+
+def is_page(filename):
+    return filename.endswith('.html') and not filename.startswith('.')
+
+
+def is_template(filename):
+    # Skip the swap and backup files of editors, e.g. .base.html.swp,
+    # base.html~, and #base.html#:
+    return not (filename.startswith('.') or filename.startswith('#') or
+                filename.endswith('~'))
+
+
+def watch(base_dir, update, port=8000, host='127.0.0.1'):
+    """Serve the build directory, and rebuild every time a source file changes
+    
+    This runs until Ctrl-C.
+    
+    Arguments:
+        base_dir:   String, usually BASE_DIR.
+        
+        update:     Function update(page_filenames, template_names), called
+                    with the sorted lists of the pages and templates that changed (or were added or deleted). It recompiles what is needed, and returns the list of the pages it compiled. See build.LiveBuild.update().
+        
+        port:       Integer, the port of the HTTP server.
+        
+        host:       String, the address of the HTTP server. The default only
+                    accepts connections from this computer.
+    
+    """
+    
+    pages_dir = os.path.join(base_dir, 'source', 'pages')
+    templates_dir = os.path.join(base_dir, 'source', 'templates')
+    server = ReloadServer((host, port), os.path.join(base_dir, 'build'))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    watcher = make_watcher([pages_dir, templates_dir])
+    print "Serving build/ at http://%s:%s/ (%s). Press Ctrl-C to stop." % (
+        host, server.server_address[1], type(watcher).__name__)
+    
+    try:
+        while True:
+            changed = watcher.changes(1.0)
+            page_filenames = sorted(filename for dir_path, filename in changed
+                                    if dir_path == pages_dir and
+                                    is_page(filename))
+            template_names = sorted(filename for dir_path, filename in changed
+                                    if dir_path == templates_dir and
+                                    is_template(filename))
+            if not (page_filenames or template_names):
+                continue
+            start = time.time()
+            try:
+                compiled = update(page_filenames, template_names)
+            except Exception:
+                # Keep watching, the next save may fix it:
+                traceback.print_exc()
+                continue
+            server.notify()
+            print "Rebuilt %s page(s) in %.0f ms." % (
+                len(compiled), 1e3 * (time.time() - start))
+    except KeyboardInterrupt:
+        print
+    finally:
+        watcher.close()
+        server.shutdown()
+        server.server_close()
@@ -1,8 +1,18 @@
 # File test_build.py
 
+import json
+import pickle
+import shutil
+import signal
+from StringIO import StringIO
+import tempfile
 import unittest
 
 from build import *
+import dehr_search
+from dehr_parser import ParserError
+from dehr_synthetic import write_synthetic_corpus
+from dehr_template_tags import WIKI_URL
 
 
 class InitialTest(unittest.TestCase):
@@ -66,6 +76,568 @@ bunny_ocean_aliases = OrderedDict([
 """)
 
 
+class TemplateTest(unittest.TestCase):
+    def test_layout_compiled_once(self):
+        engine = make_engine(BASE_DIR)
+        layout = engine.get_template(LAYOUT_TEMPLATE)
+        self.assertTrue(engine.get_template(LAYOUT_TEMPLATE) is layout)
+    
+    def test_page_body_tags(self):
+        engine = make_engine(BASE_DIR)
+        apd = AllPageData()
+        apd.add_alias('Cocaine', 'cocaine.html')
+        apd.prior.aliases = apd.next.aliases.copy()
+        body_template = compile_page_body(
+            engine, 
+            '{% link "cocaine" "Coke" %} {% link "nowhere" %}\n'
+            '{% indent %}{% wiki "heroin" %}{% endindent %}')
+        rendered = body_template.render(Context({'apd': apd}))
+        self.assertEqual(
+            rendered,
+            '<a href="cocaine.html">Coke</a> <u>nowhere [broken link]</u>\n'
+            '<div class="indent"><a target="_blank" href="%s">heroin</a>'
+            '</div> <!-- div.indent -->' % (WIKI_URL % 'heroin'))
+    
+    
+    def test_write_page_streams_the_same_bytes(self):
+        engine = make_engine(BASE_DIR)
+        apd = AllPageData()
+        apd.add_alias('Cocaine', 'cocaine.html')
+        apd.prior.aliases = apd.next.aliases.copy()
+        body_template = compile_page_body(
+            engine, '<p>\n{% link "cocaine" %}\n</p>\n\n{% indent %}\n\n'
+                    '{% wiki "heroin" %}\n\n{% endindent %}')
+        for layout_str in ['{% extends "base.html" %}', 
+                           'No content.', 
+                           '{{ page_content|safe }}{{ page_content|safe }}']:
+            layout = engine.from_string(layout_str)
+            expected_context = Context({'apd': apd, 'page_title': 'Test'})
+            expected_context['page_content'] = body_template.render(
+                expected_context)
+            expected = layout.render(expected_context)
+            out_file = StringIO()
+            write_page(out_file, layout, body_template, 
+                       Context({'apd': apd, 'page_title': 'Test'}))
+            self.assertEqual(out_file.getvalue(), expected)
+            self.assertFalse(PAGE_CONTENT_MARKER in out_file.getvalue())
+    
+    
+    def test_page_renderer(self):
+        prior = AllPageDataPart(False)
+        add_page_names(prior, 'cocaine.html', 'Cocaine', OrderedDict())
+        add_page_names(prior, 'heroin.html', 'Heroin', OrderedDict())
+        renderer = PageRenderer(make_engine(BASE_DIR), prior)
+        
+        contexts = []
+        for i in range(2):
+            apd = AllPageData()
+            apd.prior = prior
+            apd.lookups = {}
+            contexts.append((apd, renderer.page_context(
+                apd, 'index%s.html' % i, 'Index', 
+                OrderedDict([('Page type', ['Index'])]))))
+        for apd, context in contexts:
+            self.assertEqual(context['all_pages_list'], 
+                             [['Cocaine', 'cocaine.html'], 
+                              ['Heroin', 'heroin.html']])
+            self.assertTrue(apd.titles_used)
+            self.assertEqual(apd.lookups, {'cocaine': 'cocaine.html', 
+                                           'heroin': 'heroin.html'})
+        # Looked up once, for both Index pages:
+        self.assertTrue(contexts[0][1]['all_pages_list'] is 
+                        contexts[1][1]['all_pages_list'])
+        
+        apd = AllPageData()
+        apd.prior = prior
+        context = renderer.page_context(
+            apd, 'cocaine.html', 'Cocaine', 
+            OrderedDict([('Brand names', ['Coke']), ('Drug class', ['CNS'])]))
+        self.assertEqual(context['page_type'], 'Not specified')
+        self.assertEqual(context['brand_names'], ['Coke'])
+        self.assertEqual(context['drug_class'], ['CNS'])
+        self.assertEqual(context['generic_names'], [])
+        self.assertEqual(context['wikipedia_name'], None)
+        self.assertTrue(context['has_metadata'])
+        self.assertFalse('all_pages_list' in context)
+        self.assertFalse(apd.titles_used)
+        with self.assertRaisesRegexp(BuildError, 'NO MORE THAN ONE'):
+            renderer.page_context(
+                apd, 'cocaine.html', 'Cocaine', 
+                OrderedDict([('Wikipedia name', ['Cocaine', 'Coke'])]))
+
+
+def make_temp_base_dir():
+    """Copy the pages, templates, and all_page_data.py to a new base_dir"""
+    temp_dir = tempfile.mkdtemp()
+    for dir_name in ['pages', 'templates']:
+        shutil.copytree(os.path.join(BASE_DIR, 'source', dir_name), 
+                        os.path.join(temp_dir, 'source', dir_name))
+    shutil.copy(os.path.join(BASE_DIR, 'source', 'all_page_data.py'), 
+                os.path.join(temp_dir, 'source', 'all_page_data.py'))
+    os.mkdir(os.path.join(temp_dir, 'build'))
+    return temp_dir
+
+
+def read_build_dir(base_dir):
+    """Return a dict of output filename -> output file contents
+    
+    The files in subdirectories are included, e.g. "search/pages.json".
+    
+    """
+    
+    outputs = {}
+    build_dir = os.path.join(base_dir, 'build')
+    for dir_path, dir_names, filenames in os.walk(build_dir):
+        for filename in filenames:
+            filepathname = os.path.join(dir_path, filename)
+            out_file = open(filepathname, 'rb')
+            outputs[os.path.relpath(filepathname, build_dir)] = out_file.read()
+            out_file.close()
+    return outputs
+
+
+class BuildAllTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = make_temp_base_dir()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()     # Hide the "Compiled foo.html." lines
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.base_dir)
+    
+    def test_parallel_build_matches_serial_build(self):
+        # Each build gets its own base_dir, so both start from the SAME 
+        # all_page_data.py:
+        parallel_base_dir = make_temp_base_dir()
+        try:
+            engine = make_engine(self.base_dir)
+            serial_apd = build_all(self.base_dir, engine, 1).apd
+            parallel_apd = build_all(parallel_base_dir, None, 3).apd
+            self.assertEqual(parallel_apd.next_to_str('all_page'), 
+                             serial_apd.next_to_str('all_page'))
+            self.assertEqual(read_build_dir(parallel_base_dir), 
+                             read_build_dir(self.base_dir))
+        finally:
+            shutil.rmtree(parallel_base_dir)
+    
+    def build_with_timeout(self, jobs, seconds=60):
+        """Call build_all(), but fail instead of hanging forever"""
+        def on_alarm(signum, frame):
+            raise AssertionError("build_all() hung for %s seconds." % seconds)
+        old_handler = signal.signal(signal.SIGALRM, on_alarm)
+        signal.alarm(seconds)
+        try:
+            return build_all(self.base_dir, None, jobs)
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, old_handler)
+    
+    def write_page(self, page_filename, page_raw):
+        page_file = open(os.path.join(self.base_dir, 'source', 'pages', 
+                                      page_filename), 'wb')
+        page_file.write(page_raw)
+        page_file.close()
+    
+    def test_errors_can_be_pickled(self):
+        err = pickle.loads(pickle.dumps(BuildError("Bad page", "Details")))
+        self.assertTrue(type(err) is BuildError)
+        self.assertEqual(str(err), "Bad page:\nDetails")
+    
+    def test_parallel_build_parser_error(self):
+        self.write_page('broken.html', "Broken\n\nNo hyphens here.\n")
+        with self.assertRaisesRegexp(ParserError, 'five hyphens'):
+            self.build_with_timeout(2)
+    
+    def test_parallel_build_django_error(self):
+        self.write_page('broken.html', "Broken\n\nPage type: Concept\n\n"
+                                       "-----\n\n{% link \"a \"b\" %}\n")
+        with self.assertRaisesRegexp(BuildError, 'broken.html failed'):
+            self.build_with_timeout(2)
+    
+    def test_unchanged_outputs_are_not_written(self):
+        engine = make_engine(self.base_dir)
+        for jobs in [1, 2]:
+            build_all(self.base_dir, engine, jobs)
+            outputs = read_build_dir(self.base_dir)
+            build_dir = os.path.join(self.base_dir, 'build')
+            html_filenames = [filename for filename in os.listdir(build_dir) 
+                              if filename.endswith('.html')]
+            for filename in html_filenames:
+                os.utime(os.path.join(build_dir, filename), (1, 1))
+            os.remove(os.path.join(build_dir, 'cocaine.html'))
+            self.write_page('heroin.html', 
+                            read_page_raw(self.base_dir, 'heroin.html') + 
+                            "\n\nOne more paragraph.\n")
+            report = build_all(self.base_dir, engine, jobs)
+            num_outputs = len([entry for entry in report.manifest.pages.values() 
+                               if entry.output])
+            self.assertEqual(report.unchanged_outputs, num_outputs - 2)
+            for filename in html_filenames:
+                filepathname = os.path.join(build_dir, filename)
+                self.assertEqual(os.stat(filepathname).st_mtime == 1, 
+                                 filename not in ['heroin.html', 
+                                                  'cocaine.html'], filename)
+            new_outputs = read_build_dir(self.base_dir)
+            self.assertIn('One more paragraph.', new_outputs['heroin.html'])
+            self.assertEqual(new_outputs['cocaine.html'], 
+                             outputs['cocaine.html'])
+            # No temporary file is left behind:
+            self.assertEqual(sorted(new_outputs), sorted(
+                filename for filename in new_outputs 
+                if not filename.startswith('.')))
+    
+    def test_check_pages(self):
+        self.write_page('zz_tabs.html', "Tabs\n\nPage type: Concept\n\n"
+                                        "-----\n\n\tOne.\r\nTwo.\t\n")
+        self.write_page('zz_parser.html', "Broken\n\nNo hyphens here.\n")
+        self.write_page('zz_django.html', "Broken\n\nPage type: Concept\n\n"
+                                          "-----\n\n{% no_such_tag %}\n")
+        for jobs in [1, 2]:
+            problems = check_pages(self.base_dir, jobs)
+            self.assertEqual(len(problems), 5, problems)
+            self.assertTrue(problems[0].startswith('zz_django.html: '))
+            self.assertIn('no_such_tag', problems[0])
+            self.assertTrue(problems[1].startswith('zz_parser.html: '))
+            self.assertIn('five hyphens', problems[1])
+            self.assertEqual(problems[2:], [
+                'zz_tabs.html, line 7, column 1: a hard tab character', 
+                'zz_tabs.html, line 7, column 6: a CR character', 
+                'zz_tabs.html, line 8, column 5: a hard tab character'])
+        # The check wrote nothing:
+        self.assertFalse(os.path.exists(os.path.join(self.base_dir, 'build', 
+                                                     'zz_tabs.html')))
+    
+    def test_read_page_raw(self):
+        self.write_page('zz_tabs.html', "Tabs\n\n\tOne\n\n\n\nTwo.\t\n\n")
+        with self.assertRaisesRegexp(BuildError, 'line 3, column 1'):
+            read_page_raw(self.base_dir, 'zz_tabs.html')
+        self.write_page('zz_tabs.html', "Tabs\n\nOne\n\n\n\nTwo.\n\n")
+        self.assertEqual(read_page_raw(self.base_dir, 'zz_tabs.html'), 
+                         "Tabs\n\nOne\n\nTwo.")
+    
+    def test_single_pass_build(self):
+        # A new page links to another new page, which all_page_data.py has 
+        # never heard of:
+        self.write_page('zz_new_ant.html', "New Ant\n\nPage type: Concept\n\n"
+                                           "-----\n\n{% link 'New Bee' %}\n")
+        self.write_page('zz_new_bee.html', "New Bee\n\nPage type: Concept\n\n"
+                                           "-----\n\nBuzz.\n")
+        two_pass_base_dir = make_temp_base_dir()
+        try:
+            for page_filename in ['zz_new_ant.html', 'zz_new_bee.html']:
+                shutil.copy(
+                    os.path.join(self.base_dir, 'source', 'pages', 
+                                 page_filename),
+                    os.path.join(two_pass_base_dir, 'source', 'pages'))
+            engine = make_engine(self.base_dir)
+            report = build_all(self.base_dir, engine, single_pass=True)
+            two_pass_engine = make_engine(two_pass_base_dir)
+            build_all(two_pass_base_dir, two_pass_engine)
+            two_pass_report = build_all(two_pass_base_dir, two_pass_engine)
+            self.assertEqual(report.apd.next_to_str('all_page'), 
+                             two_pass_report.apd.next_to_str('all_page'))
+            self.assertEqual(read_build_dir(self.base_dir), 
+                             read_build_dir(two_pass_base_dir))
+            self.assertIn('<a href="zz_new_bee.html">New Bee</a>', 
+                          read_build_dir(self.base_dir)['zz_new_ant.html'])
+        finally:
+            shutil.rmtree(two_pass_base_dir)
+    
+    def test_index_page_names(self):
+        apd = build_all(self.base_dir, make_engine(self.base_dir)).apd
+        part = index_page_names(self.base_dir, 
+                                list_page_filenames(self.base_dir))
+        self.assertEqual(part.titles, apd.next.titles)
+        self.assertEqual(part.aliases, apd.next.aliases)
+        self.assertTrue(part.read_only)
+    
+    def test_broken_link_summary(self):
+        self.write_page('zz_typo.html', "Typo\n\nPage type: Concept\n\n"
+                                        "-----\n\n{% link 'Lexaprro' %} and "
+                                        "{% link 'Nothing like it' %}\n")
+        report = build_all(self.base_dir, make_engine(self.base_dir))
+        self.assertEqual(report.broken_links['zz_typo.html'], 
+                         ['lexaprro', 'nothing like it'])
+        summary = sys.stdout.getvalue()
+        self.assertIn('zz_typo.html: "lexaprro", did you mean "lexapro" '
+                      '(lexapro.html)?', summary)
+        self.assertIn('zz_typo.html: "nothing like it", no similar alias', 
+                      summary)
+        self.assertEqual(summary.count('broken link(s)'), 1)
+    
+    def test_synthetic_corpus_has_no_broken_links(self):
+        page_filenames = write_synthetic_corpus(
+            os.path.join(self.base_dir, 'source', 'pages'), 20, 2**11, 2)
+        report = build_all(self.base_dir, make_engine(self.base_dir), 
+                           single_pass=True)
+        for page_filename in page_filenames:
+            self.assertFalse(page_filename in report.broken_links)
+        self.assertEqual(report.apd.next.aliases['alias 1 of page 19'], 
+                         'page00019.html')
+    
+    def test_profile(self):
+        report = build_all(self.base_dir, make_engine(self.base_dir), 
+                           profile=True)
+        self.assertEqual(len(report.profile.pages), len(report.compiled))
+        for timing in report.profile.pages:
+            if timing['page'].startswith('example_'):
+                self.assertEqual(timing['phases'].keys(), [])
+            else:
+                self.assertEqual(timing['phases'].keys(), 
+                                 dehr_profile.PAGE_PHASES)
+        self.assertIn('compile', report.profile.to_json_dict()['build_phases'])
+        parallel_profile = build_all(self.base_dir, None, 2, 
+                                     profile=True).profile
+        self.assertEqual(parallel_profile.to_json_dict()['page_phases'].keys(), 
+                         dehr_profile.PAGE_PHASES)
+        self.assertEqual(build_all(self.base_dir, None, 2).profile, None)
+    
+    def test_parse_cache(self):
+        engine = make_engine(self.base_dir)
+        report = build_all(self.base_dir, engine)
+        self.assertEqual(report.parse_cache_hits, 0)
+        self.assertTrue(report.parse_cache_misses > 0)
+        self.write_page('zz_new.html', "New\n\nPage type: Concept\n\n"
+                                       "-----\n\nNew.\n")
+        report = build_all(self.base_dir, engine)
+        num_examples = len([page_filename for page_filename in report.compiled
+                            if page_filename.startswith('example_')])
+        self.assertEqual(report.parse_cache_misses, 1)
+        self.assertEqual(report.parse_cache_hits, 
+                         len(report.compiled) - num_examples - 1)
+        self.assertIn('Parse cache: %s hit(s), 1 miss(es).' % 
+                      report.parse_cache_hits, sys.stdout.getvalue())
+        # The cached pages build the same bytes as the parsed ones:
+        report = build_all(self.base_dir, engine, use_parse_cache=False)
+        self.assertEqual(report.parse_cache_hits, 0)
+        self.assertEqual(report.parse_cache_misses, 0)
+        build_dir = read_build_dir(self.base_dir)
+        report = build_all(self.base_dir, engine)
+        self.assertEqual(report.parse_cache_misses, 0)
+        self.assertEqual(read_build_dir(self.base_dir), build_dir)
+    
+    def test_fast_path(self):
+        # Three pages of the same shape, with text that must be escaped:
+        for number in range(3):
+            self.write_page('zz_fast_%s.html' % number, 
+                            "Fast <%s> & 'Co'\n\nPage type: One drug\n\n"
+                            "Wikipedia name: Fast_%s\n\n"
+                            "Brand names: B&%s, \"Quoted\".\n\n"
+                            "-----\n\nNo template syntax at all.\n" % 
+                            (number, number, number))
+        engine = make_engine(self.base_dir)
+        report = build_all(self.base_dir, engine, single_pass=True, 
+                           fast_path=False)
+        self.assertEqual(report.fast_pages, 0)
+        build_dir = read_build_dir(self.base_dir)
+        templates = dict((page_filename, entry.templates) for page_filename, 
+                         entry in report.manifest.pages.items())
+        report = build_all(self.base_dir, engine, single_pass=True)
+        # The first two pages of the shape are rendered by Django:
+        self.assertTrue(report.manifest.pages['zz_fast_2.html'].fast_path)
+        self.assertFalse(report.manifest.pages['zz_fast_1.html'].fast_path)
+        self.assertIn('Rendered %s of %s compiled page(s) without Django.' % 
+                      (report.fast_pages, len(report.compiled)), 
+                      sys.stdout.getvalue())
+        self.assertEqual(read_build_dir(self.base_dir), build_dir)
+        self.assertEqual(dict((page_filename, entry.templates) 
+                              for page_filename, entry in 
+                              report.manifest.pages.items()), templates)
+    
+    def test_search_index(self):
+        engine = make_engine(self.base_dir)
+        build_all(self.base_dir, engine)
+        self.assertIn('Wrote the search index of ', sys.stdout.getvalue())
+        search_dir = os.path.join(self.base_dir, 'build', 'search')
+        self.assertEqual(dehr_search.search(search_dir, 'smack')[0], 
+                         ['Heroin', 'heroin.html'])
+        pages_file = open(os.path.join(search_dir, 'pages.json'), 'rb')
+        urls = [url for title, url in json.load(pages_file)['pages']]
+        pages_file.close()
+        self.assertIn('index.html', urls)
+        self.assertFalse([url for url in urls if url.startswith('example_')])
+        # Nothing changed, the index is not written again:
+        sys.stdout = StringIO()
+        build_all(self.base_dir, engine, incremental=True)
+        self.assertNotIn('search index', sys.stdout.getvalue())
+        self.write_page('zz_new.html', "New\n\nPage type: Concept\n\n"
+                                       "-----\n\nXylophone.\n")
+        build_all(self.base_dir, engine, incremental=True)
+        self.assertEqual(dehr_search.search(search_dir, 'xylophone'), 
+                         [['New', 'zz_new.html']])
+        # Without the parse cache, the same index:
+        def read_search_files():
+            return dict(item for item in read_build_dir(self.base_dir).items() 
+                        if item[0].startswith('search'))
+        search_files = read_search_files()
+        build_all(self.base_dir, engine, use_parse_cache=False)
+        self.assertEqual(read_search_files(), search_files)
+    
+    def test_backlinks(self):
+        engine = make_engine(self.base_dir)
+        report = build_all(self.base_dir, engine)
+        # There was no link graph yet, so the pages with backlinks are 
+        # compiled again:
+        self.assertIn('heroin.html', report.relinked)
+        self.assertEqual(report.link_graph.backlinks('heroin.html'), 
+                         [['Test Page 01 (This Is the Title)', 
+                           'test_page_01.html']])
+        build_dir = read_build_dir(self.base_dir)
+        self.assertIn('<h2>What links here:</h2>', build_dir['heroin.html'])
+        self.assertIn('<a href="test_page_01.html">', build_dir['heroin.html'])
+        self.assertNotIn('What links here', build_dir['index.html'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.base_dir, 'source', 'link_graph.json')))
+        # The next build starts from the saved link graph:
+        self.assertEqual(build_all(self.base_dir, engine).relinked, [])
+        self.assertEqual(read_build_dir(self.base_dir), build_dir)
+        
+        self.write_page('zz_new.html', "New\n\nPage type: Concept\n\n"
+                                       "-----\n\n{% link 'heroin' %}\n")
+        report = build_all(self.base_dir, engine, incremental=True)
+        self.assertEqual(report.relinked, ['heroin.html'])
+        self.assertIn('Compiled 1 page(s) again for their What links here', 
+                      sys.stdout.getvalue())
+        self.assertIn('<a href="zz_new.html">New</a>', 
+                      read_build_dir(self.base_dir)['heroin.html'])
+        # The Index page is compiled again with the new title, but it is in 
+        # no What links here list:
+        report = build_all(self.base_dir, engine, incremental=True)
+        self.assertEqual((report.compiled, report.relinked), 
+                         (['index.html'], []))
+    
+    def test_bad_jobs(self):
+        with self.assertRaisesRegexp(BuildError, 'at least 1'):
+            build_all(self.base_dir, None, 0)
+
+
+
+class LiveBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = make_temp_base_dir()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()     # Hide the "Compiled foo.html." lines
+        self.live_build = LiveBuild(self.base_dir, make_engine(self.base_dir))
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.base_dir)
+    
+    def write_file(self, dir_name, filename, text):
+        a_file = open(os.path.join(self.base_dir, 'source', dir_name, filename), 
+                      'wb')
+        a_file.write(text)
+        a_file.close()
+    
+    def assert_same_as_full_build(self):
+        """The live build/ must be the same as a single pass full build
+        
+        save() is called first, it writes the search index.
+        
+        """
+        
+        self.live_build.save()
+        full_base_dir = make_temp_base_dir()
+        try:
+            for dir_name in ['pages', 'templates']:
+                shutil.rmtree(os.path.join(full_base_dir, 'source', dir_name))
+                shutil.copytree(
+                    os.path.join(self.base_dir, 'source', dir_name), 
+                    os.path.join(full_base_dir, 'source', dir_name))
+            build_all(full_base_dir, make_engine(full_base_dir), 
+                      single_pass=True)
+            self.assertEqual(read_build_dir(self.base_dir), 
+                             read_build_dir(full_base_dir))
+        finally:
+            shutil.rmtree(full_base_dir)
+    
+    def test_update_one_page(self):
+        self.write_file('pages', 'heroin.html', 
+                        read_page_raw(self.base_dir, 'heroin.html') + 
+                        "\nOne more paragraph.\n")
+        self.assertEqual(self.live_build.update(['heroin.html'], []), 
+                         ['heroin.html'])
+        self.assertEqual(self.live_build.update(['no_such_page.html'], []), [])
+        self.assert_same_as_full_build()
+    
+    def test_new_alias_recompiles_dependents(self):
+        self.write_file('pages', 'zz_new_ant.html', 
+                        "New Ant\n\nPage type: Concept\n\n-----\n\n"
+                        "{% link 'New Bee' %}\n")
+        self.assertEqual(self.live_build.update(['zz_new_ant.html'], []), 
+                         ['zz_new_ant.html', 'index.html'])
+        self.write_file('pages', 'zz_new_bee.html', 
+                        "New Bee\n\nPage type: Concept\n\n-----\n\nBuzz.\n")
+        # New Bee is compiled again, it is now linked to from New Ant:
+        self.assertEqual(self.live_build.update(['zz_new_bee.html'], []), 
+                         ['zz_new_bee.html', 'index.html', 'zz_new_ant.html', 
+                          'zz_new_bee.html'])
+        self.assert_same_as_full_build()
+        os.remove(os.path.join(self.base_dir, 'source', 'pages', 
+                               'zz_new_bee.html'))
+        self.assertEqual(self.live_build.update(['zz_new_bee.html'], []), 
+                         ['index.html', 'zz_new_ant.html'])
+        self.assertIn('zz_new_ant.html: "new bee"', sys.stdout.getvalue())
+    
+    def test_rename_alias(self):
+        self.write_file('pages', 'zz_new_ant.html', 
+                        "New Ant\n\nPage type: Concept\n\n-----\n\n"
+                        "{% link 'New Bee' %}\n")
+        self.write_file('pages', 'zz_new_bee.html', 
+                        "New Bee\n\nPage type: Concept\n\n-----\n\nBuzz.\n")
+        self.live_build.update(['zz_new_ant.html', 'zz_new_bee.html'], [])
+        self.assertEqual(self.live_build.link_graph.backlinks('zz_new_bee.html'), 
+                         [['New Ant', 'zz_new_ant.html']])
+        # Only the pages that looked up "new bee" are compiled again, and New 
+        # Ant is no longer in the list of New Wasp:
+        self.write_file('pages', 'zz_new_bee.html', 
+                        "New Wasp\n\nPage type: Concept\n\n-----\n\nBuzz.\n")
+        self.assertEqual(self.live_build.update(['zz_new_bee.html'], []), 
+                         ['zz_new_bee.html', 'index.html', 'zz_new_ant.html', 
+                          'zz_new_bee.html'])
+        self.assertEqual(self.live_build.link_graph.backlinks('zz_new_bee.html'), 
+                         [])
+        self.assert_same_as_full_build()
+    
+    def test_update_template(self):
+        self.write_file('templates', 'metadata_line.html', 
+                        "<!-- Changed -->\n" + open(os.path.join(
+                            BASE_DIR, 'source', 'templates', 
+                            'metadata_line.html')).read())
+        compiled = self.live_build.update([], ['metadata_line.html'])
+        self.assertIn('lexapro.html', compiled)
+        self.assertNotIn('index.html', compiled)
+        self.assert_same_as_full_build()
+    
+    def test_broken_page(self):
+        self.write_file('pages', 'heroin.html', "Heroin\n\nNo hyphens.\n")
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertEqual(self.live_build.update(['heroin.html'], []), [])
+        finally:
+            sys.stderr = stderr
+        # The other pages still link to it:
+        self.assertEqual(self.live_build.names.aliases['heroin'], 
+                         'heroin.html')
+        self.live_build.save()
+        # The next build compiles it again:
+        with self.assertRaisesRegexp(ParserError, 'five hyphens'):
+            build_all(self.base_dir, make_engine(self.base_dir), 
+                      incremental=True)
+    
+    def test_save(self):
+        self.write_file('pages', 'heroin.html', 
+                        read_page_raw(self.base_dir, 'heroin.html') + 
+                        "\nOne more paragraph.\n")
+        self.live_build.update(['heroin.html'], [])
+        self.live_build.save()
+        report = build_all(self.base_dir, make_engine(self.base_dir), 
+                           incremental=True)
+        self.assertEqual(report.compiled, [])
+
+
 #============================== If Name Is Main ===============================#
 
 if __name__ == '__main__':
@@ -0,0 +1,85 @@
+# File test_dehr_fuzzy.py
+
+import random
+import unittest
+
+from dehr_fuzzy import *
+
+
+ALIASES = ['lexapro', 'escitalopram', 'citalopram', 'cipralex', 'celexa',
+           'cocaine', 'coke', 'dopamine', 'da', 'dopamine receptor',
+           'methyl benzoyl ecgonine', 'zoloft', 'sertraline']
+
+
+def slow_edit_distance(a, b):
+    """The textbook Levenshtein distance, without any shortcuts"""
+    table = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)]
+             for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            table[i][j] = min(table[i-1][j-1] + (a[i-1] != b[j-1]),
+                              table[i-1][j] + 1, table[i][j-1] + 1)
+    return table[len(a)][len(b)]
+
+
+class EditDistanceTest(unittest.TestCase):
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('lexapro', 'lexapro', 2), 0)
+        self.assertEqual(edit_distance('lexaprro', 'lexapro', 2), 1)
+        self.assertEqual(edit_distance('lexparo', 'lexapro', 2), 2)
+        self.assertEqual(edit_distance('', 'abc', 5), 3)
+        self.assertEqual(edit_distance('zoloft', 'lexapro', 2), 3)
+    
+    def test_random_strings(self):
+        rng = random.Random(0)
+        for i in range(500):
+            a = ''.join(rng.choice('abc') for j in range(rng.randint(0, 7)))
+            b = ''.join(rng.choice('abc') for j in range(rng.randint(0, 7)))
+            expected = slow_edit_distance(a, b)
+            for max_distance in range(4):
+                self.assertEqual(edit_distance(a, b, max_distance),
+                                 min(expected, max_distance + 1))
+
+
+class AliasSuggesterTest(unittest.TestCase):
+    def setUp(self):
+        self.suggester = AliasSuggester(ALIASES)
+    
+    def test_prefix(self):
+        self.assertEqual(self.suggester.prefix('co'), ['cocaine', 'coke'])
+        self.assertEqual(self.suggester.prefix('dopamine'),
+                         ['dopamine', 'dopamine receptor'])
+        self.assertEqual(self.suggester.prefix('dopamine', 1), ['dopamine'])
+        self.assertEqual(self.suggester.prefix('zz'), [])
+    
+    def test_similar(self):
+        self.assertEqual(self.suggester.similar('lexaprro'), [(1, 'lexapro')])
+        self.assertEqual(self.suggester.similar('italopram'),
+                         [(1, 'citalopram')])
+        self.assertEqual(self.suggester.similar('italopram', 3),
+                         [(1, 'citalopram'), (3, 'escitalopram')])
+        self.assertEqual(self.suggester.similar('doe', 1), [])
+        self.assertEqual(self.suggester.similar('dq'), [(1, 'da')])
+    
+    def test_similar_matches_brute_force(self):
+        rng = random.Random(1)
+        for i in range(200):
+            alias = list(rng.choice(ALIASES))
+            for j in range(rng.randint(0, 3)):
+                alias[rng.randint(0, len(alias) - 1)] = rng.choice('aeiouxyz')
+            query = ''.join(alias)
+            expected = sorted(
+                (slow_edit_distance(query, alias), alias) for alias in ALIASES
+                if slow_edit_distance(query, alias) <= 2)
+            self.assertEqual(self.suggester.similar(query, 2, 100), expected)
+    
+    def test_suggest(self):
+        self.assertEqual(self.suggester.suggest('Lexaprro'), ['lexapro'])
+        self.assertEqual(self.suggester.suggest('escitalo'), ['escitalopram'])
+        self.assertEqual(self.suggester.suggest('no such thing'), [])
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# File test_dehr_index.py
+
+import pickle
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+from build import *
+from dehr_index import *
+
+
+def make_part(num_pages):
+    part = AllPageDataPart(False)
+    for i in range(num_pages):
+        page_filename = 'page%05d.html' % i
+        part.add_title('Page %s' % i, page_filename)
+        part.add_alias('Page %s' % i, page_filename)
+        part.add_alias('alias %s' % i, page_filename)
+    return part
+
+
+class AliasIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_filepath = os.path.join(self.temp_dir, 'test.idx')
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_round_trip(self):
+        part = make_part(1000)
+        part.add_title('Caf\xc3\xa9', 'cafe.html')
+        part.add_alias('caf\xc3\xa9', 'cafe.html')
+        write_index(self.index_filepath, part, text_hash('foo'))
+        index = AliasIndex(self.index_filepath)
+        self.assertEqual(index.source_hash, text_hash('foo'))
+        self.assertEqual(index.titles, part.titles)
+        self.assertEqual(len(index), len(part.aliases))
+        for alias, page_filename in part.aliases.items():
+            self.assertEqual(index.get(alias), page_filename)
+            self.assertEqual(index[alias], page_filename)
+        self.assertEqual(index.get(u'caf\xe9'), 'cafe.html')
+        self.assertEqual(index.get('no such alias'), None)
+        self.assertEqual(index.get('no such alias', 'x.html'), 'x.html')
+        self.assertFalse('no such alias' in index)
+        with self.assertRaises(KeyError):
+            index['no such alias']
+    
+    def test_empty(self):
+        write_index(self.index_filepath, AllPageDataPart(False),
+                    text_hash(''))
+        index = AliasIndex(self.index_filepath)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.titles, OrderedDict())
+        self.assertEqual(index.get('anything'), None)
+    
+    def test_pickle(self):
+        write_index(self.index_filepath, make_part(10), text_hash(''))
+        index = pickle.loads(pickle.dumps(AliasIndex(self.index_filepath)))
+        self.assertEqual(index.get('alias 7'), 'page00007.html')
+    
+    def test_rewrite_while_open(self):
+        write_index(self.index_filepath, make_part(10), text_hash(''))
+        index = AliasIndex(self.index_filepath)
+        write_index(self.index_filepath, make_part(20), text_hash(''))
+        self.assertEqual(index.get('alias 7'), 'page00007.html')
+        self.assertEqual(index.get('alias 17'), None)
+        self.assertEqual(AliasIndex(self.index_filepath).get('alias 17'),
+                         'page00017.html')
+    
+    def test_not_an_index(self):
+        index_file = open(self.index_filepath, 'wb')
+        index_file.write('x' * 100)
+        index_file.close()
+        with self.assertRaisesRegexp(AliasIndexError, 'not an alias index'):
+            AliasIndex(self.index_filepath)
+    
+    def test_parse_py_export(self):
+        apd = AllPageData()
+        apd.next = make_part(5)
+        apd.add_alias('Quotes \'and\' "both"', 'page00001.html')
+        apd.add_alias('Back\\slash \xc3\xa9\n', 'page00001.html')
+        titles, aliases = parse_py_export(apd.next_to_str('all_page'))
+        self.assertEqual(titles, apd.next.titles)
+        self.assertEqual(aliases, apd.next.aliases)
+    
+    def test_parse_py_export_is_not_exec(self):
+        with self.assertRaisesRegexp(AliasIndexError, 'Line 2'):
+            parse_py_export("all_page_titles = OrderedDict([\n"
+                            "    (os.system('false'), 'x.html'),\n])\n")
+        with self.assertRaisesRegexp(AliasIndexError, 'Line 1'):
+            parse_py_export("import os\n")
+
+
+class LoadPriorTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.base_dir, 'source'))
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()     # Hide the "Saved ..." line
+        self.apd = AllPageData()
+        self.apd.next = make_part(50)
+        self.apd.save_next(self.base_dir)
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.base_dir)
+    
+    def test_load_from_index(self):
+        apd = AllPageData()
+        apd.load_prior(self.base_dir)
+        self.assertTrue(type(apd.prior.aliases) is AliasIndex)
+        self.assertEqual(apd.prior.titles, self.apd.next.titles)
+        self.assertEqual(apd.find_url('ALIAS 42'), 'page00042.html')
+    
+    def test_load_from_changed_export(self):
+        # E.g. all_page_data.py was changed by a git pull:
+        apd_filepath = os.path.join(self.base_dir, 'source',
+                                    'all_page_data.py')
+        apd_file = open(apd_filepath, 'ab')
+        apd_file.write('\n')
+        apd_file.close()
+        apd = AllPageData()
+        apd.load_prior(self.base_dir)
+        self.assertTrue(type(apd.prior.aliases) is OrderedDict)
+        self.assertEqual(apd.prior.titles, self.apd.next.titles)
+        self.assertEqual(apd.prior.aliases, self.apd.next.aliases)
+    
+    def test_load_without_index(self):
+        os.remove(os.path.join(self.base_dir, 'source', INDEX_FILENAME))
+        apd = AllPageData()
+        apd.load_prior(self.base_dir)
+        self.assertEqual(apd.prior.aliases, self.apd.next.aliases)
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# File test_dehr_layout.py
+
+import unittest
+
+from build import AllPageData, BASE_DIR, Context, PageRenderer, make_engine
+from dehr_layout import *
+
+
+class ContextShapeTest(unittest.TestCase):
+    def test_context_shape(self):
+        shape, probe_layer, values = context_shape(
+            {'apd': None, 'page_title': 'Heroin', 'page_type': 'One drug', 
+             'brand_names': ['Diamorphine', ''], 'has_metadata': True, 
+             'wikipedia_name': None})
+        self.assertEqual(values, ['Diamorphine', 'Heroin'])
+        self.assertEqual(probe_layer['brand_names'], [probe(0), ''])
+        self.assertEqual(probe_layer['page_title'], probe(1))
+        self.assertEqual(probe_layer['page_type'], 'One drug')
+        self.assertEqual(context_shape(
+            {'apd': None, 'page_title': 'Cocaine', 'page_type': 'One drug', 
+             'brand_names': ['Coke', ''], 'has_metadata': True, 
+             'wikipedia_name': None})[0], shape)
+        self.assertNotEqual(context_shape(
+            {'apd': None, 'page_title': 'Cocaine', 'page_type': 'Concept', 
+             'brand_names': ['Coke', ''], 'has_metadata': True, 
+             'wikipedia_name': None})[0], shape)
+        shape, probe_layer, values = context_shape(
+            {'backlinks': [['A', 'a.html'], ['B', 'b.html']]})
+        self.assertEqual(shape, (('backlinks', ((True, True), (True, True))),))
+        self.assertEqual(probe_layer['backlinks'][1], [probe(2), probe(3)])
+        self.assertEqual(values, ['A', 'a.html', 'B', 'b.html'])
+        self.assertEqual(context_shape({'pages': [['A', 1]]}), None)
+        self.assertEqual(context_shape({'count': 1}), None)
+
+
+class LayoutSkeletonTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = make_engine(BASE_DIR)
+    
+    def test_fill_escapes_like_django(self):
+        rendered = self.engine.from_string(
+            '<title>{{ a }}</title>{{ a|safe }}{% for b in bs %}[{{ b }}]'
+            '{% endfor %}').render(Context({'a': probe(0), 
+                                            'bs': [probe(1), probe(2)]}))
+        skeleton = LayoutSkeleton(rendered, ['base.html'])
+        self.assertTrue(skeleton.complete)
+        self.assertEqual(skeleton.holes, [(0, True), (0, False), (1, True), 
+                                          (2, True)])
+        self.assertEqual(skeleton.fill(['<i>', '&', 'x']), 
+                         '<title>&lt;i&gt;</title><i>[&amp;][x]')
+    
+    def test_changed_probe_is_not_used(self):
+        layout_template = self.engine.from_string(
+            '{{ page_title|upper }} {{ page_content }}')
+        renderer = PageRenderer(self.engine, AllPageData().prior)
+        page_layer = {'page_title': 'Heroin'}
+        for number in range(3):
+            layout, fast = renderer.render_layout(
+                layout_template, Context(page_layer), page_layer)
+            self.assertFalse(fast)
+        self.assertEqual(renderer.skeletons.values(), [None])
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# File test_dehr_links.py
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dehr_links import *
+from dehr_manifest import PageEntry
+
+
+def make_entry(title, lookups, lists_all=False):
+    entry = PageEntry()
+    entry.titles = [[title, 'unused.html']]
+    entry.lookups = lookups
+    entry.output = True
+    if lists_all:
+        entry.titles_hash = 'abc'
+    return entry
+
+
+class LinkGraphTest(unittest.TestCase):
+    def make_graph(self):
+        graph = LinkGraph()
+        graph.set_page('ant.html', make_entry('Ant', {
+            'bee': 'bee.html', 'ant': 'ant.html', 'wasp': None}))
+        graph.set_page('bee.html', make_entry('Bee', {'the bee': 'bee.html'}))
+        graph.set_page('cat.html', make_entry('Cat', {
+            'bee': 'bee.html', 'ant': 'ant.html'}))
+        graph.set_page('index.html', make_entry('Index', {
+            'ant': 'ant.html', 'bee': 'bee.html'}, True))
+        return graph
+    
+    def test_backlinks(self):
+        graph = self.make_graph()
+        # A page is not in its own list, nor is the Index page:
+        self.assertEqual(graph.backlinks('bee.html'), 
+                         [['Ant', 'ant.html'], ['Cat', 'cat.html']])
+        self.assertEqual(graph.backlinks('ant.html'), [['Cat', 'cat.html']])
+        self.assertEqual(graph.backlinks('cat.html'), [])
+        self.assertEqual(graph.broken_links().items(), [('ant.html', ['wasp'])])
+    
+    def test_set_and_remove_page(self):
+        graph = self.make_graph()
+        # Cat no longer links to Bee, and Ant is renamed:
+        self.assertEqual(graph.set_page('cat.html', make_entry('Cat', {
+            'ant': 'ant.html'})), set(['ant.html', 'bee.html']))
+        self.assertEqual(graph.set_page('ant.html', make_entry('Aunt', {
+            'bee': 'bee.html'})), set(['bee.html']))
+        self.assertEqual(graph.backlinks('bee.html'), [['Aunt', 'ant.html']])
+        self.assertEqual(graph.remove_page('ant.html'), set(['bee.html']))
+        self.assertEqual(graph.backlinks('bee.html'), [])
+        self.assertEqual(graph.remove_page('ant.html'), set())
+        self.assertEqual(graph.set_page('index.html', make_entry('Index', {
+            'cat': 'cat.html'}, True)), set())
+        self.assertEqual(graph.broken_links().items(), [])
+    
+    def test_dependents(self):
+        graph = self.make_graph()
+        self.assertEqual(graph.dependents(['bee']), 
+                         set(['ant.html', 'cat.html', 'index.html']))
+        self.assertEqual(graph.dependents(['wasp', 'the bee']), 
+                         set(['ant.html', 'bee.html']))
+        self.assertEqual(graph.dependents(['nothing']), set())
+    
+    def test_save_and_load(self):
+        base_dir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(base_dir, 'source'))
+            self.assertEqual(LinkGraph.load(base_dir).links, {})
+            graph = self.make_graph()
+            graph.save(base_dir)
+            loaded = LinkGraph.load(base_dir)
+            self.assertEqual(loaded.to_json_dict(), graph.to_json_dict())
+            self.assertEqual(loaded.backlinks('bee.html'), 
+                             graph.backlinks('bee.html'))
+            self.assertEqual(type(loaded.backlinks('bee.html')[0][1]), str)
+            graph_file = open(LinkGraph.filepathname(base_dir), 'rb')
+            json_dict = json.load(graph_file)
+            graph_file.close()
+            self.assertEqual(json_dict['backlinks']['ant.html'], ['cat.html'])
+            self.assertEqual(json_dict['broken'], {'ant.html': ['wasp']})
+            # An old or broken file is the same as none:
+            graph_file = open(LinkGraph.filepathname(base_dir), 'wb')
+            graph_file.write('{"version": 0, "pages": [')
+            graph_file.close()
+            self.assertEqual(LinkGraph.load(base_dir).links, {})
+        finally:
+            shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
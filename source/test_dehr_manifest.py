@@ -0,0 +1,177 @@
+# File test_dehr_manifest.py
+
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+from build import *
+from dehr_manifest import *
+
+
+def write_page(base_dir, page_filename, page_raw):
+    page_file = open(os.path.join(base_dir, 'source', 'pages', page_filename), 
+                     'wb')
+    page_file.write(page_raw)
+    page_file.close()
+
+
+class IncrementalBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(BASE_DIR, 'source', 'templates'), 
+                        os.path.join(self.base_dir, 'source', 'templates'))
+        os.mkdir(os.path.join(self.base_dir, 'source', 'pages'))
+        os.mkdir(os.path.join(self.base_dir, 'build'))
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()     # Hide the "Compiled foo.html." lines
+        AllPageData().save_next(self.base_dir)
+        write_page(self.base_dir, 'ant.html', 
+                   "Ant\n\nPage type: Concept\n\n-----\n\n"
+                   "See {% link 'Bumblebee' %}.\n")
+        write_page(self.base_dir, 'bee.html', 
+                   "Bee\n\nPage type: Concept\n\nHidden names: Bumblebee\n\n"
+                   "-----\n\nBuzz.\n")
+        write_page(self.base_dir, 'index.html', 
+                   "Index\n\nPage type: Index\n\n-----\n\n"
+                   "{% for page_tupe in all_pages_list %}"
+                   "{{ page_tupe.0 }}{% endfor %}\n")
+        self.engine = make_engine(self.base_dir)
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.base_dir)
+    
+    def build(self):
+        return build_all(self.base_dir, self.engine, incremental=True)
+    
+    def test_noop_rebuild(self):
+        report = self.build()
+        self.assertEqual(report.compiled, ['ant.html', 'bee.html', 'index.html'])
+        # The aliases of the first build are the prior of the second build, 
+        # so 'Bumblebee' now resolves and the title list has changed:
+        report = self.build()
+        self.assertEqual(report.compiled, ['ant.html', 'index.html'])
+        report = self.build()
+        self.assertEqual(report.compiled, [])
+        self.assertEqual(report.skipped, ['ant.html', 'bee.html', 'index.html'])
+        self.assertEqual(report.apd.next.aliases, OrderedDict([
+            ('ant', 'ant.html'), ('bee', 'bee.html'), 
+            ('bumblebee', 'bee.html'), ('index', 'index.html')]))
+    
+    def test_changed_page(self):
+        self.build()
+        self.build()
+        write_page(self.base_dir, 'ant.html', 
+                   "Ant\n\nPage type: Concept\n\n-----\n\nNo links.\n")
+        report = self.build()
+        self.assertEqual(report.compiled, ['ant.html'])
+    
+    def test_touched_page(self):
+        self.build()
+        self.build()
+        page_filepathname = os.path.join(self.base_dir, 'source', 'pages', 
+                                         'bee.html')
+        os.utime(page_filepathname, (1, 1))
+        report = self.build()
+        self.assertEqual(report.compiled, [])
+    
+    def test_removed_alias(self):
+        self.build()
+        self.build()
+        write_page(self.base_dir, 'bee.html', 
+                   "Bee\n\nPage type: Concept\n\n-----\n\nBuzz.\n")
+        report = self.build()
+        self.assertEqual(report.compiled, ['bee.html'])
+        # Only now is the alias 'bumblebee' missing from all_page_data.py:
+        report = self.build()
+        self.assertEqual(report.compiled, ['ant.html'])
+    
+    def test_deleted_output(self):
+        self.build()
+        self.build()
+        os.remove(os.path.join(self.base_dir, 'build', 'bee.html'))
+        report = self.build()
+        self.assertEqual(report.compiled, ['bee.html'])
+    
+    def test_changed_template(self):
+        self.build()
+        self.build()
+        template_file = open(os.path.join(
+            self.base_dir, 'source', 'templates', 'base_base.html'), 'ab')
+        template_file.write('\n')
+        template_file.close()
+        report = self.build()
+        self.assertEqual(report.compiled, ['ant.html', 'bee.html', 'index.html'])
+    
+    def test_unused_template(self):
+        self.build()
+        self.build()
+        # None of the pages has metadata, so none of them includes it:
+        template_file = open(os.path.join(
+            self.base_dir, 'source', 'templates', 'metadata_line.html'), 'ab')
+        template_file.write('\n')
+        template_file.close()
+        report = self.build()
+        self.assertEqual(report.compiled, [])
+    
+    def test_changed_included_template(self):
+        write_page(self.base_dir, 'bee.html', 
+                   "Bee\n\nPage type: Concept\n\nHidden names: Bumblebee\n\n"
+                   "-----\n\n{% include 'simple_template_test.html' %}\n")
+        self.build()
+        self.build()
+        template_file = open(os.path.join(
+            self.base_dir, 'source', 'templates', 
+            'simple_template_test.html'), 'ab')
+        template_file.write('\n')
+        template_file.close()
+        report = self.build()
+        self.assertEqual(report.compiled, ['bee.html'])
+    
+    def test_recorded_templates(self):
+        self.build()
+        manifest = BuildManifest.load(self.base_dir)
+        self.assertEqual(manifest.pages['ant.html'].templates, 
+                         ['base.html', 'base_base.html'])
+        self.assertEqual(sorted(manifest.template_hashes), 
+                         sorted(os.listdir(os.path.join(
+                             self.base_dir, 'source', 'templates'))))
+    
+    def test_changed_code(self):
+        self.build()
+        self.build()
+        manifest = BuildManifest.load(self.base_dir)
+        manifest.code_hashes['build.py'] = 'an old hash'
+        manifest.save(self.base_dir)
+        report = self.build()
+        self.assertEqual(report.compiled, ['ant.html', 'bee.html', 'index.html'])
+    
+    def test_corrupt_manifest(self):
+        manifest_file = open(BuildManifest.filepathname(self.base_dir), 'wb')
+        manifest_file.write('{"version": 2, "pag')
+        manifest_file.close()
+        with self.assertRaisesRegexp(ManifestError, 'not valid JSON'):
+            self.build()
+        # A full build ignores the manifest, and then writes a good one:
+        report = build_all(self.base_dir, self.engine)
+        self.assertEqual(report.compiled, ['ant.html', 'bee.html', 'index.html'])
+        self.assertEqual(sorted(BuildManifest.load(self.base_dir).pages), 
+                         ['ant.html', 'bee.html', 'index.html'])
+    
+    def test_manifest_round_trip(self):
+        self.build()
+        manifest = BuildManifest.load(self.base_dir)
+        entry = manifest.pages['ant.html']
+        self.assertEqual(entry.lookups, OrderedDict([('bumblebee', None)]))
+        self.assertEqual(entry.titles, [['Ant', 'ant.html']])
+        self.assertEqual(entry.aliases, [['ant', 'ant.html']])
+        self.assertTrue(type(entry.titles[0][0]) is str)
+        self.assertEqual(manifest.pages['index.html'].titles_hash, 
+                         titles_hash([]))
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
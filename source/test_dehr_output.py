@@ -0,0 +1,103 @@
+# File test_dehr_output.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import dehr_output
+from dehr_output import *
+
+
+class OutputWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def path(self, filename):
+        return os.path.join(self.temp_dir, filename)
+    
+    def read(self, filename):
+        out_file = open(self.path(filename), 'rb')
+        data = out_file.read()
+        out_file.close()
+        return data
+    
+    def write_all(self, writer, outputs):
+        """Write {filename: [chunk, ...]}, return {filename: written}"""
+        written = {}
+        for filename, chunks in sorted(outputs.items()):
+            out_file = writer.open(filename, self.path(filename))
+            for chunk in chunks:
+                out_file.write(chunk)
+            written[filename] = out_file.close()
+        writer.finish()
+        return written
+    
+    def test_unchanged_files_are_left_alone(self):
+        writer = OutputWriter()
+        outputs = {'a.html': ['<p>', u'A', '</p>'], 'b.html': ['B']}
+        self.assertEqual(self.write_all(writer, outputs), 
+                         {'a.html': True, 'b.html': True})
+        self.assertEqual(self.read('a.html'), '<p>A</p>')
+        for filename in outputs:
+            os.utime(self.path(filename), (1, 1))
+        
+        # The next build only knows the hashes, e.g. from the manifest:
+        prior_hashes = dict((filename, [digest, size]) for filename, 
+                            (digest, size, written) in writer.results.items())
+        writer = OutputWriter(prior_hashes)
+        outputs['b.html'] = ['B, changed']
+        self.assertEqual(self.write_all(writer, outputs), 
+                         {'a.html': False, 'b.html': True})
+        self.assertEqual(os.stat(self.path('a.html')).st_mtime, 1)
+        self.assertEqual(self.read('b.html'), 'B, changed')
+        
+        # A deleted file is written again:
+        os.remove(self.path('a.html'))
+        writer = OutputWriter(writer.prior_hashes)
+        self.assertEqual(self.write_all(writer, outputs), 
+                         {'a.html': True, 'b.html': False})
+        self.assertEqual(self.read('a.html'), '<p>A</p>')
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), 
+                         ['a.html', 'b.html'])
+    
+    def test_big_files_are_spooled(self):
+        spool_bytes = dehr_output.OUTPUT_SPOOL_BYTES
+        dehr_output.OUTPUT_SPOOL_BYTES = 10
+        try:
+            writer = OutputWriter(num_threads=0)
+            out_file = writer.open('big.html', self.path('big.html'))
+            for i in range(10):
+                out_file.write('0123456789')
+            self.assertNotEqual(out_file.temp_file, None)
+            self.assertEqual(out_file.chunks, [])
+            out_file.close()
+            self.assertEqual(self.read('big.html'), '0123456789' * 10)
+            self.assertEqual(os.listdir(self.temp_dir), ['big.html'])
+            
+            out_file = writer.open('big.html', self.path('big.html'))
+            out_file.write('0123456789' * 10)
+            self.assertFalse(out_file.close())
+            out_file = writer.open('bad.html', self.path('bad.html'))
+            out_file.write('0123456789' * 10)
+            out_file.discard()
+            self.assertEqual(os.listdir(self.temp_dir), ['big.html'])
+        finally:
+            dehr_output.OUTPUT_SPOOL_BYTES = spool_bytes
+    
+    def test_failed_write(self):
+        writer = OutputWriter()
+        out_file = writer.open('a.html', self.path('no_such_dir/a.html'))
+        out_file.write('A')
+        out_file.close()
+        with self.assertRaisesRegexp(OutputError, 'Could not write 1'):
+            writer.finish()
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
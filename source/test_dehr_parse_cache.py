@@ -0,0 +1,69 @@
+# File test_dehr_parse_cache.py
+
+from collections import OrderedDict
+import os
+import shutil
+import tempfile
+import unittest
+
+from dehr_parse_cache import *
+
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, PARSE_CACHE_DIRNAME)
+        self.meta_dict = OrderedDict([('Page type', ['Drug']), 
+                                      ('Brand names', ['Lexapro', 'Cipralex'])])
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_put_and_get(self):
+        cache = ParseCache(self.cache_dir)
+        key = cache.key("Lexapro\n\n-----\n\nAn SSRI.\n")
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, 'Lexapro', self.meta_dict, '<p>An SSRI.</p>')
+        title, meta_dict, content = ParseCache(self.cache_dir).get(key)
+        self.assertEqual(title, 'Lexapro')
+        self.assertEqual(meta_dict.items(), self.meta_dict.items())
+        self.assertEqual(content, '<p>An SSRI.</p>')
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(os.listdir(self.cache_dir), [key + SUFFIX])
+    
+    def test_key(self):
+        cache = ParseCache(self.cache_dir)
+        self.assertNotEqual(cache.key('A'), cache.key('B'))
+        other = ParseCache(self.cache_dir)
+        other.version = 'another parser'
+        self.assertNotEqual(cache.key('A'), other.key('A'))
+    
+    def test_broken_file_is_a_miss(self):
+        cache = ParseCache(self.cache_dir)
+        key = cache.key('A')
+        broken_file = open(cache.filepathname(key), 'wb')
+        broken_file.write('\x00not marshal')
+        broken_file.close()
+        self.assertEqual(cache.get(key), None)
+        self.assertEqual(cache.misses, 1)
+    
+    def test_prune_removes_least_recently_used(self):
+        cache = ParseCache(self.cache_dir)
+        keys = [cache.key(str(i)) for i in range(4)]
+        for i, key in enumerate(keys):
+            cache.put(key, 'Title', self.meta_dict, 'x' * 1000)
+            os.utime(cache.filepathname(key), (1000 + i, 1000 + i))
+        # Using the oldest file makes it the most recent:
+        cache.get(keys[0])
+        size = os.path.getsize(cache.filepathname(keys[0]))
+        cache.max_bytes = 2 * size
+        self.assertEqual(cache.prune(), 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), 
+                         sorted([keys[0] + SUFFIX, keys[3] + SUFFIX]))
+        self.assertEqual(cache.prune(), 0)
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
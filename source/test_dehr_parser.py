@@ -2,9 +2,26 @@
 
 from collections import OrderedDict
 from exceptions import IndexError
+import os
+import random
+from StringIO import StringIO
 import unittest
 
 from dehr_parser import *
+from dehr_synthetic import make_synthetic_page
+
+
+pages_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+def all_source_pages():
+    """Return a list of (page_filename, page_raw) for every source page"""
+    pages = []
+    for page_filename in sorted(os.listdir(pages_dir)):
+        if page_filename[-5:] == '.html':
+            page_file = open(os.path.join(pages_dir, page_filename), 'rb')
+            pages.append((page_filename, page_file.read()))
+            page_file.close()
+    return pages
 
 
 class RegexTest(unittest.TestCase):
@@ -105,6 +122,31 @@ class LexerTest(unittest.TestCase):
         with self.assertRaises(CrCharacterError):
             tokens = lexer(input)
     
+    def test_cr_error_has_every_position(self):
+        input = "Title\r\n\nFirst.\n\n\r\r Second."
+        with self.assertRaisesRegexp(CrCharacterError, 
+                                     'line 1, column 6: a CR character\n'
+                                     'line 5, column 1: a CR character\n'
+                                     'line 5, column 2: a CR character$'):
+            lexer(input)
+    
+    def test_normalize_source(self):
+        input = "Title\n\n\n\nK: V\n\n\n-----\n\n\tBody\t\n\n\n"
+        output, problems = normalize_source(input, '\r\t')
+        self.assertEqual(output, "Title\n\nK: V\n\n-----\n\n\tBody\t")
+        self.assertEqual(output, 
+                         deal_with_excess_newlines(
+                             deal_with_final_newlines(input)))
+        self.assertEqual([str(problem) for problem in problems], 
+                         ['line 10, column 1: a hard tab character', 
+                          'line 10, column 6: a hard tab character'])
+        # Only CR is forbidden by default:
+        self.assertEqual(normalize_source(input), (output, []))
+        # A clean page is not copied:
+        clean = "Title\n\nK: V\n\n-----\n\nBody."
+        self.assertTrue(normalize_source(clean)[0] is clean)
+        self.assertEqual(lexer(output, normalized=True), lexer(input))
+    
     def test_lexer_for_tags(self):
         input = "Foo.\n\n{% indent %}\n\nBar."
         tokens = lexer(input)
@@ -137,9 +179,191 @@ class LexerTest(unittest.TestCase):
             'b>Baz.',
             '<',
             '/b>'])
+    
+    
+    def test_lexer_body_region(self):
+        # Only [LF][LF] and the first token of each line split the body:
+        input = ("Title\n\nKey: A, B.\n\n-----\n\nFirst, then: <b>bold</b>."
+                 "\n\n<b>Line</b>, more.\n\n\\<i>Esc</i>, y.\n\n<nop>A, b"
+                 "\\\n\n<i>c</i>\n\n{% indent %}")
+        tokens = lexer(input)
+        self.assertEqual(tokens, [
+            'Title', '\n\n', 'Key', ': ', 'A', ', ', 'B.', '\n\n', '-----',
+            '\n\n',
+            'First, then: <b>bold</b>.',
+            '\n\n',
+            '<',
+            'b>Line</b>, more.',
+            '\n\n',
+            '\\<',
+            'i>Esc</i>, y.',
+            '\n\n',
+            '<nop>',
+            'A, b',
+            '\\\n\n',
+            '<i>c</i>',
+            '\n\n',
+            '{% indent %}'])
+        # Without a header, all of it is lexed as header:
+        self.assertEqual(body_start("<b>A</b>\n\nB, c."), None)
+        self.assertEqual(lexer("<b>A</b>\n\nB, c."), 
+                         ['<', 'b>A', '<', '/b>', '\n\n', 'B', ', ', 'c.'])
+    
+    def test_body_tokens_render_the_same(self):
+        # The same page, lexed with the header tokens everywhere, as it was 
+        # before the body had its own:
+        for page_filename, page_raw in all_source_pages():
+            page_str = deal_with_excess_newlines(
+                deal_with_final_newlines(page_raw))
+            nodes = []
+            for tokens in [lexer(page_raw), 
+                           scan_regex(page_str, HEADER_REGION, 0, 
+                                      len(page_str))]:
+                node = WholePageNode(tokens)
+                node.parse()
+                node.render()
+                nodes.append(node)
+            body_node, header_node = nodes
+            self.assertEqual(body_node.content, header_node.content)
+            self.assertEqual(body_node.meta_dict, header_node.meta_dict)
+            self.assertEqual(body_node.body_start, header_node.body_start)
+            self.assertTrue(len(body_node.tokens) <= len(header_node.tokens))
+
+
+class LexerEngineTest(unittest.TestCase):
+    """Every lexer engine must output the same tokens as the 'reslice' engine"""
+    
+    tricky_inputs = [
+        "x",
+        "<",
+        "Foo, bar: baz",
+        "Foo,bar:baz, : ,",
+        "\\<b>Escaped</b> and \\\n\nescaped newlines",
+        "---- four, five -----, six ------",
+        "<nop><nop><<{% indent %}{% endindent %}{% clearfix %}",
+        "{% indent%} {%indent %} {% link \"foo\" %}",
+        "Trailing backslash \\",
+        "Title\n\nKey: V1, V2.\n\n-----\n\nBody.\n\n\n\n\nMore.\n\n\n",
+        "Ti-----tle\n\nK: V.\n\n------\n\n<b>A</b>, b: c\n\n\\<\n\n<nop>\n\n<",
+        "Title\\\n\nStill: title\n\nK: V\n\n-----\n\n\\\n\n<i>, </i>\\\n\n<i>",
+    ]
+    
+    def assert_engines_agree(self, input_str):
+        expected = lexer(input_str, 'reslice')
+        expected_kinds = TokenStream.from_tokens(expected).kinds
+        for engine in LEXER_ENGINES:
+            message = "engine %r, input %r" % (engine, input_str[:60])
+            self.assertEqual(lexer(input_str, engine), expected, message)
+            tokens = lexer(input_str, engine, typed=True)
+            self.assertEqual(tokens.texts(), expected, message)
+            self.assertEqual(tokens.kinds, expected_kinds, message)
+    
+    def test_tricky_inputs(self):
+        for input_str in self.tricky_inputs:
+            self.assert_engines_agree(input_str)
+    
+    def test_source_pages(self):
+        for page_filename, page_raw in all_source_pages():
+            self.assert_engines_agree(page_raw)
+    
+    def test_synthetic_pages(self):
+        for seed in range(5):
+            self.assert_engines_agree(make_synthetic_page(20000, seed))
+    
+    def test_random_inputs(self):
+        # Strings made of the pieces of special tokens, so the engines see 
+        # every near miss, e.g. '<no', '----', '{% inde':
+        pieces = ['<', 'nop>', '\\', '\n', '-', '--', ',', ':', ' ', '{%', 
+                  ' indent %}', ' endindent %}', ' clearfix %}', 'x', 'Foo']
+        rng = random.Random(23)
+        for i in range(500):
+            input_str = 'x' + ''.join(rng.choice(pieces) 
+                                      for j in range(rng.randint(1, 40)))
+            self.assert_engines_agree(input_str)
+    
+    def test_unknown_engine(self):
+        with self.assertRaisesRegexp(ParserError, 'no lexer engine'):
+            lexer("Foo.", 'no_such_engine')
+
+
+class CountingFile(StringIO):
+    """A StringIO that remembers how many bytes were read from it"""
+    
+    def __init__(self, input_str):
+        StringIO.__init__(self, input_str)
+        self.bytes_read = 0
+    
+    def read(self, size=-1):
+        data = StringIO.read(self, size)
+        self.bytes_read += len(data)
+        return data
+
+
+class PageHeaderTest(unittest.TestCase):
+    """read_page_header() must agree with a full parse of the whole page"""
+    
+    tricky_inputs = [
+        "Title\n\nKey: V1, V2.\n\n-----\n\nBody.",
+        "Title\n\nKey: V1\n\n\n\n-----\n\n\n\n\nBody.\n\n",
+        "Title -----\n\nKey: V1\n\n-----\n\nBody.",
+        "Title\n\nKey: V1\n\n-----\n\n-----\n\nBody.",
+        "Title\n\nKey: <nop>V1, \\<b>\n\n-----\n\n<nop>Body.",
+    ]
+    
+    bad_inputs = [
+        "Title\n\nKey: ------\n\n-----\n\nBody.",
+        "Title\n\nKey: V1\n\n-----\n\n",
+        "Title\n\nKey: V1\n\n------\n\nBody.",
+        "Title\n\n-----\n\nBody.",
+        "Title\n\nKey: V1\n\nBody.",
+        "Title only",
+    ]
+    
+    def assert_same_header(self, input_str):
+        node = WholePageNode(lexer(input_str))
+        node.parse()
+        for block_size in [1, 3, 4096]:
+            title, meta_dict = read_page_header(StringIO(input_str), block_size)
+            self.assertEqual(title, node.title)
+            self.assertEqual(meta_dict, node.meta_dict)
+            self.assertTrue(type(meta_dict) is OrderedDict)
+    
+    def test_tricky_inputs(self):
+        for input_str in self.tricky_inputs:
+            self.assert_same_header(input_str)
+    
+    def test_source_pages(self):
+        for page_filename, page_raw in all_source_pages():
+            self.assert_same_header(page_raw)
+    
+    def test_same_errors(self):
+        for input_str in self.bad_inputs:
+            node = WholePageNode(lexer(input_str))
+            with self.assertRaises(ParserError) as full_error:
+                node.parse()
+            for block_size in [1, 3, 4096]:
+                with self.assertRaises(ParserError) as header_error:
+                    read_page_header(StringIO(input_str), block_size)
+                self.assertEqual(str(header_error.exception), 
+                                 str(full_error.exception))
+    
+    def test_body_is_not_read(self):
+        page = make_synthetic_page(2**20)
+        a_file = CountingFile(page)
+        title, meta_dict = read_page_header(a_file)
+        self.assertEqual(title, 'Synthetic Page %s' % 2**20)
+        self.assertEqual(a_file.bytes_read, HEADER_BLOCK_SIZE)
 
 
 class ParserTest(unittest.TestCase):
+    def test_iter_output_matches_render(self):
+        tokens = lexer(make_synthetic_page(2**16))
+        node = MultiParagraphNode(tokens, tokens.index('-----') + 2)
+        node.parse()
+        fragments = list(node.iter_output())
+        node.render()
+        self.assertEqual(fragments, node.output)
+    
     def test_parser(self):
         input = "<h1>Heading</h1>\n\nFirst.\n\nSecond.\n"
         tokens = lexer(input)
@@ -328,6 +552,90 @@ Third paragraph, end of file.
             OrderedDict([
                 ('KeyA', ['ValueA1', 'Foo']),
                 ('KeyB', ['ValueB1', 'Bar'])]))
+    
+    
+    def test_nodes_share_tokens(self):
+        input = "Title\n\nKey: A, B.\n\n-----\n\nFirst.\n\n<b>Second</b>"
+        tokens = lexer(input, typed=True)
+        node = WholePageNode(tokens)
+        node.parse()
+        for child in node.children:
+            self.assertTrue(child.tokens is tokens)
+        for child in node.children[3].children:
+            self.assertTrue(child.tokens is tokens)
+        self.assertEqual(node.children[2].input, ['Key', ': ', 'A', ', ', 'B.'])
+        self.assertEqual(node.children[3].input, 
+                         ['First.', '\n\n', '<', 'b>Second</b>'])
+    
+    def test_nodes_have_no_dict(self):
+        node = WholePageNode(lexer(make_synthetic_page(2**12)))
+        node.parse()
+        node.render()
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            # Every Node class declares __slots__:
+            self.assertFalse(hasattr(node, '__dict__'), type(node).__name__)
+            nodes.extend(node.children or [])
+    
+    def test_five_hyphens_right_after_title(self):
+        tokens = lexer("Title\n\n-----\n\nFirst.")
+        node = WholePageNode(tokens)
+        with self.assertRaisesRegexp(ParserError, 'NOT preceded'):
+            node.parse()
+    
+    def test_five_hyphens_at_the_end(self):
+        tokens = lexer("Title\n\nKey: Value\n\n-----")
+        node = WholePageNode(tokens)
+        with self.assertRaisesRegexp(ParserError, 'NOT followed'):
+            node.parse()
+    
+    def test_token_positions(self):
+        tokens = TokenStream.from_tokens(['a', '\n\n', 'b', '\n\n', 'c', 
+                                          '\n\n'])
+        self.assertEqual(token_positions(tokens, BREAK, 0, 6), [1, 3, 5])
+        self.assertEqual(token_positions(tokens, BREAK, 2, 5), [3])
+        self.assertEqual(token_positions(tokens, COLON, 0, 6), [])
+        self.assertEqual(positions_in_span([1, 3, 5], 2, 5), [3])
+    
+    def test_token_stream(self):
+        tokens = lexer("Title\n\nK: A, B.\n\n-----\n\n\\<i>x\\\n\ny</i>", 
+                       typed=True)
+        self.assertEqual(tokens.texts(), 
+                         ['Title', '\n\n', 'K', ': ', 'A', ', ', 'B.', '\n\n',
+                          '-----', '\n\n', '\\<', 'i>x', '\\\n\n', 'y</i>'])
+        self.assertEqual(list(tokens.kinds), 
+                         [TEXT, BREAK, TEXT, COLON, TEXT, COMMA, TEXT, BREAK, 
+                          SEPARATOR, BREAK, ESCAPED_LT, TEXT, ESCAPED_BREAK, 
+                          TEXT])
+        self.assertEqual(tokens.join(2, 7), 'K: A, B.')
+        self.assertEqual(tokens.find(SEPARATOR, 0, len(tokens)), 8)
+        self.assertEqual(tokens.find(SEPARATOR, 9, len(tokens)), -1)
+        self.assertEqual(list(iter_unescape_double_newline(tokens, 10, 14)), 
+                         ['\\<i>x', '\n\n', 'y</i>'])
+    
+    def test_typed_tokens_render_the_same(self):
+        for page_filename, page_raw in all_source_pages():
+            nodes = []
+            for tokens in [lexer(page_raw), lexer(page_raw, typed=True)]:
+                node = WholePageNode(tokens)
+                node.parse()
+                node.render()
+                nodes.append(node)
+            list_node, typed_node = nodes
+            self.assertEqual(typed_node.content, list_node.content)
+            self.assertEqual(typed_node.meta_dict, list_node.meta_dict)
+            self.assertEqual(typed_node.title, list_node.title)
+    
+    def test_parse_header(self):
+        for page_filename, page_raw in all_source_pages():
+            full_node = WholePageNode(lexer(page_raw))
+            full_node.parse()
+            header_node = WholePageNode(lexer(page_raw))
+            header_node.parse_header()
+            self.assertEqual(header_node.title, full_node.title)
+            self.assertEqual(header_node.meta_dict, full_node.meta_dict)
+            self.assertEqual(len(header_node.children), 3)
 
 
 #============================== If Name Is Main ===============================#
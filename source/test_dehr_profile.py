@@ -0,0 +1,105 @@
+# File test_dehr_profile.py
+
+import json
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import time
+import unittest
+
+from dehr_profile import *
+
+
+class SlowFile(object):
+    def write(self, data):
+        time.sleep(0.01)
+
+
+class PhaseTimerTest(unittest.TestCase):
+    def test_phases(self):
+        timer = PhaseTimer()
+        with timer.phase('lexer'):
+            pass
+        with timer.phase('django render'):
+            time.sleep(0.01)
+            timer.wrap_file(SlowFile()).write('x')
+        self.assertEqual([event[0] for event in timer.events], 
+                         ['lexer', 'django render', 'write'])
+        lexer, django_render, write = timer.events
+        self.assertTrue(django_render[2] >= 0.009)
+        self.assertTrue(write[2] >= 0.009)
+        # The write is taken out of the rendering, and comes right after it:
+        self.assertTrue(django_render[2] < 0.019)
+        self.assertAlmostEqual(django_render[1] + django_render[2], write[1])
+    
+    def test_null_timer(self):
+        a_file = StringIO()
+        with NULL_TIMER.phase('read'):
+            NULL_TIMER.wrap_file(a_file).write('x')
+        self.assertTrue(NULL_TIMER.wrap_file(a_file) is a_file)
+    
+    def test_phase_totals(self):
+        events = [['write', 0, 1.0], ['read', 1, 2.0], ['write', 3, 3.0]]
+        self.assertEqual(phase_totals(events).items(), 
+                         [('write', 4.0), ('read', 2.0)])
+
+
+class BuildProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.profile = BuildProfile()
+        with self.profile.build.phase('compile'):
+            for i, page_filename in enumerate(['a.html', 'b.html']):
+                timer = PhaseTimer()
+                timer.events = [['read', time.time(), 0.001 * (i + 1)], 
+                                ['lexer', time.time(), 0.002]]
+                self.profile.pages.append(page_timing(
+                    page_filename, time.time(), 0.01 * (i + 1), timer))
+        self.profile.finish()
+    
+    def test_slowest(self):
+        self.assertEqual([timing['page'] for timing in self.profile.slowest(1)], 
+                         ['b.html'])
+    
+    def test_json_dict(self):
+        json_dict = self.profile.to_json_dict()
+        self.assertEqual(json_dict['page_phases'].keys(), PAGE_PHASES)
+        self.assertAlmostEqual(json_dict['page_phases']['read'], 0.003)
+        self.assertAlmostEqual(json_dict['page_phases']['lexer'], 0.004)
+        self.assertEqual(json_dict['build_phases'].keys(), ['compile'])
+    
+    def test_chrome_trace(self):
+        trace_events = self.profile.to_chrome_trace()['traceEvents']
+        self.assertEqual([trace_event['name'] for trace_event in trace_events], 
+                         ['build', 'compile', 'a.html', 'read', 'lexer', 
+                          'b.html', 'read', 'lexer'])
+        for trace_event in trace_events:
+            self.assertEqual(trace_event['ph'], 'X')
+            self.assertTrue(trace_event['ts'] >= 0)
+        self.assertEqual(trace_events[3]['args'], {'page': 'a.html'})
+    
+    def test_save(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            report_filepath = os.path.join(temp_dir, 'report.json')
+            trace_filepath = os.path.join(temp_dir, 'trace.json')
+            self.profile.save(report_filepath, trace_filepath)
+            report = json.load(open(report_filepath))
+            self.assertEqual(len(report['pages']), 2)
+            trace = json.load(open(trace_filepath))
+            self.assertEqual(len(trace['traceEvents']), 8)
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test_summary(self):
+        summary = self.profile.summary(1)
+        self.assertIn('2 page(s) compiled', summary)
+        self.assertIn('Slowest 1 page(s)', summary)
+        self.assertIn('b.html', summary)
+        self.assertNotIn('a.html', summary)
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# File test_dehr_search.py
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dehr_search import *
+
+
+class TermsTest(unittest.TestCase):
+    def test_text_terms(self):
+        self.assertEqual(
+            text_terms('<p>\nThe {% link "heroin" "Smack" %} &amp; '
+                       '{{ page_title }} <b>5-HT</b> a\n</p>\n'),
+            ['the', 'heroin', 'smack', 'ht'])
+        self.assertEqual(text_terms('Caf\xc3\xa9 cr\xc3\xa8me'), 
+                         [u'caf\xe9', u'cr\xe8me'])
+    
+    def test_term_shard(self):
+        # The same as termShard() in templates/search_box.html:
+        self.assertEqual(term_shard(u'lexapro', 4096), 2440)
+        self.assertEqual(term_shard(u'\xe9t\xe9', 4096), 2939)
+        self.assertEqual(term_shard(u'\U0001F600x', 4096), 2624)
+    
+    def test_num_shards_for(self):
+        self.assertEqual(num_shards_for(1), 1)
+        self.assertEqual(num_shards_for(PAGES_PER_SHARD + 1), 2)
+        self.assertEqual(num_shards_for(10**9), MAX_SHARDS)
+
+
+class SearchIndexWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.search_dir = os.path.join(self.temp_dir, SEARCH_DIRNAME)
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def write_index(self, num_shards):
+        writer = SearchIndexWriter(self.search_dir, num_shards)
+        writer.add_page('Heroin', 'heroin.html', 
+                        '<p>\nAn opioid, also known as smack.\n</p>\n', 
+                        ['heroin', 'diamorphine'])
+        writer.add_page('Endogenous Opioids', 'endogenous_opioids.html', 
+                        '<p>\nOpioids made by the body.\n</p>\n', 
+                        ['endogenous opioids', 'endorphins'])
+        writer.finish()
+    
+    def test_search(self):
+        self.write_index(4)
+        self.assertEqual(sorted(os.listdir(self.search_dir)), 
+                         ['pages.json', 'shard_0.json', 'shard_1.json', 
+                          'shard_2.json', 'shard_3.json'])
+        self.assertEqual(search(self.search_dir, 'SMACK'), 
+                         [['Heroin', 'heroin.html']])
+        self.assertEqual(search(self.search_dir, 'diamorphine opioid'), 
+                         [['Heroin', 'heroin.html']])
+        self.assertEqual(search(self.search_dir, 'body smack'), [])
+        # The title counts more than the text:
+        self.assertEqual(search(self.search_dir, 'opioids')[0], 
+                         ['Endogenous Opioids', 'endogenous_opioids.html'])
+        shard_file = open(os.path.join(
+            self.search_dir, 'shard_%s.json' % term_shard(u'smack', 4)), 'rb')
+        self.assertEqual(json.load(shard_file)['smack'], [0, 1])
+        shard_file.close()
+    
+    def test_finish_replaces_old_index(self):
+        self.write_index(4)
+        self.write_index(1)
+        self.assertEqual(sorted(os.listdir(self.search_dir)), 
+                         ['pages.json', 'shard_0.json'])
+        self.assertEqual(os.listdir(self.temp_dir), [SEARCH_DIRNAME])
+    
+    def test_abort(self):
+        self.write_index(1)
+        writer = SearchIndexWriter(self.search_dir, 2)
+        writer.add_page('Heroin', 'heroin.html', 'Smack.', [])
+        writer.abort()
+        self.assertEqual(os.listdir(self.temp_dir), [SEARCH_DIRNAME])
+        self.assertEqual(search(self.search_dir, 'smack'), 
+                         [['Heroin', 'heroin.html']])
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
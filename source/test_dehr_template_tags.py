@@ -0,0 +1,79 @@
+# File test_dehr_template_tags.py
+
+import unittest
+
+from build import AllPageData, BASE_DIR, Context, compile_page_body, make_engine
+from dehr_template_tags import *
+
+
+BODIES = [
+    '<p>\n{% link "Cocaine" %} {% link \'coke\' "Coke" %} {% link "x" "" %}\n'
+    '</p>\n\n{% indent %}\n\n{% wiki "heroin" "smack" %}{%clearfix%}\n\n'
+    '{% endindent %}',
+    # Left to Django: a backslash, braces, a variable, too many arguments:
+    '{% link "say \\"hi\\"" %} {% wiki "{{ x }}" %} {% link who %} '
+    '{{ who }} {# {% link "nowhere" %} #}',
+    # Verbatim blocks are text:
+    '{% verbatim %}{% link "cocaine" %}{% endverbatim %} {% link "cocaine" %}',
+    # A link in an {% if %} that is false must not be looked up:
+    '{% if who %}{% link "nowhere" %}{% endif %}{% wiki "heroin" %}',
+]
+
+
+class ExpandStaticTagsTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = make_engine(BASE_DIR)
+    
+    def make_apd(self):
+        apd = AllPageData()
+        apd.add_alias('Cocaine', 'cocaine.html')
+        apd.add_alias('Coke', 'cocaine.html')
+        apd.prior.aliases = apd.next.aliases.copy()
+        apd.lookups = {}
+        return apd
+    
+    def render(self, body, static):
+        apd = self.make_apd()
+        if static:
+            template = compile_page_body(self.engine, body, apd)
+        else:
+            template = compile_page_body(self.engine, body)
+        return template.render(Context({'apd': apd, 'who': ''})), apd.lookups
+    
+    def test_same_output_and_lookups_as_django(self):
+        for body in BODIES:
+            self.assertEqual(self.render(body, True), self.render(body, False))
+    
+    def test_only_literal_tags_are_expanded(self):
+        apd = self.make_apd()
+        self.assertEqual(
+            expand_static_tags(BODIES[0], apd),
+            '<p>\n<a href="cocaine.html">Cocaine</a> '
+            '<a href="cocaine.html">Coke</a> <u>x [broken link]</u>\n</p>\n\n'
+            '<div class="indent">\n\n<a target="_blank" href="%s">smack</a>'
+            '<div class="clearfix">.</div>\n\n</div> <!-- div.indent -->' % 
+            (WIKI_URL % 'heroin'))
+        self.assertEqual(expand_static_tags(BODIES[1], apd), BODIES[1])
+        self.assertEqual(
+            expand_static_tags(BODIES[2], apd), 
+            '{% verbatim %}{% link "cocaine" %}{% endverbatim %} '
+            '<a href="cocaine.html">cocaine</a>')
+        # Not expanded, the {% if %} decides:
+        self.assertTrue('{% link "nowhere" %}' in 
+                        expand_static_tags(BODIES[3], apd))
+        self.assertFalse('nowhere' in apd.lookups)
+        # Django raises the TemplateSyntaxError:
+        self.assertEqual(expand_static_tags('{% %}{{ %}', apd), '{% %}{{ %}')
+    
+    def test_split_template(self):
+        self.assertEqual(split_template('a{{ b }}{% c %}{% verbatim %}{% d %}'
+                                        '{% endverbatim %}'),
+                         [['text', 'a'], ['other', '{{ b }}'], 
+                          ['block', '{% c %}'], ['block', '{% verbatim %}'], 
+                          ['text', '{% d %}'], ['block', '{% endverbatim %}']])
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()
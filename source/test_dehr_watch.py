@@ -0,0 +1,125 @@
+# File test_dehr_watch.py
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+
+from dehr_watch import *
+
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def write_file(self, filename, text):
+        a_file = open(os.path.join(self.temp_dir, filename), 'wb')
+        a_file.write(text)
+        a_file.close()
+    
+    def check_watcher(self, watcher):
+        try:
+            self.assertEqual(watcher.changes(0.01), set())
+            self.write_file('a.html', 'A\n')
+            self.assertEqual(watcher.changes(5), 
+                             set([(self.temp_dir, 'a.html')]))
+            # An editor that saves to a temporary file, then renames it:
+            self.write_file('.a.html.tmp', 'Longer A\n')
+            os.rename(os.path.join(self.temp_dir, '.a.html.tmp'),
+                      os.path.join(self.temp_dir, 'a.html'))
+            self.assertTrue((self.temp_dir, 'a.html') in watcher.changes(5))
+            os.remove(os.path.join(self.temp_dir, 'a.html'))
+            self.assertEqual(watcher.changes(5), 
+                             set([(self.temp_dir, 'a.html')]))
+        finally:
+            watcher.close()
+    
+    def test_polling_watcher(self):
+        self.check_watcher(PollingWatcher([self.temp_dir]))
+    
+    def test_inotify_watcher(self):
+        try:
+            watcher = InotifyWatcher([self.temp_dir])
+        except WatchError:
+            raise unittest.SkipTest("inotify is not available.")
+        self.check_watcher(watcher)
+    
+    def test_make_watcher(self):
+        watcher = make_watcher([self.temp_dir])
+        watcher.close()
+        self.assertTrue(type(watcher) in [InotifyWatcher, PollingWatcher])
+
+
+class ReloadServerTest(unittest.TestCase):
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        html_file = open(os.path.join(self.build_dir, 'page.html'), 'wb')
+        html_file.write('<html><body>Page</body></html>')
+        html_file.close()
+        self.server = ReloadServer(('127.0.0.1', 0), self.build_dir)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.build_dir)
+    
+    def get(self, path):
+        return urllib2.urlopen(self.url + path, timeout=10).read()
+    
+    def test_page_has_reload_script(self):
+        html = self.get('/page.html')
+        self.assertTrue(html.startswith('<html><body>Page<script>'))
+        self.assertTrue(html.endswith('})(0);\n</script>\n</body></html>'))
+        # The file itself is not changed:
+        html_file = open(os.path.join(self.build_dir, 'page.html'), 'rb')
+        self.assertEqual(html_file.read(), '<html><body>Page</body></html>')
+        html_file.close()
+    
+    def test_no_files_outside_build_dir(self):
+        with self.assertRaises(urllib2.HTTPError):
+            self.get('/../' + os.path.basename(self.build_dir) + '/nothing')
+        with self.assertRaises(urllib2.HTTPError):
+            self.get('/missing.html')
+    
+    def test_reload(self):
+        timer = threading.Timer(0.1, self.server.notify)
+        timer.start()
+        start = time.time()
+        self.assertEqual(self.get('/__reload?version=0'), '1')
+        self.assertTrue(time.time() - start < 5)
+        # Already out of date, no waiting:
+        self.assertEqual(self.get('/__reload?version=0'), '1')
+        self.assertTrue('})(1);' in self.get('/page.html'))
+    
+    def test_add_reload_script(self):
+        self.assertEqual(add_reload_script('<p>No body</p>', 3),
+                         '<p>No body</p>' + RELOAD_SCRIPT % 3)
+
+
+class FilenameTest(unittest.TestCase):
+    def test_is_page(self):
+        self.assertTrue(is_page('lexapro.html'))
+        self.assertFalse(is_page('.lexapro.html'))
+        self.assertFalse(is_page('lexapro.html.swp'))
+    
+    def test_is_template(self):
+        self.assertTrue(is_template('base.html'))
+        self.assertFalse(is_template('.base.html.swp'))
+        self.assertFalse(is_template('base.html~'))
+        self.assertFalse(is_template('#base.html#'))
+
+
+#============================== If Name Is Main ===============================#
+
+if __name__ == '__main__':
+    unittest.main()